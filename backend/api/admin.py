@@ -1,5 +1,12 @@
-from django.contrib import admin
-from .models import Category, Product, BusinessLunch, Order, Reservation
+from django import forms
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import redirect, render
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
+from django.utils.http import urlencode
+from . import ledger, order_lines
+from .models import Category, Product, BusinessLunch, Order, ArchivedOrder, Reservation
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -12,10 +19,45 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ('category', 'is_popular')
     search_fields = ('title', 'description')
 
+class LunchImportForm(forms.Form):
+    file = forms.FileField(label="Файл расписания (CSV или XLSX)")
+
 @admin.register(BusinessLunch)
 class BusinessLunchAdmin(admin.ModelAdmin):
     list_display = ('date', 'created_at')
     ordering = ('-date',)
+    change_list_template = 'admin/api/businesslunch/change_list.html'
+
+    def get_urls(self):
+        urls = [
+            path('import/', self.admin_site.admin_view(self.import_view), name='api_businesslunch_import'),
+        ]
+        return urls + super().get_urls()
+
+    def import_view(self, request):
+        from .lunch_import import LunchImportError, import_schedule
+
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            raise PermissionDenied
+
+        form = LunchImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                count = import_schedule(upload.file, upload.name)
+            except LunchImportError as e:
+                form.add_error('file', str(e))
+            else:
+                self.message_user(request, f"Импортировано дней: {count}", messages.SUCCESS)
+                return redirect('admin:api_businesslunch_changelist')
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': "Импорт бизнес-ланчей",
+            'opts': self.model._meta,
+            'form': form,
+        }
+        return render(request, 'admin/api/businesslunch/import_form.html', context)
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
@@ -25,37 +67,79 @@ class OrderAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at', 'formatted_items')
     actions = ['set_kitchen', 'set_delivery', 'set_completed']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('lines')
+
     def formatted_items(self, obj):
-        import json
-        from django.utils.html import format_html
-        try:
-            items = json.loads(obj.items)
-            html = "<ul style='margin: 0; padding-left: 15px;'>"
-            for item in items:
-                html += f"<li><b>{item.get('title')}</b> x{item.get('quantity')} — {item.get('price')} ₽</li>"
-            html += "</ul>"
-            return format_html(html)
-        except:
-            return "Ошибка отображения"
+        lines = obj.lines.all()
+        if lines:
+            return items_html([(line.title, line.quantity, line.unit_price) for line in lines])
+        # Old order that backfill_order_lines hasn't reached yet
+        return items_html(obj.items)
     
     formatted_items.short_description = "Состав заказа"
 
+    def changelist_view(self, request, extra_context=None):
+        # Old orders are in the archive: say how many of them match the search too
+        query = request.GET.get('q', '').strip()
+        if query:
+            archived, _ = self.get_search_results(request, ArchivedOrder.objects.all(), query)
+            count = archived.count()
+            if count:
+                url = reverse('admin:api_archivedorder_changelist') + '?' + urlencode({'q': query})
+                self.message_user(request, format_html(
+                    'В архиве найдено еще заказов: {}. <a href="{}">Показать</a>', count, url,
+                ))
+        return super().changelist_view(request, extra_context)
+
     @admin.action(description="На кухню")
     def set_kitchen(self, request, queryset):
-        queryset.update(status='kitchen')
+        ledger.set_status(queryset, 'kitchen')
 
     @admin.action(description="В доставку")
     def set_delivery(self, request, queryset):
-        queryset.update(status='delivery')
+        ledger.set_status(queryset, 'delivery')
 
     @admin.action(description="Выполнен")
     def set_completed(self, request, queryset):
-        queryset.update(status='completed')
+        ledger.set_status(queryset, 'completed')
+
+def items_html(items):
+    """Order contents as a list: (title, quantity, price) tuples or the Order.items JSON."""
+    if isinstance(items, str):
+        items = [(title, quantity, price) for _, title, quantity, price in order_lines.parse_items(items)]
+    if not items:
+        return "Ошибка отображения"
+    return format_html(
+        "<ul style='margin: 0; padding-left: 15px;'>{}</ul>",
+        format_html_join('', "<li><b>{}</b> x{} — {} ₽</li>", items),
+    )
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    # Read-only: archived orders are history (`manage.py archive_orders`)
+    list_display = ('id', 'name', 'phone', 'total_price', 'status', 'formatted_items', 'created_at', 'archived_at')
+    list_filter = ('status', 'created_at')
+    search_fields = OrderAdmin.search_fields
+    date_hierarchy = 'created_at'
+
+    def formatted_items(self, obj):
+        return items_html(obj.items)
+
+    formatted_items.short_description = "Состав заказа"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 @admin.register(Reservation)
 class ReservationAdmin(admin.ModelAdmin):
-    list_display = ('name', 'phone', 'date', 'time', 'guests', 'created_at')
-    list_filter = ('date', 'created_at')
+    list_display = ('name', 'phone', 'date', 'time', 'guests', 'table', 'status', 'created_at')
+    list_filter = ('status', 'date', 'created_at')
+    # Cancelling frees the table for the site's availability (api/slots.py)
+    list_editable = ('status',)
     search_fields = ('name', 'phone')
 
 from .models import BanquetMenu
@@ -66,3 +150,17 @@ class BanquetMenuAdmin(admin.ModelAdmin):
     list_filter = ('category', 'is_active', 'layout_type')
     list_editable = ('order', 'is_active', 'category')
     search_fields = ('title', 'description')
+
+
+from .models import PaymentEvent
+
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'outcome', 'order', 'payment_id', 'amount')
+    list_filter = ('outcome', 'created_at')
+    search_fields = ('payment_id', 'order__id')
+    list_select_related = ('order',)
+    readonly_fields = ('order', 'payment_id', 'amount', 'outcome', 'payload', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
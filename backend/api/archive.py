@@ -0,0 +1,90 @@
+"""
+Hot/cold split of orders: the live Order table and ArchivedOrder.
+
+The dashboard and the order admin read Order, which used to
+keep every order forever. `manage.py archive_orders` moves completed and
+cancelled orders older than ARCHIVE_ORDERS_AFTER_DAYS into ArchivedOrder
+(optionally a separate database, see api/routers.py), ARCHIVE_BATCH_SIZE
+orders per transaction, keeping their ids. Live ids are never handed out
+again (AUTOINCREMENT on SQLite, sequences elsewhere), so an archived id
+stays unique.
+
+A move writes the archive copy first and then deletes the live row, so an
+interrupted run leaves at most a batch in both places. Rerunning finishes
+it, and readers prefer the live row in the meantime. The delete sends no
+post_delete, because archiving isn't cancelling: the revenue ledger and the
+sales rollups keep counting archived orders. Their OrderLine rows stay as
+they are (OrderLine.order has no database constraint and the archived copy
+keeps the id), so per-dish figures still count them. Payment events lose
+the link but keep the payment id.
+
+Readers that need the whole history query both tables: the profile order
+list (pagination.page() merges them), get_order(), the order search in the
+admin, reconciliation and sales.rebuild().
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+
+from .models import ArchivedOrder, Order, PaymentEvent
+
+ARCHIVABLE_STATUSES = ('completed', 'cancelled')
+
+FIELDS = [field.attname for field in Order._meta.concrete_fields]
+
+
+def cutoff_for(days):
+    return timezone.now() - timedelta(days=days)
+
+
+def candidates(cutoff):
+    return Order.objects.filter(status__in=ARCHIVABLE_STATUSES, created_at__lt=cutoff)
+
+
+def raw_delete(queryset):
+    """
+    One DELETE for the queryset: no cascade collection and no delete signals.
+    QuerySet._raw_delete() is private Django API, check it on every Django
+    upgrade.
+    """
+    return queryset._raw_delete(queryset.db)
+
+
+def archive_batch(cutoff, batch_size):
+    """Moves up to batch_size orders older than cutoff. Returns how many were moved."""
+    with transaction.atomic():
+        rows = list(candidates(cutoff).order_by()[:batch_size].values(*FIELDS))
+        if not rows:
+            return 0
+        ids = [row['id'] for row in rows]
+
+        archived_at = timezone.now()
+        with transaction.atomic(using=router.db_for_write(ArchivedOrder)):
+            ArchivedOrder.objects.bulk_create(
+                [ArchivedOrder(archived_at=archived_at, **row) for row in rows],
+                ignore_conflicts=True,  # left over from an interrupted run
+            )
+
+        PaymentEvent.objects.filter(order_id__in=ids).update(order=None)
+        # Straight DELETE: the post_delete handlers would take the orders
+        # out of the revenue ledger and the sales rollups, and the cascade
+        # would take their lines
+        raw_delete(Order.objects.filter(pk__in=ids))
+    return len(ids)
+
+
+def archive(days=None, batch_size=None):
+    """Archives every eligible order, one batch per transaction. Returns the count."""
+    cutoff = cutoff_for(settings.ARCHIVE_ORDERS_AFTER_DAYS if days is None else days)
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    total = 0
+    while moved := archive_batch(cutoff, batch_size):
+        total += moved
+    return total
+
+
+def get_order(**filters):
+    """The live order matching filters, else its archived copy, else None."""
+    return Order.objects.filter(**filters).first() or ArchivedOrder.objects.filter(**filters).first()
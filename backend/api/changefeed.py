@@ -0,0 +1,89 @@
+"""
+Change tokens for the admin long-poll (views.poll_changes).
+
+Three counters live in the cache: orders and reservations (seeded with the
+table's MAX(id), then bumped for every created row) and status changes of
+existing orders. Signals bump them after commit, so "anything new?" is a
+cache read and a waiting admin tab never touches the database. The token
+"orders.reservations.status" is the client's high-water mark.
+
+The per-process cache only sees changes made by the same process. That is
+all of them with one server process, otherwise set REDIS_URL. Without
+either (CHANGEFEED_SHARED off) the polls read latest() from the tables.
+"""
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import Max
+
+from .models import Order, Reservation
+
+ORDERS = 'changefeed:orders'
+RESERVATIONS = 'changefeed:reservations'
+STATUS = 'changefeed:status'
+KEYS = (ORDERS, RESERVATIONS, STATUS)
+
+
+def seed():
+    # After a restart or eviction, add() keeps whatever another worker set first
+    cache.add(ORDERS, Order.objects.aggregate(top=Max('id'))['top'] or 0, None)
+    cache.add(RESERVATIONS, Reservation.objects.aggregate(top=Max('id'))['top'] or 0, None)
+    cache.add(STATUS, 0, None)
+
+
+def bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        seed()
+        cache.incr(key)
+
+
+def current():
+    values = cache.get_many(KEYS)
+    if len(values) < len(KEYS):
+        seed()
+        values = cache.get_many(KEYS)
+    return tuple(values.get(key, 0) for key in KEYS)
+
+
+def latest():
+    """Counters from the tables, for when the cache misses other processes' changes."""
+    return (
+        Order.objects.aggregate(top=Max('id'))['top'] or 0,
+        Reservation.objects.aggregate(top=Max('id'))['top'] or 0,
+        cache.get(STATUS, 0),
+    )
+
+
+async def acurrent():
+    values = await cache.aget_many(KEYS)
+    if len(values) < len(KEYS):
+        return await sync_to_async(current)()
+    return tuple(values[key] for key in KEYS)
+
+
+def format_token(counters):
+    return '.'.join(str(value) for value in counters)
+
+
+def parse_token(token):
+    try:
+        counters = tuple(int(part) for part in (token or '').split('.'))
+    except ValueError:
+        return None
+    return counters if len(counters) == len(KEYS) else None
+
+
+def changes(since, counters):
+    """Response for a client at `since` (None for its first request)."""
+    orders, reservations, statuses = (
+        (max(now - then, 0) for now, then in zip(counters, since)) if since else (0, 0, 0)
+    )
+    return {
+        'token': format_token(counters),
+        'changed': since is not None and counters != since,
+        'new_orders': orders,
+        'new_reservations': reservations,
+        'status_changes': statuses,
+        'play_sound': orders > 0 or reservations > 0,
+    }
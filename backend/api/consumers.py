@@ -0,0 +1,21 @@
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from . import events
+
+
+class AdminOrdersConsumer(AsyncJsonWebsocketConsumer):
+    """Pushes new orders and reservations to staff (see events.py)."""
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_staff:
+            await self.close(code=4403)
+            return
+        await self.channel_layer.group_add(events.GROUP, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(events.GROUP, self.channel_name)
+
+    async def admin_event(self, message):
+        await self.send_json(message['payload'])
@@ -0,0 +1,46 @@
+"""
+Live admin notifications.
+
+Order and reservation signals call publish() after commit; the event is fanned
+out through the channel layer to every staff browser connected to
+ws/admin/orders/ (see consumers.py). The layer is in-process by default
+(CHANNEL_LAYERS in settings), which only reaches sockets served by the same
+process; set REDIS_URL to fan out across workers. Admin pages fall back to
+polling check-new/ when the socket can't be opened.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+GROUP = 'admin-orders'
+
+
+def order_event(order):
+    return {
+        'event': 'order',
+        'id': order.pk,
+        'name': order.name,
+        'total_price': int(order.total_price or 0),
+        'payment_method': order.payment_method,
+    }
+
+
+def reservation_event(reservation):
+    return {
+        'event': 'reservation',
+        'id': reservation.pk,
+        'name': reservation.name,
+        'date': str(reservation.date),
+        'time': str(reservation.time)[:5],
+        'guests': reservation.guests,
+    }
+
+
+def publish(payload):
+    # A broker outage must never fail the order itself, pollers still see it
+    try:
+        layer = get_channel_layer()
+        if layer is None:
+            return
+        async_to_sync(layer.group_send)(GROUP, {'type': 'admin.event', 'payload': payload})
+    except Exception as e:
+        print(f"Admin event publish failed: {e}")
@@ -0,0 +1,124 @@
+"""
+HyperLogLog sketch for counting unique visitors.
+
+One sketch per day is stored on DailyStats.visitor_sketch instead of a
+DailyVisitor row per IP. Sketches merge by taking the register-wise maximum,
+so workers can each add their own visitors and a week or month is simply the
+union of its days.
+
+While a day has few visitors the sketch stays exact: it keeps the 64-bit
+hashes themselves (8 bytes each) and switches to 2**P registers (one byte
+each) once it has more than TRAFFIC_EXACT_VISITORS of them. With P = 12 the
+dense sketch is 4 KB and the standard error is about 1.04 / sqrt(4096) = 1.6%.
+
+Serialized form: b'E' + sorted hashes, or b'H' + precision byte + registers.
+"""
+import hashlib
+import math
+import struct
+
+from django.conf import settings
+
+P = 12
+
+EXACT, DENSE = b'E', b'H'
+
+
+def hash_value(value):
+    digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def exact_limit():
+    # By default the exact form stays until it is as big as the dense one
+    return getattr(settings, 'TRAFFIC_EXACT_VISITORS', (1 << P) // 8)
+
+
+class VisitorSketch:
+    def __init__(self, precision=P):
+        self.precision = precision
+        self.hashes = set()
+        self.registers = None
+
+    @property
+    def is_exact(self):
+        return self.registers is None
+
+    def add(self, value):
+        self.add_hash(hash_value(value))
+
+    def add_hash(self, h):
+        if self.registers is None:
+            self.hashes.add(h)
+            if len(self.hashes) > exact_limit():
+                self._densify()
+            return
+        p = self.precision
+        index = h >> (64 - p)
+        rest = h & ((1 << (64 - p)) - 1)
+        # Position of the first 1 bit in the remaining 64 - p bits
+        rank = (64 - p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def _densify(self):
+        hashes, self.hashes = self.hashes, set()
+        self.registers = bytearray(1 << self.precision)
+        for h in hashes:
+            self.add_hash(h)
+
+    def update(self, other):
+        """Merges another sketch into this one (union of the visitor sets)."""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with different precision")
+        if other.registers is None:
+            for h in other.hashes:
+                self.add_hash(h)
+            return
+        if self.registers is None:
+            self._densify()
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def __len__(self):
+        return self.count()
+
+    def count(self):
+        if self.registers is None:
+            return len(self.hashes)
+
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction: linear counting is more accurate here
+            estimate = m * math.log(m / zeros)
+        # 64-bit hashes make the large range correction unnecessary
+        return int(round(estimate))
+
+    def to_bytes(self):
+        if self.registers is None:
+            return EXACT + b''.join(struct.pack('>Q', h) for h in sorted(self.hashes))
+        return DENSE + bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data:
+            return cls()
+        data = bytes(data)
+        if data[:1] == EXACT:
+            sketch = cls()
+            sketch.hashes = {h for (h,) in struct.iter_unpack('>Q', data[1:])}
+            return sketch
+        if data[:1] == DENSE:
+            sketch = cls(precision=data[1])
+            sketch.registers = bytearray(data[2:])
+            return sketch
+        raise ValueError("Unknown sketch format")
+
+    @classmethod
+    def union(cls, sketches):
+        merged = cls()
+        for sketch in sketches:
+            merged.update(sketch)
+        return merged
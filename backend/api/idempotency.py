@@ -0,0 +1,110 @@
+"""
+Idempotency-Key support for create endpoints (orders, reservations).
+
+Mobile clients retry a POST after a timeout, each retry used to create
+another order. With the header set, the first request claims the key
+(a row in IdempotencyKey) and stores its successful response; repeats get
+that response back without running the view. A duplicate that arrives
+while the first one is still running waits for it instead of doing the
+work twice.
+
+Only 2xx responses are kept: after a validation error or a crash the key
+is released and the client can retry with it. Keys expire after
+IDEMPOTENCY_TTL and are purged as new ones come in.
+"""
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.1
+
+
+def claim(key, fingerprint):
+    """None if this request now owns the key, otherwise the row that holds it (or None if it just vanished)."""
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(key=key, fingerprint=fingerprint, created_at=timezone.now())
+        return None
+    except IntegrityError:
+        return IdempotencyKey.objects.filter(key=key).first() or False
+
+
+def is_abandoned(row, now):
+    if row.status_code is None:
+        return row.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+    return row.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_TTL)
+
+
+def replay(row):
+    response = Response(json.loads(row.response), status=row.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def purge_expired():
+    IdempotencyKey.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_TTL)
+    ).delete()
+
+
+def idempotent(scope):
+    """For @api_view POST views: honours the Idempotency-Key header, see module docstring."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            header = request.headers.get(HEADER)
+            if not header:
+                return view(request, *args, **kwargs)
+            if len(header) > MAX_KEY_LENGTH:
+                return Response({"error": "Некорректный Idempotency-Key"}, status=400)
+
+            key = hashlib.sha256(f"{scope}:{header}".encode()).hexdigest()
+            fingerprint = hashlib.sha256(request.body).hexdigest()
+            deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+
+            while True:
+                row = claim(key, fingerprint)
+                if row is None:
+                    break
+                if row is False:
+                    continue
+                if is_abandoned(row, timezone.now()):
+                    IdempotencyKey.objects.filter(key=key, created_at=row.created_at).delete()
+                    continue
+                if row.fingerprint != fingerprint:
+                    return Response({"error": "Idempotency-Key уже использован для другого запроса"}, status=422)
+                if row.status_code is not None:
+                    return replay(row)
+                if time.monotonic() >= deadline:
+                    return Response({"error": "Запрос уже обрабатывается, повторите позже"}, status=409)
+                time.sleep(POLL_INTERVAL)
+
+            purge_expired()
+            try:
+                response = view(request, *args, **kwargs)
+            except Exception:
+                IdempotencyKey.objects.filter(key=key).delete()
+                raise
+
+            if 200 <= response.status_code < 300:
+                IdempotencyKey.objects.filter(key=key).update(
+                    status_code=response.status_code,
+                    response=json.dumps(response.data, cls=DjangoJSONEncoder, ensure_ascii=False),
+                )
+            else:
+                IdempotencyKey.objects.filter(key=key).delete()
+            return response
+        return wrapper
+    return decorator
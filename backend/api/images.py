@@ -0,0 +1,168 @@
+"""
+Responsive image derivatives for uploaded photos.
+
+Uploads are often multi-megabyte phone photos, so after a Product or
+BanquetMenu is saved we render a few smaller widths in WebP and JPEG in a
+background thread pool. Files are content-addressed (named after the hash of
+the original), so re-uploading the same photo or re-running the backfill
+command does no extra work.
+
+The result is stored on the model in `image_derivatives`:
+
+    {"image": {"source": "products/ribs.jpg", "digest": "...",
+               "webp": {"320": "derivatives/ab/abcd.../320.webp", ...},
+               "jpeg": {"320": "derivatives/ab/abcd.../320.jpg", ...}}}
+"""
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+
+from .models import Product, BanquetMenu
+
+# Image fields that get derivatives, per model
+IMAGE_FIELDS = {
+    Product: ['image'],
+    BanquetMenu: ['cover_image', 'content_image'],
+}
+
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def get_widths():
+    return sorted(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', [320, 640, 1280]))
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2),
+                thread_name_prefix='image-derivatives',
+            )
+        return _executor
+
+
+def stale_fields(instance):
+    """Image fields whose derivatives are missing or belong to an older upload."""
+    derivatives = instance.image_derivatives or {}
+    stale = []
+    for field in IMAGE_FIELDS[type(instance)]:
+        file = getattr(instance, field)
+        if file and derivatives.get(field, {}).get('source') != file.name:
+            stale.append(field)
+    return stale
+
+
+def render_derivatives(file):
+    """Writes every width/format of `file` to storage and returns the map for it."""
+    from PIL import Image, ImageOps
+
+    file.open('rb')
+    try:
+        data = file.read()
+    finally:
+        file.close()
+
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    prefix = f"derivatives/{digest[:2]}/{digest}/"
+    result = {'source': file.name, 'digest': digest}
+
+    with Image.open(io.BytesIO(data)) as original:
+        # Phone photos are often stored rotated with an EXIF flag
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+        # Never upscale: widths above the original collapse into the original width
+        widths = [w for w in get_widths() if w < image.width] + [min(image.width, get_widths()[-1])]
+
+        for key, (pil_format, ext, options) in FORMATS.items():
+            result[key] = {}
+            for width in sorted(set(widths)):
+                name = f"{prefix}{width}.{ext}"
+                if not default_storage.exists(name):
+                    height = max(1, round(image.height * width / image.width))
+                    resized = image.resize((width, height), Image.Resampling.LANCZOS)
+                    if pil_format == 'JPEG' and resized.mode != 'RGB':
+                        resized = resized.convert('RGB')
+                    buffer = io.BytesIO()
+                    resized.save(buffer, pil_format, **options)
+                    default_storage.save(name, ContentFile(buffer.getvalue()))
+                result[key][str(width)] = name
+    return result
+
+
+def generate(model, pk, force=False, mark_menu=True):
+    """
+    Renders derivatives for one row. Runs in the worker pool or the backfill
+    command; the latter passes mark_menu=False and rebuilds the menu snapshot
+    once for all products instead of once per product.
+    """
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        if instance is None:
+            return False
+
+        fields = IMAGE_FIELDS[model] if force else stale_fields(instance)
+        fields = [field for field in fields if getattr(instance, field)]
+        if not fields:
+            return False
+
+        derivatives = dict(instance.image_derivatives or {})
+        for field in fields:
+            derivatives[field] = render_derivatives(getattr(instance, field))
+
+        # update() instead of save(): no signals, so no re-scheduling loop
+        model.objects.filter(pk=pk).update(image_derivatives=derivatives)
+        if model is Product and mark_menu:
+            # srcset is part of the menu payload
+            from . import menu_snapshot
+            menu_snapshot.mark_dirty('product', pk)
+        return True
+    finally:
+        close_old_connections()
+
+
+def schedule(instance):
+    """Queues derivative rendering for `instance` once the save is committed."""
+    if not stale_fields(instance):
+        return
+    model, pk = type(instance), instance.pk
+    transaction.on_commit(lambda: get_executor().submit(_generate_logged, model, pk))
+
+
+def _generate_logged(model, pk):
+    try:
+        generate(model, pk)
+    except Exception:
+        # Broken upload should not kill the pool; original image is still served
+        logger.exception("Image derivative error for %s #%s", model.__name__, pk)
+
+
+def srcset(instance, field):
+    """{"webp": {"320": url, ...}, "jpeg": {...}} for the current upload, or None."""
+    file = getattr(instance, field)
+    entry = (instance.image_derivatives or {}).get(field)
+    if not file or not entry or entry.get('source') != file.name:
+        return None
+    return {
+        key: {width: default_storage.url(name) for width, name in entry[key].items()}
+        for key in FORMATS
+        if key in entry
+    }
@@ -0,0 +1,69 @@
+"""
+Revenue ledger: running revenue and order count per day (RevenueLedger).
+
+Every order that isn't cancelled counts towards the local day it was placed.
+Order signals apply the difference between what an order contributed before
+and after a save (see saved_state()), so cancelling an order reverses its
+entry, un-cancelling brings it back and a corrected total_price is adjusted.
+The dashboard reads all-time revenue from these rows instead of summing the
+whole Order table.
+
+QuerySet.update() sends no signals: change statuses with set_status().
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Order, RevenueLedger
+
+NOTHING = (Decimal(0), 0)
+
+
+def contribution(status, total_price):
+    if status == 'cancelled' or total_price is None:
+        return NOTHING
+    return Decimal(total_price), 1
+
+
+def saved_state(order):
+    """pre_save: the order as it is in the database before this save (None for new orders)."""
+    if order._state.adding or order.pk is None:
+        return None
+    return Order.objects.filter(pk=order.pk).values('status', 'total_price', 'payment_method', 'items').first()
+
+
+def record(order, before):
+    """post_save: books the difference against the state from saved_state()."""
+    old = contribution(before['status'], before['total_price']) if before else NOTHING
+    new = contribution(order.status, order.total_price)
+    apply(order.created_at, new[0] - old[0], new[1] - old[1])
+
+
+def record_delete(order):
+    revenue, orders = contribution(order.status, order.total_price)
+    apply(order.created_at, -revenue, -orders)
+
+
+def apply(created_at, revenue, orders):
+    if not revenue and not orders:
+        return
+    day = timezone.localdate(created_at)
+    with transaction.atomic():
+        RevenueLedger.objects.bulk_create([RevenueLedger(date=day)], ignore_conflicts=True)
+        RevenueLedger.objects.filter(date=day).update(
+            revenue=F('revenue') + revenue,
+            orders=F('orders') + orders,
+        )
+
+
+def set_status(queryset, status):
+    """Bulk status change that keeps the ledger (and other order signals) in sync."""
+    changed = 0
+    with transaction.atomic():
+        for order in queryset.exclude(status=status):
+            order.status = status
+            order.save(update_fields=['status'])
+            changed += 1
+    return changed
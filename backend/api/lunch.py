@@ -0,0 +1,54 @@
+"""
+Resolved business lunch for /api/lunch/.
+
+The answer to "which lunch is today" changes at most once a day, so the
+serialized lunch is cached under the local date (TIME_ZONE) until local
+midnight. Saving or deleting a BusinessLunch drops today's entry.
+
+With the default per-process cache that only happens in the process that
+saved it: other processes keep serving the old lunch until midnight. Set
+REDIS_URL when running more than one.
+"""
+import datetime
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import BusinessLunch
+
+
+def cache_key(day):
+    return f"lunch:{day.isoformat()}"
+
+
+def seconds_until_midnight(now=None):
+    now = timezone.localtime(now)
+    midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time.min)
+    midnight = timezone.make_aware(midnight, now.tzinfo)
+    return max(1, int((midnight - now).total_seconds()) + 1)
+
+
+def resolve(day):
+    """Today's lunch, or the most recent one if today's menu isn't filled in yet."""
+    from .serializers import BusinessLunchSerializer
+
+    lunch = BusinessLunch.objects.filter(date=day).first()
+    if not lunch:
+        lunch = BusinessLunch.objects.order_by('-date').first()
+    return BusinessLunchSerializer(lunch).data if lunch else None
+
+
+def get_lunch():
+    today = timezone.localdate()
+    key = cache_key(today)
+
+    # Wrapped in a dict so "no lunch at all" is cached too
+    entry = cache.get(key)
+    if entry is None:
+        entry = {'lunch': resolve(today)}
+        cache.set(key, entry, seconds_until_midnight())
+    return entry['lunch']
+
+
+def invalidate():
+    cache.delete(cache_key(timezone.localdate()))
@@ -0,0 +1,152 @@
+"""
+Bulk import of business lunch schedules from CSV or XLSX.
+
+One row per day with the columns below (English or Russian headers). Dish
+lists use one dish per line inside the cell, the same as in the admin form.
+Rows are upserted on the unique `date` in batches inside one transaction,
+and the lunch cache is invalidated once after the import commits. An
+existing day only gets the columns the row has: a sheet without prices
+keeps the prices already set.
+"""
+import csv
+import datetime
+import io
+from collections import defaultdict
+
+from django.db import transaction
+
+from . import lunch
+from .models import BusinessLunch
+
+FIELDS = [
+    'date', 'salads', 'soups', 'hot_dishes', 'garnishes',
+    'price_3_course', 'price_salad_soup', 'price_salad_hot', 'price_soup_hot',
+]
+DISH_FIELDS = FIELDS[1:5]
+PRICE_FIELDS = FIELDS[5:]
+
+HEADER_ALIASES = {
+    'дата': 'date',
+    'салаты': 'salads',
+    'супы': 'soups',
+    'горячее': 'hot_dishes',
+    'гарниры': 'garnishes',
+    '3 блюда': 'price_3_course',
+    'салат + суп': 'price_salad_soup',
+    'салат + горячее': 'price_salad_hot',
+    'суп + горячее': 'price_soup_hot',
+}
+
+DATE_FORMATS = ['%Y-%m-%d', '%d.%m.%Y', '%d.%m.%y']
+
+
+class LunchImportError(ValueError):
+    pass
+
+
+def normalize_header(name):
+    name = str(name or '').strip().lower()
+    return HEADER_ALIASES.get(name, name)
+
+
+def iter_csv(fileobj):
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    sample = text.read(4096)
+    text.seek(0)
+    try:
+        # Excel in Russian locale saves CSV with ';'
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(text, dialect)
+    header = [normalize_header(name) for name in next(reader, [])]
+    for row in reader:
+        yield dict(zip(header, row))
+
+
+def iter_xlsx(fileobj):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise LunchImportError("Для импорта XLSX установите openpyxl (или сохраните файл как CSV)")
+
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [normalize_header(name) for name in next(rows, [])]
+        for row in rows:
+            yield dict(zip(header, row))
+    finally:
+        workbook.close()
+
+
+def iter_rows(fileobj, filename):
+    if filename.lower().endswith(('.xlsx', '.xlsm')):
+        return iter_xlsx(fileobj)
+    return iter_csv(fileobj)
+
+
+def parse_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(str(value).strip(), date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f"неизвестный формат даты: {value!r}")
+
+
+def build_lunch(row):
+    """The unsaved lunch and the fields the row sets: a missing column or an empty price keeps the stored value."""
+    values = {'date': parse_date(row.get('date'))}
+    for field in DISH_FIELDS:
+        if field in row:
+            values[field] = str(row.get(field) or '').replace('\r\n', '\n').strip()
+    for field in PRICE_FIELDS:
+        value = row.get(field)
+        if value not in (None, ''):
+            values[field] = int(float(str(value).replace(',', '.')))
+    return BusinessLunch(**values), tuple(field for field in FIELDS[1:] if field in values)
+
+
+def import_schedule(fileobj, filename, batch_size=200):
+    """Upserts every row of the file, returns the number of days imported."""
+    count = 0
+    with transaction.atomic():
+        batch = {}
+        for line, row in enumerate(iter_rows(fileobj, filename), start=2):
+            if not any(row.values()):
+                continue
+            try:
+                obj, fields = build_lunch(row)
+            except (TypeError, ValueError) as e:
+                raise LunchImportError(f"Строка {line}: {e}")
+            # The same date twice in one batch can't be upserted in one statement
+            batch[obj.date] = (obj, fields)
+            if len(batch) >= batch_size:
+                count += _flush(batch)
+        count += _flush(batch)
+
+        # bulk_create sends no signals, so drop the cached lunch once here
+        transaction.on_commit(lunch.invalidate)
+    return count
+
+
+def _flush(batch):
+    if not batch:
+        return 0
+    # One upsert per set of columns, so rows only overwrite what they contain
+    groups = defaultdict(list)
+    for obj, fields in batch.values():
+        groups[fields].append(obj)
+    for fields, objs in groups.items():
+        if fields:
+            BusinessLunch.objects.bulk_create(objs, update_conflicts=True, unique_fields=['date'], update_fields=fields)
+        else:
+            BusinessLunch.objects.bulk_create(objs, ignore_conflicts=True)
+    count = len(batch)
+    batch.clear()
+    return count
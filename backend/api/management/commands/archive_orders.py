@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import archive
+
+
+class Command(BaseCommand):
+    help = "Moves old completed and cancelled orders into the archive (safe to interrupt and rerun, run daily)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ARCHIVE_ORDERS_AFTER_DAYS,
+                            help="Archive orders placed more than this many days ago")
+        parser.add_argument('--batch-size', type=int, default=settings.ARCHIVE_BATCH_SIZE,
+                            help="Orders moved per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the orders that would be moved")
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = archive.candidates(archive.cutoff_for(options['days'])).count()
+            self.stdout.write(f"{count} orders would be archived")
+            return
+        count = archive.archive(options['days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {count} orders"))
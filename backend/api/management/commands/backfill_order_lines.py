@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api import order_lines
+
+
+class Command(BaseCommand):
+    help = "Writes OrderLine rows for orders that only have the items JSON (safe to interrupt and rerun)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="Orders per transaction")
+
+    def handle(self, *args, **options):
+        def progress(orders, lines, last_pk):
+            self.stdout.write(f"  {orders} orders, {lines} lines (up to order #{last_pk})")
+
+        orders, lines = order_lines.backfill(chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {lines} lines for {orders} orders"))
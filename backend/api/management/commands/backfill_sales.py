@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api import sales
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the daily sales rollups from all completed orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Orders fetched per query")
+
+    def handle(self, *args, **options):
+        orders, days = sales.rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {days} days from {orders} completed orders"))
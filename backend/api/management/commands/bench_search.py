@@ -0,0 +1,89 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from api.models import Category, Product
+from api.search import SearchIndex
+from api.serializers import ProductSerializer
+
+WORDS = [
+    'шашлык', 'свиной', 'куриный', 'говяжий', 'люля', 'кебаб', 'ребрышки', 'копченые',
+    'пельмени', 'домашние', 'вареники', 'картофелем', 'грибами', 'сметаной', 'салат',
+    'цезарь', 'греческий', 'оливье', 'овощной', 'борщ', 'солянка', 'уха', 'пицца',
+    'маргарита', 'пепперони', 'сырная', 'блины', 'ягодным', 'соусом', 'чесночный',
+    'лаваш', 'лепешка', 'сыром', 'зеленью', 'томатами', 'огурцами', 'форель', 'лосось',
+]
+
+SYLLABLES = ['ба', 'ве', 'ги', 'до', 'жу', 'за', 'ки', 'ло', 'му', 'не', 'по', 'ри', 'со', 'ту', 'фе', 'ха', 'це', 'ша']
+
+QUERIES = ['шашлык', 'пельмени домашние', 'цезар', 'салат овощ', 'шашлк', 'греческий салат', 'лосось', 'блины']
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class Command(BaseCommand):
+    help = "Compares the in-memory search index against ORM icontains on a synthetic menu"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20000, help="Synthetic dishes to generate")
+        parser.add_argument('--repeat', type=int, default=200, help="Runs per query")
+
+    def handle(self, *args, **options):
+        random.seed(42)
+        # Everything happens in a transaction that is rolled back at the end
+        with transaction.atomic():
+            self.run(options['products'], options['repeat'])
+            transaction.set_rollback(True)
+
+    def run(self, count, repeat):
+        # Real menus have far more distinct words than WORDS, pad with made-up ones
+        vocabulary = list({''.join(random.choices(SYLLABLES, k=3)) for _ in range(5000)})
+
+        category = Category.objects.create(name="Бенчмарк")
+        Product.objects.bulk_create([
+            Product(
+                category=category,
+                title=f"{random.choice(WORDS)} {random.choice(vocabulary)}".capitalize(),
+                description=' '.join(random.sample(WORDS, 2) + random.sample(vocabulary, 4)),
+                price=random.randint(100, 900),
+            )
+            for _ in range(count)
+        ], batch_size=1000)
+
+        started = time.perf_counter()
+        index = SearchIndex()
+        products = ProductSerializer(Product.objects.all(), many=True).data
+        index.load(products, version=0)
+        self.stdout.write(f"{count} products, index built in {time.perf_counter() - started:.2f}s "
+                          f"({len(index.vocabulary)} stems)")
+
+        self.stdout.write(f"{'query':<20} {'index p50':>10} {'index p95':>10} {'hits':>6}   "
+                          f"{'orm p50':>10} {'orm p95':>10} {'hits':>6}")
+        for query in QUERIES:
+            index_times, orm_times = [], []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                hits = index.search(query, limit=20)
+                index_times.append(time.perf_counter() - started)
+
+            # The old admin path: every word as icontains on title or description.
+            # SQLite LIKE only folds ASCII case, so Cyrillic matches are case-sensitive.
+            orm_filter = Q()
+            for word in query.split():
+                orm_filter &= Q(title__icontains=word) | Q(description__icontains=word)
+            for _ in range(max(1, repeat // 10)):
+                started = time.perf_counter()
+                orm_hits = list(Product.objects.filter(orm_filter)[:20])
+                orm_times.append(time.perf_counter() - started)
+
+            self.stdout.write(
+                f"{query:<20} {percentile(index_times, 0.5) * 1000:>8.3f}ms {percentile(index_times, 0.95) * 1000:>8.3f}ms {len(hits):>6}   "
+                f"{statistics.median(orm_times) * 1000:>8.3f}ms {percentile(orm_times, 0.95) * 1000:>8.3f}ms {len(orm_hits):>6}"
+            )
@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+
+from api import images, menu_snapshot
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = "Renders WebP/JPEG derivatives for existing product and banquet menu images"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="Parallel render threads")
+        parser.add_argument('--force', action='store_true', help="Re-render even if derivatives are up to date")
+
+    def handle(self, *args, **options):
+        jobs = []
+        for model, fields in images.IMAGE_FIELDS.items():
+            for instance in model.objects.only('pk', 'image_derivatives', *fields).iterator():
+                if options['force'] or images.stale_fields(instance):
+                    jobs.append((model, instance.pk))
+
+        if not jobs:
+            self.stdout.write("All derivatives are up to date")
+            return
+
+        self.stdout.write(f"Rendering derivatives for {len(jobs)} objects...")
+        done = skipped = failed = 0
+        products = set()
+        # Pillow releases the GIL while resizing and encoding, so threads scale
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {
+                executor.submit(images.generate, model, pk, options['force'], mark_menu=False): (model, pk)
+                for model, pk in jobs
+            }
+            for future in as_completed(futures):
+                model, pk = futures[future]
+                try:
+                    rendered = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{model.__name__} #{pk}: {e}")
+                    continue
+                if rendered:
+                    done += 1
+                    if model is Product:
+                        products.add(pk)
+                else:
+                    # Deleted meanwhile or its image was cleared: nothing was rendered
+                    skipped += 1
+                    self.stderr.write(f"{model.__name__} #{pk}: no source image, skipped")
+
+        if products:
+            # One rebuild for the whole backfill: srcset is part of the menu payload
+            menu_snapshot.rebuild(changed={'product': products})
+
+        summary = f"Done: {done}, skipped: {skipped}, failed: {failed}"
+        self.stdout.write(self.style.SUCCESS(summary) if not (skipped or failed) else self.style.WARNING(summary))
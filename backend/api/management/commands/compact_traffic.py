@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import rollups
+
+
+class Command(BaseCommand):
+    help = "Compacts hourly traffic rollups into days and months and prunes old visitor sketches (run daily)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hourly-days', type=int, default=settings.TRAFFIC_HOURLY_RETENTION_DAYS,
+                            help="Keep hourly rows for this many days")
+        parser.add_argument('--daily-days', type=int, default=settings.TRAFFIC_DAILY_RETENTION_DAYS,
+                            help="Keep daily rows for this many days")
+        parser.add_argument('--sketch-days', type=int, default=settings.TRAFFIC_SKETCH_RETENTION_DAYS,
+                            help="Keep visitor sketches for this many days")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Rows per delete batch")
+
+    def handle(self, *args, **options):
+        days = rollups.compact_hours(options['hourly_days'])
+        months = rollups.compact_days(options['daily_days'])
+        sketches = rollups.prune_sketches(options['sketch_days'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {days} days of hourly rows and {months} months of daily rows, "
+            f"pruned {sketches} visitor sketches"
+        ))
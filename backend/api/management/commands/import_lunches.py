@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.lunch_import import LunchImportError, import_schedule
+
+
+class Command(BaseCommand):
+    help = "Imports a business lunch schedule (CSV or XLSX, one row per day), updating existing dates"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path to .csv or .xlsx file")
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            with open(path, 'rb') as f:
+                count = import_schedule(f, path, batch_size=options['batch_size'])
+        except (OSError, LunchImportError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {count} days"))
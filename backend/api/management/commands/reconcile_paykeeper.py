@@ -0,0 +1,62 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import reconcile
+
+
+class Command(BaseCommand):
+    help = "Reconciles a PayKeeper payment export (CSV, JSON or JSON Lines) against orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', help="Path to the exported payments file")
+        parser.add_argument('--format', choices=['csv', 'json'], help="Defaults to the file extension (.csv or JSON)")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Export rows matched per query")
+        parser.add_argument('--report', help="Write every problem found to this CSV file")
+        parser.add_argument('--apply', action='store_true',
+                            help="Mark orders with a missing callback as paid (logged as PaymentEvent)")
+        parser.add_argument('--show', type=int, default=20, help="Problems to print (the rest only go to --report)")
+
+    def handle(self, *args, **options):
+        report_file = open(options['report'], 'w', encoding='utf-8', newline='') if options['report'] else None
+        writer = csv.writer(report_file) if report_file else None
+        if writer:
+            writer.writerow(['problem', 'payment_id', 'order_id', 'payment_amount', 'order_amount', 'order_payment_id'])
+        shown = 0
+
+        def on_issue(kind, payment_id, order_id, amount, order):
+            nonlocal shown
+            if writer:
+                writer.writerow([kind, payment_id, order_id or '', amount if amount is not None else '',
+                                 order.total_price if order else '', order.payment_id or '' if order else ''])
+            if shown < options['show']:
+                shown += 1
+                details = f"заказ #{order_id}" if order_id else "без номера заказа"
+                if kind == 'amount_mismatch':
+                    details += f", платеж {amount} ₽, заказ {order.total_price} ₽"
+                elif kind == 'other_payment':
+                    details += f", в заказе платеж {order.payment_id}"
+                self.stdout.write(f"  {reconcile.ISSUES[kind]}: платеж {payment_id or '?'}, {details}")
+
+        try:
+            rows = reconcile.read_rows(options['export'], options['format'])
+            result = reconcile.reconcile(rows, batch_size=options['batch_size'], apply=options['apply'], on_issue=on_issue)
+        except (OSError, ValueError, csv.Error) as e:
+            raise CommandError(f"Cannot read {options['export']}: {e}")
+        finally:
+            if report_file:
+                report_file.close()
+
+        self.stdout.write(
+            f"Rows: {result.rows}, matched: {result.matched}, skipped (not successful): {result.skipped}"
+        )
+        for kind, title in reconcile.ISSUES.items():
+            self.stdout.write(f"{title}: {result.issues[kind]}")
+        if options['apply']:
+            self.stdout.write(f"Marked paid: {result.applied}")
+
+        total = sum(result.issues.values())
+        if total:
+            self.stdout.write(self.style.WARNING(f"{total} problems found"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Export and orders agree"))
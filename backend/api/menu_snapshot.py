@@ -0,0 +1,183 @@
+"""
+Pre-rendered menu payload for /api/menu/.
+
+The menu changes a few times a week but is requested on every page view, so
+instead of serializing every Category and Product on each hit we keep the
+rendered JSON in a single MenuSnapshot row together with a version counter.
+The snapshot is rebuilt from post_save/post_delete signals (see api/signals.py),
+at most once per transaction, and every worker keeps the payload of the last
+version it has seen in memory.
+
+Every rebuild also stamps the changed rows with the new version (and writes
+tombstones for deleted ones), so clients holding version N can ask for
+/api/menu/?since=N and get only what changed.
+"""
+import hashlib
+import threading
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import F
+from rest_framework.renderers import JSONRenderer
+
+from .models import Category, Product, MenuSnapshot, MenuTombstone
+
+SNAPSHOT_ID = 1
+
+MENU_MODELS = {
+    'category': Category,
+    'product': Product,
+}
+
+Snapshot = namedtuple('Snapshot', ['version', 'etag', 'payload'])
+
+# Payload of the last version seen by this worker
+_local_snapshot = None
+_lock = threading.Lock()
+
+
+class PendingRebuild:
+    """on_commit callback collecting the menu rows changed in one transaction."""
+
+    def __init__(self):
+        self.changed = {kind: set() for kind in MENU_MODELS}
+        self.deleted = {kind: set() for kind in MENU_MODELS}
+
+    def add(self, kind, pk, deleted=False):
+        if kind is None:
+            return
+        if deleted:
+            self.changed[kind].discard(pk)
+            self.deleted[kind].add(pk)
+        else:
+            self.changed[kind].add(pk)
+
+    def __call__(self):
+        rebuild(self.changed, self.deleted)
+
+
+def build_payload(version):
+    """Serializes the whole menu exactly like the old get_menu view did."""
+    from .serializers import CategorySerializer, ProductSerializer
+
+    data = {
+        "version": version,
+        "categories": CategorySerializer(Category.objects.all(), many=True).data,
+        "products": ProductSerializer(Product.objects.all(), many=True).data,
+    }
+    return JSONRenderer().render(data)
+
+
+def make_etag(version, payload):
+    digest = hashlib.sha256(payload).hexdigest()[:16]
+    return f'"menu-{version}-{digest}"'
+
+
+def rebuild(changed=None, deleted=None):
+    """
+    Bumps the version, stamps changed rows and stores a fresh payload.
+
+    The version is bumped first so the write lock is held while the menu is
+    read: two concurrent rebuilds can never store an older payload under a
+    newer version.
+    """
+    global _local_snapshot
+
+    MenuSnapshot.objects.get_or_create(pk=SNAPSHOT_ID)
+    with transaction.atomic():
+        MenuSnapshot.objects.filter(pk=SNAPSHOT_ID).update(version=F('version') + 1)
+        version = MenuSnapshot.objects.values_list('version', flat=True).get(pk=SNAPSHOT_ID)
+
+        # update() does not send signals, so stamping can't loop back here
+        for kind, pks in (changed or {}).items():
+            if pks:
+                MENU_MODELS[kind].objects.filter(pk__in=pks).update(menu_version=version)
+        MenuTombstone.objects.bulk_create([
+            MenuTombstone(kind=kind, object_id=pk, version=version)
+            for kind, pks in (deleted or {}).items()
+            for pk in pks
+        ])
+
+        payload = build_payload(version)
+        etag = make_etag(version, payload)
+        MenuSnapshot.objects.filter(pk=SNAPSHOT_ID).update(
+            payload=payload.decode('utf-8'),
+            etag=etag,
+        )
+
+    snapshot = Snapshot(version, etag, payload)
+    with _lock:
+        if _local_snapshot is None or _local_snapshot.version < version:
+            _local_snapshot = snapshot
+    return snapshot
+
+
+def mark_dirty(kind=None, pk=None, deleted=False):
+    """
+    Schedules a rebuild after the current transaction commits.
+
+    Saving many rows in one transaction (e.g. admin list_editable on
+    Category.order) triggers a single rebuild. Outside of a transaction
+    on_commit runs the rebuild immediately.
+    """
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        for entry in connection.run_on_commit:
+            if isinstance(entry[1], PendingRebuild):
+                entry[1].add(kind, pk, deleted)
+                return
+
+    pending = PendingRebuild()
+    pending.add(kind, pk, deleted)
+    transaction.on_commit(pending)
+
+
+def get_snapshot():
+    """Returns the current snapshot, fetching the payload only when the version moved."""
+    global _local_snapshot
+
+    row = MenuSnapshot.objects.filter(pk=SNAPSHOT_ID).values_list('version', 'etag').first()
+    if row is None or not row[1]:
+        # First request after deploy: nothing has been rendered yet
+        return rebuild()
+
+    version, etag = row
+    snapshot = _local_snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    # Re-read version and etag together with the payload so all three match
+    version, etag, payload = MenuSnapshot.objects.values_list(
+        'version', 'etag', 'payload'
+    ).get(pk=SNAPSHOT_ID)
+    snapshot = Snapshot(version, etag, payload.encode('utf-8'))
+    with _lock:
+        if _local_snapshot is None or _local_snapshot.version < version:
+            _local_snapshot = snapshot
+    return snapshot
+
+
+def get_changes(since, version):
+    """
+    Rows added, changed or deleted after version `since`, up to `version`.
+
+    Rows stamped by a rebuild that committed after `version` was read may be
+    included too; clients apply the delta as upserts so that is harmless.
+    """
+    from .serializers import CategorySerializer, ProductSerializer
+
+    deleted = {'categories': [], 'products': []}
+    if since >= version:
+        # Client is up to date, nothing to query
+        return {"version": version, "since": since, "categories": [], "products": [], "deleted": deleted}
+
+    for kind, object_id in MenuTombstone.objects.filter(version__gt=since).values_list('kind', 'object_id'):
+        deleted['categories' if kind == 'category' else 'products'].append(object_id)
+
+    return {
+        "version": version,
+        "since": since,
+        "categories": CategorySerializer(Category.objects.filter(menu_version__gt=since), many=True).data,
+        "products": ProductSerializer(Product.objects.filter(menu_version__gt=since), many=True).data,
+        "deleted": deleted,
+    }
@@ -0,0 +1,263 @@
+"""
+Per-route request timing, exported in Prometheus text format.
+
+RequestTimingMiddleware observes every request into fixed-size histograms
+(one per metric and route, so memory doesn't grow with traffic): latency,
+number of DB queries and time spent in the DB. TrafficMonitorMiddleware
+reports its own overhead the same way.
+
+Each gunicorn worker keeps its histograms in memory and writes them to its
+own file in METRICS_DIR at most every METRICS_WRITE_INTERVAL seconds. The
+/api/admin/metrics/ endpoint merges the files of all workers (bucket counts
+simply add up). When it finds the file of a worker that has exited, it
+folds those counts into its own file and removes the dead one, like
+prometheus_client's mark_process_dead. So counters never go down and the
+directory doesn't grow with every restart.
+"""
+import atexit
+import bisect
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+METRICS = {
+    'http_request_duration_seconds': ("Request latency by route", DURATION_BUCKETS),
+    'http_request_db_queries': ("Database queries per request by route", QUERY_BUCKETS),
+    'http_request_db_duration_seconds': ("Time spent in the database per request by route", DURATION_BUCKETS),
+    'traffic_monitor_duration_seconds': ("Time TrafficMonitorMiddleware adds to a request", DURATION_BUCKETS),
+}
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+WORKER_FILE = re.compile(r'^worker-(\d+)-[0-9a-f]+\.json$')
+
+
+def process_alive(pid):
+    if os.name != 'posix':
+        return True  # os.kill() would terminate it on Windows, just keep the file
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets, counts=None, total=0.0):
+        self.buckets = buckets
+        # One extra slot for +Inf
+        self.counts = counts or [0] * (len(buckets) + 1)
+        self.sum = total
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """Estimate by linear interpolation inside the bucket holding the q-th observation."""
+        total = self.count
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class QueryStats:
+    """connection.execute_wrapper hook counting queries and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}   # (metric, route) -> Histogram
+        self.written_at = 0.0
+        self.path = None
+
+    def _check_fork(self):
+        # Imported before gunicorn forked: every worker needs its own data and file
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.reset()
+
+    def observe(self, metric, route, value):
+        with self.lock:
+            self._check_fork()
+            histogram = self.histograms.get((metric, route))
+            if histogram is None:
+                histogram = self.histograms[metric, route] = Histogram(METRICS[metric][1])
+            histogram.observe(value)
+
+        if time.monotonic() - self.written_at >= getattr(settings, 'METRICS_WRITE_INTERVAL', 5):
+            self.write()
+
+    def directory(self):
+        return getattr(settings, 'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'api-metrics'))
+
+    def write(self):
+        with self.lock:
+            self._check_fork()
+            self.written_at = time.monotonic()
+            data = [[metric, route, h.counts, h.sum] for (metric, route), h in self.histograms.items()]
+            if self.path is None:
+                # pid alone can be reused by a later worker
+                self.path = os.path.join(self.directory(), f"worker-{self.pid}-{uuid.uuid4().hex[:8]}.json")
+
+        try:
+            os.makedirs(self.directory(), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Metrics write error: {e}")
+
+    def fold_dead_workers(self):
+        """Takes over the counts of exited workers, returns the claimed files to remove once written."""
+        directory = self.directory()
+        claimed = []
+        for name in os.listdir(directory) if os.path.isdir(directory) else []:
+            match = WORKER_FILE.match(name)
+            path = os.path.join(directory, name)
+            if not match or path == self.path or process_alive(int(match.group(1))):
+                continue
+            # rename() succeeds for one worker only, nobody folds a file twice
+            claimed_path = f"{path}.folding"
+            try:
+                os.rename(path, claimed_path)
+                with open(claimed_path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            claimed.append(claimed_path)
+            with self.lock:
+                self._check_fork()
+                for metric, route, counts, total in data:
+                    if metric not in METRICS:
+                        continue
+                    histogram = self.histograms.get((metric, route))
+                    if histogram is None:
+                        histogram = self.histograms[metric, route] = Histogram(METRICS[metric][1])
+                    histogram.merge(Histogram(METRICS[metric][1], counts, total))
+        return claimed
+
+    def collect(self):
+        """Histograms of all workers merged together."""
+        claimed = self.fold_dead_workers()
+        self.write()
+        for path in claimed:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        merged = {}
+        directory = self.directory()
+        for name in os.listdir(directory) if os.path.isdir(directory) else []:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric, route, counts, total in data:
+                if metric not in METRICS:
+                    continue
+                histogram = Histogram(METRICS[metric][1], counts, total)
+                if (metric, route) in merged:
+                    merged[metric, route].merge(histogram)
+                else:
+                    merged[metric, route] = histogram
+        return merged
+
+
+registry = Registry()
+atexit.register(lambda: registry.histograms and registry.write())
+
+
+def observe_request(route, duration, queries):
+    registry.observe('http_request_duration_seconds', route, duration)
+    registry.observe('http_request_db_queries', route, queries.count)
+    registry.observe('http_request_db_duration_seconds', route, queries.duration)
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def export():
+    """All workers' histograms in Prometheus text exposition format."""
+    merged = registry.collect()
+    lines = []
+    for metric, (help_text, buckets) in METRICS.items():
+        routes = sorted(route for name, route in merged if name == metric)
+        if not routes:
+            continue
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for route in routes:
+            histogram = merged[metric, route]
+            route_label = f'route="{label(route)}"'
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{route_label},le="{bound}"}} {cumulative}')
+            lines.append(f"{metric}_sum{{{route_label}}} {number(histogram.sum)}")
+            lines.append(f"{metric}_count{{{route_label}}} {cumulative}")
+
+        # Precomputed percentiles for a quick look without PromQL
+        lines.append(f"# HELP {metric}_quantile {help_text}, estimated from the histogram")
+        lines.append(f"# TYPE {metric}_quantile gauge")
+        for route in routes:
+            for q in QUANTILES:
+                value = merged[metric, route].quantile(q)
+                lines.append(f'{metric}_quantile{{route="{label(route)}",quantile="{q}"}} {number(float(value))}')
+    return '\n'.join(lines) + '\n'
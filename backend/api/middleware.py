@@ -1,5 +1,28 @@
+import time
+
+from django.db import connection
 from django.utils import timezone
-from .models import DailyStats, DailyVisitor
+from . import metrics, traffic
+
+
+class RequestTimingMiddleware:
+    """Per-route latency, DB query count and DB time, see api/metrics.py."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = metrics.QueryStats()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        # Route pattern, not the path, so the number of histograms stays fixed
+        match = getattr(request, 'resolver_match', None)
+        metrics.observe_request(match.route if match else 'unmatched', duration, queries)
+        return response
+
 
 class TrafficMonitorMiddleware:
     def __init__(self, get_response):
@@ -11,7 +34,9 @@ class TrafficMonitorMiddleware:
            not request.path.startswith('/media/') and \
            not request.path.startswith('/admin/'):
             
+            started = time.perf_counter()
             self.track_visit(request)
+            metrics.registry.observe('traffic_monitor_duration_seconds', 'all', time.perf_counter() - started)
 
         response = self.get_response(request)
         return response
@@ -19,26 +44,11 @@ class TrafficMonitorMiddleware:
     def get_client_ip(self, request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
         if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
+            ip = x_forwarded_for.split(',')[0].strip()
         else:
             ip = request.META.get('REMOTE_ADDR')
         return ip
 
     def track_visit(self, request):
-        today = timezone.now().date()
-        ip = self.get_client_ip(request)
-        
-        # Update Total Views
-        stats, _ = DailyStats.objects.get_or_create(
-            date=today,
-            defaults={'unique_visitors': 0, 'total_views': 0}
-        )
-        stats.total_views += 1
-        stats.save()
-        
-        # Update Unique Visitors (IP based)
-        visitor_exists = DailyVisitor.objects.filter(date=today, ip_address=ip).exists()
-        if not visitor_exists:
-            DailyVisitor.objects.create(date=today, ip_address=ip)
-            stats.unique_visitors += 1
-            stats.save()
+        # Counted in memory and written in batches by api/traffic.py
+        traffic.buffer.record(timezone.now(), self.get_client_ip(request), request.path)
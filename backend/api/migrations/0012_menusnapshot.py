@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_alter_order_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='Версия меню')),
+                ('etag', models.CharField(blank=True, max_length=64, verbose_name='ETag')),
+                ('payload', models.TextField(blank=True, verbose_name='Данные меню (JSON)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Снимок меню',
+                'verbose_name_plural': 'Снимки меню',
+            },
+        ),
+    ]
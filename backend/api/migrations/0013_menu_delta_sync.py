@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_menusnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('category', 'Категория'), ('product', 'Блюдо')], max_length=20, verbose_name='Тип')),
+                ('object_id', models.PositiveBigIntegerField(verbose_name='ID объекта')),
+                ('version', models.PositiveBigIntegerField(db_index=True, verbose_name='Версия меню')),
+            ],
+            options={
+                'verbose_name': 'Удаленная позиция меню',
+                'verbose_name_plural': 'Удаленные позиции меню',
+            },
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='menu_version',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='menu_version',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_menu_delta_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='banquetmenu',
+            name='image_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
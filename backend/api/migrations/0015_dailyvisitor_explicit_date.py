@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dailyvisitor',
+            name='date',
+            field=models.DateField(verbose_name='Дата'),
+        ),
+    ]
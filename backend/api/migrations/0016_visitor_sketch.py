@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:14
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def build_sketches(apps, schema_editor):
+    # Fold the per-IP rows into one sketch per day before the table goes away
+    from api.hll import VisitorSketch
+
+    DailyStats = apps.get_model('api', 'DailyStats')
+    DailyVisitor = apps.get_model('api', 'DailyVisitor')
+
+    sketches = defaultdict(VisitorSketch)
+    for day, ip in DailyVisitor.objects.values_list('date', 'ip_address').iterator(chunk_size=2000):
+        sketches[day].add(ip)
+
+    for day, sketch in sketches.items():
+        stats, _ = DailyStats.objects.get_or_create(date=day)
+        stats.visitor_sketch = sketch.to_bytes()
+        stats.unique_visitors = len(sketch)
+        stats.save(update_fields=['visitor_sketch', 'unique_visitors'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_dailyvisitor_explicit_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailystats',
+            name='visitor_sketch',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Скетч посетителей'),
+        ),
+        migrations.RunPython(build_sketches, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='DailyVisitor',
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_visitor_sketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrafficRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('hour', 'Час'), ('day', 'День'), ('month', 'Месяц')], max_length=5, verbose_name='Интервал')),
+                ('period_start', models.DateTimeField(verbose_name='Начало периода')),
+                ('path_group', models.CharField(max_length=32, verbose_name='Раздел сайта')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='Просмотры')),
+            ],
+            options={
+                'verbose_name': 'Трафик по периодам',
+                'verbose_name_plural': 'Трафик по периодам',
+                'indexes': [models.Index(fields=['period_start'], name='api_rollup_period_idx')],
+                'unique_together': {('resolution', 'period_start', 'path_group')},
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:19
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_ledger(apps, schema_editor):
+    # One pass over the existing orders, from here on signals keep it current
+    Order = apps.get_model('api', 'Order')
+    RevenueLedger = apps.get_model('api', 'RevenueLedger')
+
+    days = defaultdict(lambda: [Decimal(0), 0])
+    orders = Order.objects.exclude(status='cancelled').values_list('created_at', 'total_price')
+    for created_at, total_price in orders.iterator(chunk_size=2000):
+        day = days[timezone.localdate(created_at)]
+        day[0] += total_price
+        day[1] += 1
+
+    RevenueLedger.objects.bulk_create(
+        [RevenueLedger(date=date, revenue=revenue, orders=count) for date, (revenue, count) in days.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_traffic_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='Дата')),
+                ('revenue', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='Выручка')),
+                ('orders', models.IntegerField(default=0, verbose_name='Заказов')),
+            ],
+            options={
+                'verbose_name': 'Выручка за день',
+                'verbose_name_plural': 'Выручка по дням',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.RunPython(fill_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_revenue_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='Дата')),
+                ('orders', models.IntegerField(default=0, verbose_name='Заказов')),
+                ('revenue', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='Выручка')),
+                ('revenue_cash', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='Наличные')),
+                ('revenue_online', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='Онлайн')),
+                ('revenue_transfer', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='Перевод')),
+            ],
+            options={
+                'verbose_name': 'Продажи за день',
+                'verbose_name_plural': 'Продажи по дням',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('title', models.CharField(max_length=200, verbose_name='Блюдо')),
+                ('quantity', models.IntegerField(default=0, verbose_name='Количество')),
+                ('revenue', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='Выручка')),
+            ],
+            options={
+                'verbose_name': 'Продажи блюда за день',
+                'verbose_name_plural': 'Продажи блюд по дням',
+                'unique_together': {('date', 'title')},
+            },
+        ),
+    ]
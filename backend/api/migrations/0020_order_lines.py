@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_daily_sales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200, verbose_name='Название на момент заказа')),
+                ('unit_price', models.DecimalField(decimal_places=0, max_digits=10, verbose_name='Цена за шт.')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('created_at', models.DateTimeField(verbose_name='Дата заказа')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='api.order', verbose_name='Заказ')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_lines', to='api.product', verbose_name='Блюдо')),
+            ],
+            options={
+                'verbose_name': 'Позиция заказа',
+                'verbose_name_plural': 'Позиции заказов',
+                'indexes': [models.Index(fields=['product', 'created_at'], name='api_orderline_product_idx'), models.Index(fields=['created_at'], name='api_orderline_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='Ключ')),
+                ('fingerprint', models.CharField(max_length=64, verbose_name='Хэш запроса')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Код ответа')),
+                ('response', models.TextField(blank=True, verbose_name='Ответ')),
+                ('created_at', models.DateTimeField(db_index=True, verbose_name='Создан')),
+            ],
+            options={
+                'verbose_name': 'Ключ идемпотентности',
+                'verbose_name_plural': 'Ключи идемпотентности',
+            },
+        ),
+    ]
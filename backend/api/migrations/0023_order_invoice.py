@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='invoice_id',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='ID счета PayKeeper'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='invoice_url',
+            field=models.URLField(blank=True, default='', max_length=255, verbose_name='Ссылка на оплату'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_order_invoice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_id', models.CharField(blank=True, max_length=100, verbose_name='ID платежа')),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Сумма')),
+                ('outcome', models.CharField(choices=[('paid', 'Оплата принята'), ('duplicate', 'Повторное уведомление'), ('bad_signature', 'Неверная подпись'), ('unknown_order', 'Заказ не найден'), ('invalid', 'Неполные данные')], max_length=20, verbose_name='Результат')),
+                ('payload', models.TextField(blank=True, verbose_name='Данные уведомления')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Получено')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_events', to='api.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Уведомление об оплате',
+                'verbose_name_plural': 'Уведомления об оплате',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_payment_events'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paymentevent',
+            name='outcome',
+            field=models.CharField(choices=[('paid', 'Оплата принята'), ('duplicate', 'Повторное уведомление'), ('bad_signature', 'Неверная подпись'), ('unknown_order', 'Заказ не найден'), ('invalid', 'Неполные данные'), ('reconciled', 'Проведено по выгрузке')], max_length=20, verbose_name='Результат'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_payment_event_reconciled'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('name', models.CharField(max_length=100, verbose_name='Имя клиента')),
+                ('phone', models.CharField(max_length=20, verbose_name='Телефон')),
+                ('address', models.CharField(max_length=255, verbose_name='Адрес доставки')),
+                ('items', models.TextField(verbose_name='Состав заказа')),
+                ('total_price', models.DecimalField(decimal_places=0, max_digits=10, verbose_name='Сумма заказа')),
+                ('status', models.CharField(choices=[('new', 'Новый'), ('kitchen', 'На кухне'), ('delivery', 'В доставке'), ('completed', 'Выполнен'), ('cancelled', 'Отменен')], default='new', max_length=20, verbose_name='Статус')),
+                ('payment_method', models.CharField(choices=[('cash', 'Наличные'), ('online', 'Оплата на сайте (PayKeeper)'), ('transfer', 'Карта / Перевод')], default='cash', max_length=20, verbose_name='Способ оплаты')),
+                ('is_paid', models.BooleanField(default=False, verbose_name='Оплачено')),
+                ('payment_id', models.CharField(blank=True, max_length=100, null=True, verbose_name='ID платежа')),
+                ('invoice_id', models.CharField(blank=True, default='', max_length=64, verbose_name='ID счета PayKeeper')),
+                ('invoice_url', models.URLField(blank=True, default='', max_length=255, verbose_name='Ссылка на оплату')),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='Номер заказа')),
+                ('created_at', models.DateTimeField(verbose_name='Дата создания')),
+                ('archived_at', models.DateTimeField(verbose_name='Перенесен в архив')),
+                ('user', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='archived_orders', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Архивный заказ',
+                'verbose_name_plural': 'Архив заказов',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', 'created_at', 'id'], name='api_archived_user_idx'), models.Index(fields=['created_at', 'id'], name='api_archived_created_idx')],
+            },
+        ),
+    ]
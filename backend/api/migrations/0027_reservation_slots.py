@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_archived_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='status',
+            field=models.CharField(choices=[('new', 'Новая'), ('confirmed', 'Подтверждена'), ('cancelled', 'Отменена')], default='new', max_length=20, verbose_name='Статус'),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='table',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Стол'),
+        ),
+    ]
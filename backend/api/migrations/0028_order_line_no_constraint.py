@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_reservation_slots'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderline',
+            name='order',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='api.order', verbose_name='Заказ'),
+        ),
+    ]
@@ -3,6 +3,8 @@ from django.db import models
 class Category(models.Model):
     name = models.CharField(max_length=100, verbose_name="Название категории")
     order = models.PositiveIntegerField(default=0, verbose_name="Порядок сортировки")
+    # Snapshot version in which the row last changed, used by /api/menu/?since=
+    menu_version = models.PositiveBigIntegerField(default=0, db_index=True, editable=False)
 
     class Meta:
         verbose_name = "Категория меню"
@@ -20,6 +22,9 @@ class Product(models.Model):
     weight = models.CharField(max_length=50, blank=True, verbose_name="Вес/Объем")
     image = models.ImageField(upload_to='products/', blank=True, null=True, verbose_name="Фотография")
     is_popular = models.BooleanField(default=False, verbose_name="Популярное")
+    # Resized WebP/JPEG copies of `image`, filled in by api/images.py
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    menu_version = models.PositiveBigIntegerField(default=0, db_index=True, editable=False)
 
     class Meta:
         verbose_name = "Блюдо"
@@ -66,7 +71,8 @@ class UserAddress(models.Model):
     def __str__(self):
         return f"{self.user.username}: {self.address}"
 
-class Order(models.Model):
+class BaseOrder(models.Model):
+    # Fields shared by live orders and the archive (see api/archive.py)
     STATUS_CHOICES = [
         ('new', 'Новый'),
         ('kitchen', 'На кухне'),
@@ -81,7 +87,6 @@ class Order(models.Model):
         ('transfer', 'Карта / Перевод'),
     ]
 
-    user = models.ForeignKey(User, related_name='orders', on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Пользователь")
     name = models.CharField(max_length=100, verbose_name="Имя клиента")
     phone = models.CharField(max_length=20, verbose_name="Телефон")
     address = models.CharField(max_length=255, verbose_name="Адрес доставки")
@@ -92,30 +97,164 @@ class Order(models.Model):
     payment_method = models.CharField(max_length=20, choices=PAYMENT_CHOICES, default='cash', verbose_name="Способ оплаты")
     is_paid = models.BooleanField(default=False, verbose_name="Оплачено")
     payment_id = models.CharField(max_length=100, blank=True, null=True, verbose_name="ID платежа")
+    # PayKeeper invoice, created once per order (api/paykeeper.py)
+    invoice_id = models.CharField(max_length=64, blank=True, default='', verbose_name="ID счета PayKeeper")
+    invoice_url = models.URLField(max_length=255, blank=True, default='', verbose_name="Ссылка на оплату")
 
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
 
+    class Meta:
+        abstract = True
+
+class Order(BaseOrder):
+    user = models.ForeignKey(User, related_name='orders', on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Пользователь")
+
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
         ordering = ['-created_at']
+        # Hot filters: new orders (dashboard), created_at ranges
+        # (today's figures) and a user's order history.
+        # manage.py check_query_plans verifies they are used
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='api_order_status_idx'),
+            models.Index(fields=['created_at'], name='api_order_created_idx'),
+            models.Index(fields=['user', 'created_at'], name='api_order_user_idx'),
+        ]
 
     def __str__(self):
         return f"Заказ #{self.id} от {self.name} ({self.total_price} ₽)"
 
+class ArchivedOrder(BaseOrder):
+    # Completed and cancelled orders moved out of Order by `manage.py
+    # archive_orders`, with their original ids. May live in a separate
+    # database (ARCHIVE_DB_PATH, see api/routers.py), hence no constraint on
+    # user and nothing done when the user is deleted
+    id = models.BigIntegerField(primary_key=True, verbose_name="Номер заказа")
+    user = models.ForeignKey(User, related_name='archived_orders', on_delete=models.DO_NOTHING, db_constraint=False,
+                             null=True, blank=True, verbose_name="Пользователь")
+    created_at = models.DateTimeField(verbose_name="Дата создания")
+    archived_at = models.DateTimeField(verbose_name="Перенесен в архив")
+
+    class Meta:
+        verbose_name = "Архивный заказ"
+        verbose_name_plural = "Архив заказов"
+        ordering = ['-created_at']
+        # The id is spelled out: unlike Order's it isn't SQLite's rowid, so
+        # the indexes wouldn't carry it for the (created_at, id) ordering
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='api_archived_user_idx'),
+            models.Index(fields=['created_at', 'id'], name='api_archived_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Заказ #{self.id} от {self.name} ({self.total_price} ₽, архив)"
+
+class OrderLine(models.Model):
+    # One row per dish of an order, written next to the Order.items JSON (api/order_lines.py).
+    # No constraint on order: the lines stay when archive_orders moves the
+    # order to ArchivedOrder (same id), deleting an order still takes them along
+    order = models.ForeignKey(Order, related_name='lines', on_delete=models.CASCADE, db_constraint=False,
+                              verbose_name="Заказ")
+    product = models.ForeignKey(Product, related_name='order_lines', on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Блюдо")
+    title = models.CharField(max_length=200, verbose_name="Название на момент заказа")
+    unit_price = models.DecimalField(max_digits=10, decimal_places=0, verbose_name="Цена за шт.")
+    quantity = models.PositiveIntegerField(verbose_name="Количество")
+    # Copy of order.created_at, so per-dish date ranges don't need a join
+    created_at = models.DateTimeField(verbose_name="Дата заказа")
+
+    class Meta:
+        verbose_name = "Позиция заказа"
+        verbose_name_plural = "Позиции заказов"
+        indexes = [
+            models.Index(fields=['product', 'created_at'], name='api_orderline_product_idx'),
+            models.Index(fields=['created_at'], name='api_orderline_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.title} x{self.quantity}"
+
+    @property
+    def total(self):
+        return self.unit_price * self.quantity
+
+class RevenueLedger(models.Model):
+    # Revenue of non-cancelled orders per day, maintained by signals (api/ledger.py)
+    date = models.DateField(unique=True, verbose_name="Дата")
+    revenue = models.DecimalField(max_digits=12, decimal_places=0, default=0, verbose_name="Выручка")
+    orders = models.IntegerField(default=0, verbose_name="Заказов")
+
+    class Meta:
+        verbose_name = "Выручка за день"
+        verbose_name_plural = "Выручка по дням"
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"Выручка за {self.date}"
+
+class DailySales(models.Model):
+    # Completed orders per day, maintained by signals (api/sales.py)
+    date = models.DateField(unique=True, verbose_name="Дата")
+    orders = models.IntegerField(default=0, verbose_name="Заказов")
+    revenue = models.DecimalField(max_digits=12, decimal_places=0, default=0, verbose_name="Выручка")
+    revenue_cash = models.DecimalField(max_digits=12, decimal_places=0, default=0, verbose_name="Наличные")
+    revenue_online = models.DecimalField(max_digits=12, decimal_places=0, default=0, verbose_name="Онлайн")
+    revenue_transfer = models.DecimalField(max_digits=12, decimal_places=0, default=0, verbose_name="Перевод")
+
+    class Meta:
+        verbose_name = "Продажи за день"
+        verbose_name_plural = "Продажи по дням"
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"Продажи за {self.date}"
+
+    @property
+    def average_check(self):
+        return round(self.revenue / self.orders) if self.orders else 0
+
+class DailyProductSales(models.Model):
+    # Dishes of completed orders per day, by title as written in the order
+    date = models.DateField(verbose_name="Дата")
+    title = models.CharField(max_length=200, verbose_name="Блюдо")
+    quantity = models.IntegerField(default=0, verbose_name="Количество")
+    revenue = models.DecimalField(max_digits=12, decimal_places=0, default=0, verbose_name="Выручка")
+
+    class Meta:
+        verbose_name = "Продажи блюда за день"
+        verbose_name_plural = "Продажи блюд по дням"
+        unique_together = ('date', 'title')
+
+    def __str__(self):
+        return f"{self.title} за {self.date}"
+
 class Reservation(models.Model):
+    STATUS_CHOICES = [
+        ('new', 'Новая'),
+        ('confirmed', 'Подтверждена'),
+        ('cancelled', 'Отменена'),
+    ]
+
     name = models.CharField(max_length=100, verbose_name="Имя")
     phone = models.CharField(max_length=20, verbose_name="Телефон")
     date = models.DateField(verbose_name="Дата")
     time = models.TimeField(verbose_name="Время")
     guests = models.IntegerField(verbose_name="Количество гостей")
     comment = models.TextField(blank=True, verbose_name="Комментарий")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='new', verbose_name="Статус")
+    # Number of the table in RESERVATION_TABLES, picked by api/slots.py. Empty
+    # for parties bigger than any table (arranged by phone) and old bookings
+    table = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Стол")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
 
     class Meta:
         verbose_name = "Бронь столика"
         verbose_name_plural = "Брони столов"
         ordering = ['-date', '-time']
+        indexes = [
+            models.Index(fields=['date', 'time'], name='api_reservation_date_idx'),
+            models.Index(fields=['created_at'], name='api_reservation_created_idx'),
+        ]
 
     def __str__(self):
         return f"Бронь: {self.name} на {self.date} {self.time}"
@@ -149,6 +288,9 @@ class BanquetMenu(models.Model):
     is_active = models.BooleanField(default=True, verbose_name="Активно")
     order = models.IntegerField(default=0, verbose_name="Порядок сортировки")
 
+    # Resized copies of cover_image/content_image, filled in by api/images.py
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+
     def __str__(self):
         return self.title
 
@@ -161,6 +303,8 @@ class DailyStats(models.Model):
     date = models.DateField(unique=True, verbose_name="Дата")
     unique_visitors = models.IntegerField(default=0, verbose_name="Посетители (уник.)")
     total_views = models.IntegerField(default=0, verbose_name="Просмотры страниц")
+    # HyperLogLog sketch of the day's visitor IPs, see api/hll.py
+    visitor_sketch = models.BinaryField(null=True, blank=True, editable=False, verbose_name="Скетч посетителей")
     
     class Meta:
         verbose_name = "Статистика посещений"
@@ -170,11 +314,98 @@ class DailyStats(models.Model):
     def __str__(self):
         return f"Статистика за {self.date}"
 
-class DailyVisitor(models.Model):
-    ip_address = models.GenericIPAddressField(verbose_name="IP адрес")
-    date = models.DateField(auto_now_add=True, verbose_name="Дата")
-    
+class PaymentEvent(models.Model):
+    # Every PayKeeper notification and what came of it (views.paykeeper_callback)
+    OUTCOME_CHOICES = [
+        ('paid', 'Оплата принята'),
+        ('duplicate', 'Повторное уведомление'),
+        ('bad_signature', 'Неверная подпись'),
+        ('unknown_order', 'Заказ не найден'),
+        ('invalid', 'Неполные данные'),
+        ('reconciled', 'Проведено по выгрузке'),
+    ]
+
+    order = models.ForeignKey(Order, related_name='payment_events', on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Заказ")
+    payment_id = models.CharField(max_length=100, blank=True, verbose_name="ID платежа")
+    amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Сумма")
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES, verbose_name="Результат")
+    payload = models.TextField(blank=True, verbose_name="Данные уведомления")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Получено")
+
+    class Meta:
+        verbose_name = "Уведомление об оплате"
+        verbose_name_plural = "Уведомления об оплате"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_outcome_display()}: платеж {self.payment_id}"
+
+class IdempotencyKey(models.Model):
+    # Idempotency-Key of an order/reservation request and the response it got (api/idempotency.py)
+    key = models.CharField(max_length=64, primary_key=True, verbose_name="Ключ")
+    fingerprint = models.CharField(max_length=64, verbose_name="Хэш запроса")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Код ответа")
+    response = models.TextField(blank=True, verbose_name="Ответ")
+    created_at = models.DateTimeField(db_index=True, verbose_name="Создан")
+
+    class Meta:
+        verbose_name = "Ключ идемпотентности"
+        verbose_name_plural = "Ключи идемпотентности"
+
+    def __str__(self):
+        return self.key
+
+class TrafficRollup(models.Model):
+    # Page views per path group; hourly rows are compacted into days and months by api/rollups.py
+    HOUR, DAY, MONTH = 'hour', 'day', 'month'
+    RESOLUTION_CHOICES = (
+        (HOUR, 'Час'),
+        (DAY, 'День'),
+        (MONTH, 'Месяц'),
+    )
+
+    resolution = models.CharField(max_length=5, choices=RESOLUTION_CHOICES, verbose_name="Интервал")
+    period_start = models.DateTimeField(verbose_name="Начало периода")
+    path_group = models.CharField(max_length=32, verbose_name="Раздел сайта")
+    views = models.PositiveIntegerField(default=0, verbose_name="Просмотры")
+
+    class Meta:
+        verbose_name = "Трафик по периодам"
+        verbose_name_plural = "Трафик по периодам"
+        unique_together = ('resolution', 'period_start', 'path_group')
+        indexes = [models.Index(fields=['period_start'], name='api_rollup_period_idx')]
+
+    def __str__(self):
+        return f"{self.path_group} {self.get_resolution_display()} {self.period_start:%d.%m.%Y %H:%M}"
+
+class MenuSnapshot(models.Model):
+    # Single row holding the pre-rendered /api/menu/ payload, see api/menu_snapshot.py
+    version = models.PositiveBigIntegerField(default=0, verbose_name="Версия меню")
+    etag = models.CharField(max_length=64, blank=True, verbose_name="ETag")
+    payload = models.TextField(blank=True, verbose_name="Данные меню (JSON)")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
+
     class Meta:
-        verbose_name = "Посетитель"
-        verbose_name_plural = "Посетители"
-        unique_together = ('ip_address', 'date')
+        verbose_name = "Снимок меню"
+        verbose_name_plural = "Снимки меню"
+
+    def __str__(self):
+        return f"Меню v{self.version}"
+
+class MenuTombstone(models.Model):
+    # Deleted menu rows, so delta clients know what to drop
+    KIND_CHOICES = [
+        ('category', 'Категория'),
+        ('product', 'Блюдо'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name="Тип")
+    object_id = models.PositiveBigIntegerField(verbose_name="ID объекта")
+    version = models.PositiveBigIntegerField(db_index=True, verbose_name="Версия меню")
+
+    class Meta:
+        verbose_name = "Удаленная позиция меню"
+        verbose_name_plural = "Удаленные позиции меню"
+
+    def __str__(self):
+        return f"{self.kind} #{self.object_id} (v{self.version})"
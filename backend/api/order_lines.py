@@ -0,0 +1,94 @@
+"""
+OrderLine rows from the Order.items JSON.
+
+create_order writes the lines together with the order; `manage.py
+backfill_order_lines` fills them in for older orders. Lines point at the
+Product when it can be found (by the id the cart sends, or else by exact
+title) and always keep the title and price as they were at order time.
+"""
+import json
+from decimal import Decimal
+
+from django.db import transaction
+
+from .models import Order, OrderLine, Product
+
+
+def parse_items(items):
+    """[(product id or None, title, quantity, unit price)]; empty if items isn't the usual JSON."""
+    try:
+        data = json.loads(items or '[]') if isinstance(items, str) else items
+    except ValueError:
+        return []
+    if not isinstance(data, list):
+        return []
+
+    lines = []
+    for item in data:
+        if not isinstance(item, dict) or not item.get('title'):
+            continue
+        try:
+            product_id = int(item['id']) if item.get('id') is not None else None
+            quantity = int(item.get('quantity') or 0)
+            price = Decimal(str(item.get('price') or 0))
+        except (TypeError, ValueError, ArithmeticError):
+            continue
+        if quantity > 0:
+            lines.append((product_id, str(item['title'])[:200], quantity, price))
+    return lines
+
+
+def build_lines(orders):
+    """Unsaved OrderLine objects for the given orders, with products resolved in two queries."""
+    parsed = [(order, parse_items(order.items)) for order in orders]
+    ids = {product_id for _, lines in parsed for product_id, *_ in lines if product_id}
+    titles = {title for _, lines in parsed for product_id, title, *_ in lines if not product_id}
+
+    known_ids = set(Product.objects.filter(pk__in=ids).values_list('pk', flat=True)) if ids else set()
+    by_title = dict(Product.objects.filter(title__in=titles).values_list('title', 'pk')) if titles else {}
+
+    result = []
+    for order, lines in parsed:
+        for product_id, title, quantity, price in lines:
+            if product_id not in known_ids:
+                product_id = by_title.get(title)
+            result.append(OrderLine(
+                order=order,
+                product_id=product_id,
+                title=title,
+                unit_price=price,
+                quantity=quantity,
+                created_at=order.created_at,
+            ))
+    return result
+
+
+def create_for(order):
+    OrderLine.objects.bulk_create(build_lines([order]))
+
+
+def backfill(chunk_size=500, progress=None):
+    """
+    Writes lines for orders that have none, oldest first, one transaction per
+    chunk. Interrupted runs just continue: finished orders already have lines.
+    Returns (orders, lines) written.
+    """
+    last_pk = 0
+    orders_done = lines_done = 0
+    while True:
+        chunk = list(
+            Order.objects.filter(pk__gt=last_pk, lines__isnull=True)
+            .order_by('pk')
+            .only('pk', 'items', 'created_at')[:chunk_size]
+        )
+        if not chunk:
+            return orders_done, lines_done
+
+        with transaction.atomic():
+            lines = OrderLine.objects.bulk_create(build_lines(chunk), batch_size=500)
+
+        last_pk = chunk[-1].pk
+        orders_done += len(chunk)
+        lines_done += len(lines)
+        if progress:
+            progress(orders_done, lines_done, last_pk)
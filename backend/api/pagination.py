@@ -0,0 +1,56 @@
+"""
+Keyset ("cursor") pagination over (created_at, id), newest first.
+
+The cursor is the position of the last row of the previous page, so each
+page is one range query on an index that ends in created_at (SQLite keeps
+the id in every index) no matter how deep the client scrolls, and rows
+added meanwhile don't shift the pages. Each source gets one such query and
+the results are merged, so live and archived orders page as one list.
+"""
+import base64
+import binascii
+
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(row):
+    position = f"{row.created_at.isoformat()}|{row.pk}"
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        position = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, pk = position.rsplit('|', 1)
+        created_at = parse_datetime(created_at)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if created_at is None:
+        raise InvalidCursor(cursor)
+    return created_at, pk
+
+
+def page(querysets, cursor=None, limit=20):
+    """
+    (rows, next cursor or None) for the page after `cursor`, merged from
+    one or more querysets with unique pks (live and archived orders). A row
+    found in two of them (mid-archiving) is taken from the first.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    rows = {}
+    for queryset in querysets:
+        if position:
+            created_at, pk = position
+            # (created_at, id) < (cursor): a range on created_at the index can seek to
+            queryset = queryset.filter(created_at__lte=created_at).exclude(created_at=created_at, pk__gte=pk)
+        for row in queryset.order_by('-created_at', '-pk')[:limit + 1]:
+            rows.setdefault(row.pk, row)
+    rows = sorted(rows.values(), key=lambda row: (row.created_at, row.pk), reverse=True)
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
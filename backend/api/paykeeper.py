@@ -1,122 +1,281 @@
+"""
+PayKeeper integration: invoices through the JSON API and notification checks.
+
+An invoice is created backend-to-backend: a token from /info/settings/token/
+(cached, PayKeeper keeps it valid for a day) and a POST to
+/change/invoice/preview/, authenticated with the API user
+(PAYKEEPER_USER / PAYKEEPER_PASSWORD). The resulting link is stored on the
+order, so asking for it again never creates a second invoice.
+
+Each process keeps one pooled httpx client, requests have strict timeouts
+and are retried with exponential backoff. The async client is only used
+over ASGI, where its event loop lives as long as the process. Under WSGI
+every async view gets a loop of its own, so order_payment uses the sync
+client there. Invoice creation
+is only retried when PayKeeper can't have seen the request (connection
+errors, 502/503/504), otherwise a retry could issue two invoices.
+
+Without API credentials get_payment_url() falls back to the preview link
+with query parameters that was used before.
+"""
+import asyncio
 import hashlib
+import hmac
+import threading
+import time
 import urllib.parse
+
+import httpx
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import transaction
+
+from .models import Order
+
+RETRY_STATUSES = {502, 503, 504}
+# Errors raised before the request reached PayKeeper
+NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class PayKeeperError(Exception):
+    pass
+
+
+class PayKeeperClient:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.client = None
+        self.async_client = None
+        self.token = None
+        self.token_expires = 0
+
+    def client_options(self):
+        return {
+            'base_url': settings.PAYKEEPER_SERVER_URL.rstrip('/'),
+            'auth': (settings.PAYKEEPER_USER, settings.PAYKEEPER_PASSWORD),
+            'timeout': httpx.Timeout(settings.PAYKEEPER_TIMEOUT, connect=settings.PAYKEEPER_CONNECT_TIMEOUT),
+            'limits': httpx.Limits(max_connections=10, max_keepalive_connections=5),
+        }
+
+    def get_client(self):
+        with self.lock:
+            if self.client is None:
+                self.client = httpx.Client(**self.client_options())
+            return self.client
+
+    def get_async_client(self):
+        # An AsyncClient belongs to the event loop it was first used on
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.async_client is not None and self.async_client[0] is not loop:
+                self._drop_async_client()
+            if self.async_client is None:
+                self.async_client = (loop, httpx.AsyncClient(**self.client_options()))
+            return self.async_client[1]
+
+    def _drop_async_client(self):
+        loop, async_client = self.async_client
+        self.async_client = None
+        # Its connections can only be closed on its own loop
+        if not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(async_client.aclose(), loop)
+
+    def close(self):
+        with self.lock:
+            if self.client is not None:
+                self.client.close()
+            if self.async_client is not None:
+                self._drop_async_client()
+            self.client = None
+            self.token = None
+
+    # Requests
+
+    def should_retry(self, attempt, error=None, response=None, resend=True):
+        if attempt >= settings.PAYKEEPER_RETRIES:
+            return False
+        if error is not None:
+            return resend or isinstance(error, NOT_SENT)
+        return response.status_code in RETRY_STATUSES
+
+    def backoff(self, attempt):
+        return settings.PAYKEEPER_BACKOFF * 2 ** attempt
+
+    def send(self, method, url, resend=True, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                response = self.get_client().request(method, url, **kwargs)
+            except httpx.HTTPError as e:
+                if not self.should_retry(attempt, error=e, resend=resend):
+                    raise PayKeeperError(f"PayKeeper request failed: {e}") from e
+            else:
+                if not self.should_retry(attempt, response=response):
+                    return self.parse(response)
+            time.sleep(self.backoff(attempt))
+            attempt += 1
+
+    async def asend(self, method, url, resend=True, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                response = await self.get_async_client().request(method, url, **kwargs)
+            except httpx.HTTPError as e:
+                if not self.should_retry(attempt, error=e, resend=resend):
+                    raise PayKeeperError(f"PayKeeper request failed: {e}") from e
+            else:
+                if not self.should_retry(attempt, response=response):
+                    return self.parse(response)
+            await asyncio.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def parse(self, response):
+        if response.status_code != 200:
+            raise PayKeeperError(f"PayKeeper answered {response.status_code}")
+        try:
+            data = response.json()
+        except ValueError:
+            raise PayKeeperError("PayKeeper answered with invalid JSON")
+        if isinstance(data, dict) and data.get('result') == 'fail':
+            raise PayKeeperError(f"PayKeeper error: {data.get('msg', '')}")
+        return data
+
+    # Invoices
+
+    def invoice_form(self, order, token):
+        return {
+            'pay_amount': str(order.total_price),
+            'orderid': str(order.pk),
+            'clientid': order.name,
+            'client_phone': order.phone,
+            'service_name': f"Заказ №{order.pk}",
+            'token': token,
+        }
+
+    def invoice_link(self, data):
+        invoice_id = data.get('invoice_id') if isinstance(data, dict) else None
+        if not invoice_id:
+            raise PayKeeperError("PayKeeper returned no invoice_id")
+        url = data.get('invoice_url') or f"{settings.PAYKEEPER_SERVER_URL.rstrip('/')}/bill/{invoice_id}/"
+        return str(invoice_id), url
+
+    def cached_token(self):
+        if self.token and time.monotonic() < self.token_expires:
+            return self.token
+        return None
+
+    def store_token(self, data):
+        if not isinstance(data, dict) or not data.get('token'):
+            raise PayKeeperError("PayKeeper returned no token")
+        self.token = data['token']
+        self.token_expires = time.monotonic() + settings.PAYKEEPER_TOKEN_SECONDS
+        return self.token
 
-def get_payment_url(order_id, amount, client_name="", client_phone="", client_email=""):
+    def get_token(self):
+        return self.cached_token() or self.store_token(self.send('GET', '/info/settings/token/'))
+
+    async def aget_token(self):
+        return self.cached_token() or self.store_token(await self.asend('GET', '/info/settings/token/'))
+
+    def create_invoice(self, order):
+        """(invoice_id, invoice_url) for a new PayKeeper invoice."""
+        try:
+            data = self.send('POST', '/change/invoice/preview/', resend=False,
+                             data=self.invoice_form(order, self.get_token()))
+        except PayKeeperError:
+            self.token = None  # it may have been revoked, fetch a new one next time
+            raise
+        return self.invoice_link(data)
+
+    async def acreate_invoice(self, order):
+        try:
+            data = await self.asend('POST', '/change/invoice/preview/', resend=False,
+                                    data=self.invoice_form(order, await self.aget_token()))
+        except PayKeeperError:
+            self.token = None
+            raise
+        return self.invoice_link(data)
+
+
+client = PayKeeperClient()
+
+
+def api_configured():
+    return bool(settings.PAYKEEPER_USER and settings.PAYKEEPER_PASSWORD)
+
+
+def store_invoice(order, invoice_id, invoice_url):
+    # Only the first invoice sticks if two requests raced
+    updated = Order.objects.filter(pk=order.pk, invoice_url='').update(invoice_id=invoice_id, invoice_url=invoice_url)
+    if not updated:
+        order.refresh_from_db(fields=['invoice_id', 'invoice_url'])
+    else:
+        order.invoice_id, order.invoice_url = invoice_id, invoice_url
+    return order.invoice_url
+
+
+def get_payment_url(order):
+    """Payment link for the order, creating the PayKeeper invoice on first use."""
+    if order.invoice_url:
+        return order.invoice_url
+    if not api_configured():
+        return preview_url(order)
+    return store_invoice(order, *client.create_invoice(order))
+
+
+async def aget_payment_url(order):
+    if order.invoice_url:
+        return order.invoice_url
+    if not api_configured():
+        return preview_url(order)
+    return await sync_to_async(store_invoice)(order, *await client.acreate_invoice(order))
+
+
+def preview_url(order):
+    """Invoice preview form prefilled through query parameters (no API user needed)."""
+    query_string = urllib.parse.urlencode({
+        "sum": order.total_price,
+        "orderid": order.pk,
+        "clientid": order.name,
+        "client_phone": order.phone,
+        "client_email": "",
+        "service_name": f"Заказ №{order.pk}",
+    })
+    return f"{settings.PAYKEEPER_SERVER_URL.rstrip('/')}/change/invoice/preview/?{query_string}"
+
+
+def mark_paid(order_id, payment_id):
     """
-    Generates a PayKeeper payment URL.
-    
-    Args:
-        order_id (str|int): The order ID.
-        amount (float|int): The order amount.
-        client_name (str): Client's name.
-        client_phone (str): Client's phone.
-        client_email (str): Client's email.
-        
-    Returns:
-        str: The full payment URL to redirect the user to.
+    Marks the order paid by payment_id. The conditional UPDATE on is_paid
+    decides the race: True only for the call that actually changed it,
+    duplicates get False. The winner then switches payment_method to online
+    through save(), so the sales rollups move the revenue.
     """
-    
-    server_url = settings.PAYKEEPER_SERVER_URL.rstrip('/')
-    secret_key = settings.PAYKEEPER_SECRET_KEY
-    
-    payment_data = {
-        "sum": amount,
-        "orderid": order_id,
-        "clientid": client_name,
-        "client_phone": client_phone,
-        "client_email": client_email,
-        "service_name": f"Заказ №{order_id}"
-    }
-    
-    # PayKeeper allows passing parameters via POST or GET (if supported by the specific server config).
-    # Ideally, we should use POST to /create/, but for simple redirection a GET with parameters 
-    # to the form page is the most common "simple" integration (Invoice method).
-    # However, proper integration usually sends a POST request to get a specific invoice link 
-    # OR generates a form that the user submits.
-    # 
-    # Method 1 (Direct Form Link with GET params - easiest if supported):
-    # url = f"{server_url}/bill/fast/?sum={amount}&orderid={order_id}..."
-    #
-    # Method 2 (Signature generation for secure forms):
-    # Some PayKeeper setups require a signature.
-    #
-    # Let's implement the standard logical approach for "Redirect to Payment"
-    # referencing common PayKeeper docs. A safe bet is using the /create/ endpoint 
-    # which typically returns a JSON with the invoice URL, OR constructing a direct link.
-    #
-    # Given we want to return a URL to the frontend to redirect:
-    # We will construct a signed URL if we can, or a direct link to the payment form.
-    #
-    # Common pattern: server_url + /bill/fast/ (Fast form) is deprecated often.
-    # Correct pattern: server_url + /create/ (API to create invoice) -> returns link.
-    
-    # Let's try the API approach to get a clean link properly.
-    # If the user doesn't have an API user set up, this might fail.
-    # BUT, many integrations just want a form link. 
-    #
-    # Simplest working solution usually found in PayKeeper plugins:
-    # URL: server_url + /change/invoice/preview/
-    # with POST data.
-    
-    # Let's assume the user wants the "Simple" integration where we generate a link
-    # that pre-fills the form.
-    # URL: {server_url}/bill/{order_id}/?sum={amount}&...
-    
-    # Wait, the official docs usually say:
-    # Form action: {server_url}/create/ 
-    # It returns a redirect or JSON.
-    
-    # Let's stick to generating a URL that the frontend redirects to.
-    # If we simply construct {server_url}/bill/... it might not work if not configured.
-    
-    # Let's use the most robust method:
-    # Generate parameters for a form, but since we need a URL:
-    # We will construct a link to /create/ with GET parameters if the server supports it,
-    # OR we make a request from backend to PayKeeper to get the invoice_url.
-    
-    # DECISION: Backend-to-Backend request to get the invoice link is safer and cleaner.
-     
-    # Note: Accessing /create/ via API requires Basic Auth usually (login/password),
-    # NOT just a secret key. The Secret Key is for callbacks.
-    # Since the user only has a "Secret Key" in common knowledge, they might not have API users set up.
-    
-    # Alternative: The "Form" integration (POST to server_url/order/inline/)
-    # We can returns a URL that is just the server_url, and the frontend posts a form?
-    # No, the frontend expects a `payment_url` to redirect to.
-    
-    # Let's use the "Payment Link" generation format if we only have a Secret Key.
-    # Actually, PayKeeper often accepts GET requests to /create/ with parameters for simple forms.
-    
-    # Let's use the simplest: 
-    # {server_url}/change/invoice/preview/?clientid={...}&orderid={...}&sum={...}
-    # This often shows the payment page.
-    
-    query_string = urllib.parse.urlencode(payment_data)
-    
-    # Using /order/inline/ or just root / often works for redirect with params
-    # But let's build the standard "Link to Pay" style.
-    
-    full_url = f"{server_url}/change/invoice/preview/?{query_string}"
-    return full_url
+    with transaction.atomic(savepoint=False):
+        paid = Order.objects.filter(pk=order_id, is_paid=False).update(is_paid=True, payment_id=payment_id)
+        if paid:
+            # Through save() so the sales rollups see the payment method change
+            for order in Order.objects.filter(pk=order_id).exclude(payment_method='online'):
+                order.payment_method = 'online'
+                order.save(update_fields=['payment_method'])
+    return bool(paid)
+
+
+def notification_hash(payment_id):
+    """md5(id + secret): the notification's key, and the hash in the "OK <hash>" answer."""
+    return hashlib.md5(f"{payment_id}{settings.PAYKEEPER_SECRET_KEY}".encode('utf-8')).hexdigest()
+
 
 def verify_signature(payment_id, key):
     """
     Verifies the PayKeeper notification signature.
-    
+
     Args:
         payment_id (str): PayKeeper system ID.
-        key (str): The MD5 has sent by PayKeeper.
-        
+        key (str): The MD5 hash sent by PayKeeper.
+
     Returns:
         bool: True if signature matches.
     """
-    secret_key = settings.PAYKEEPER_SECRET_KEY
-    
-    # Calculate hash: md5(id + secret_key)
-    # Standard PayKeeper notification hash
-    data_str = f"{payment_id}{secret_key}"
-    calculated_hash = hashlib.md5(data_str.encode('utf-8')).hexdigest()
-    
-    return calculated_hash == key
-
+    # Constant time, so the hash can't be guessed byte by byte
+    return hmac.compare_digest(notification_hash(payment_id).encode(), str(key).encode())
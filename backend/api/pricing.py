@@ -0,0 +1,131 @@
+"""
+Server-side cart pricing.
+
+Orders used to be saved with whatever items and total_price the browser
+sent. quote() prices a cart from the current menu instead: dishes from
+Product.price, business lunch combos from today's BusinessLunch, plus the
+delivery fee.
+
+Prices come from a per-worker table built from the menu snapshot and
+rebuilt when its version changes (every Product/Category save bumps it, see
+menu_snapshot.py). So a quote costs the snapshot's version check and no
+per-item queries.
+"""
+import json
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+
+from . import lunch, menu_snapshot
+
+COMBOS = {
+    '3_course': ('price_3_course', "Бизнес-ланч: 3 блюда"),
+    'salad_soup': ('price_salad_soup', "Бизнес-ланч: салат + суп"),
+    'salad_hot': ('price_salad_hot', "Бизнес-ланч: салат + горячее"),
+    'soup_hot': ('price_soup_hot', "Бизнес-ланч: суп + горячее"),
+}
+
+MAX_QUANTITY = 99
+
+
+class PricingError(ValueError):
+    pass
+
+
+class PriceTable:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.by_id = {}      # product id -> (title, price)
+        self.by_title = {}   # title -> product id, for carts saved before ids were sent
+
+    def current(self):
+        snapshot = menu_snapshot.get_snapshot()
+        if snapshot.version != self.version:
+            with self.lock:
+                if snapshot.version != self.version:
+                    products = json.loads(snapshot.payload)['products']
+                    # Prices are whole rubles (decimal_places=0)
+                    self.by_id = {p['id']: (p['title'], int(Decimal(str(p['price'])))) for p in products}
+                    self.by_title = {p['title']: p['id'] for p in products}
+                    self.version = snapshot.version
+        return self
+
+
+table = PriceTable()
+
+
+def parse_cart(items):
+    """Cart items as sent by CartModal: a list (or its JSON string) of {id, title, quantity} / {lunch, quantity}."""
+    if isinstance(items, str):
+        try:
+            items = json.loads(items)
+        except ValueError:
+            raise PricingError("Некорректный состав заказа")
+    if not isinstance(items, list) or not items:
+        raise PricingError("Корзина пуста")
+    return items
+
+
+def quantity_of(item):
+    try:
+        quantity = int(item.get('quantity', 1))
+    except (TypeError, ValueError):
+        raise PricingError("Некорректное количество")
+    if not 1 <= quantity <= MAX_QUANTITY:
+        raise PricingError("Некорректное количество")
+    return quantity
+
+
+def quote(items, delivery=True):
+    prices = table.current()
+    today_lunch = None
+
+    lines = []
+    for item in parse_cart(items):
+        if not isinstance(item, dict):
+            raise PricingError("Некорректный состав заказа")
+        quantity = quantity_of(item)
+
+        if item.get('lunch'):
+            combo = COMBOS.get(item['lunch'])
+            if combo is None:
+                raise PricingError("Неизвестный вариант бизнес-ланча")
+            if today_lunch is None:
+                today_lunch = lunch.get_lunch()
+                if not today_lunch:
+                    raise PricingError("Бизнес-ланч сегодня недоступен")
+            field, title = combo
+            lines.append({'id': None, 'lunch': item['lunch'], 'title': title,
+                          'price': int(today_lunch[field]), 'quantity': quantity})
+            continue
+
+        product_id = item.get('id')
+        if product_id not in prices.by_id:
+            product_id = prices.by_title.get(item.get('title'))
+        if product_id is None:
+            raise PricingError(f"Блюдо «{item.get('title', '')}» больше недоступно")
+        title, price = prices.by_id[product_id]
+        lines.append({'id': product_id, 'title': title, 'price': price, 'quantity': quantity})
+
+    items_total = sum(line['price'] * line['quantity'] for line in lines)
+    delivery_fee = 0
+    if delivery and items_total < settings.FREE_DELIVERY_FROM:
+        delivery_fee = settings.DELIVERY_FEE
+
+    return {
+        'menu_version': prices.version,
+        'lines': lines,
+        'items_total': items_total,
+        'delivery_fee': delivery_fee,
+        'total': items_total + delivery_fee,
+    }
+
+
+def items_json(priced):
+    """Order.items in the format the admin and order_lines expect."""
+    return json.dumps([
+        {'id': line['id'], 'title': line['title'], 'quantity': line['quantity'], 'price': line['price']}
+        for line in priced['lines']
+    ], ensure_ascii=False)
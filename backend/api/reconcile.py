@@ -0,0 +1,175 @@
+"""
+Reconciliation of a PayKeeper payment export against our orders.
+
+The callback is the only thing that marks an order paid, so a notification
+that never arrived leaves a paid order looking unpaid. `manage.py
+reconcile_paykeeper <export>` streams the export (CSV, JSON array or JSON
+Lines), looks the orders up in batches with in_bulk() and reports:
+
+- missing_callback: paid in PayKeeper, the order isn't marked paid
+- amount_mismatch: the payment sum differs from the order total
+- other_payment: the order is marked paid by a different payment (paid twice?)
+- orphan: a payment whose order doesn't exist
+
+Orders that were archived are looked up in ArchivedOrder. Only the current
+batch is held in memory. With apply=True missing callbacks of live orders
+are booked through the same conditional update as the callback itself.
+"""
+import csv
+import json
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from . import paykeeper
+from .models import ArchivedOrder, Order, PaymentEvent
+
+ISSUES = {
+    'missing_callback': "Оплачено в PayKeeper, но заказ не отмечен оплаченным",
+    'amount_mismatch': "Сумма платежа не совпадает с суммой заказа",
+    'other_payment': "Заказ отмечен оплаченным другим платежом",
+    'orphan': "Платеж без заказа",
+}
+
+# Export column names, English API names first, then the headers of the
+# cabinet's CSV export
+COLUMNS = {
+    'payment_id': ('id', 'payment_id', 'ID платежа', 'Номер платежа'),
+    'order_id': ('orderid', 'order_id', 'Номер заказа'),
+    'amount': ('pay_amount', 'sum', 'amount', 'Сумма'),
+    'status': ('status', 'Статус'),
+}
+
+ORDER_FIELDS = ('pk', 'is_paid', 'payment_id', 'total_price')
+
+# Rows with another status (refunded, canceled, pending...) are skipped
+SUCCESS_STATUSES = {'success', 'obtained', 'успешно', 'получен'}
+
+
+def read_rows(path, fmt=None):
+    """Export rows as dicts, one at a time."""
+    fmt = fmt or ('csv' if str(path).lower().endswith('.csv') else 'json')
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if fmt == 'csv':
+            sample = f.read(4096)
+            f.seek(0)
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+            yield from csv.DictReader(f, dialect=dialect)
+        else:
+            yield from iter_json(f)
+
+
+def iter_json(f, chunk_size=1 << 16):
+    """Objects of a top-level JSON array or of JSON Lines, decoded one by one."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    while True:
+        buffer = buffer.lstrip(' \t\r\n,[]')
+        if buffer:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except ValueError:
+                if eof:
+                    raise ValueError(f"Invalid JSON near: {buffer[:80]!r}")
+            else:
+                yield item
+                buffer = buffer[end:]
+                continue
+        elif eof:
+            return
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+
+
+def field(row, name):
+    for column in COLUMNS[name]:
+        value = row.get(column)
+        if value not in (None, ''):
+            return str(value).strip()
+    return ''
+
+
+def parse_amount(value):
+    try:
+        return Decimal(value.replace('\xa0', '').replace(' ', '').replace(',', '.'))
+    except InvalidOperation:
+        return None
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+class Result:
+    def __init__(self):
+        self.rows = 0
+        self.skipped = 0
+        self.matched = 0
+        self.applied = 0
+        self.issues = Counter()
+
+
+def reconcile(rows, batch_size=1000, apply=False, on_issue=None):
+    """
+    Checks export rows against orders, batch_size rows per query. on_issue is
+    called as on_issue(kind, payment_id, order_id, amount, order) for every
+    problem found. Returns a Result with the counts.
+    """
+    result = Result()
+    for batch in batched(rows, batch_size):
+        check_batch(batch, result, apply, on_issue)
+    return result
+
+
+def check_batch(batch, result, apply, on_issue):
+    payments = []
+    for row in batch:
+        result.rows += 1
+        status = field(row, 'status').lower()
+        if status and status not in SUCCESS_STATUSES:
+            result.skipped += 1
+            continue
+        order_id = field(row, 'order_id')
+        payments.append((
+            field(row, 'payment_id'),
+            int(order_id) if order_id.isdigit() else None,
+            parse_amount(field(row, 'amount')),
+            row,
+        ))
+
+    order_ids = {order_id for _, order_id, _, _ in payments if order_id}
+    orders = Order.objects.only(*ORDER_FIELDS).in_bulk(order_ids)
+    if missing := order_ids - orders.keys():
+        orders.update(ArchivedOrder.objects.only(*ORDER_FIELDS).in_bulk(missing))
+
+    for payment_id, order_id, amount, row in payments:
+        order = orders.get(order_id)
+        if order is None:
+            kind = 'orphan'
+        elif amount is not None and amount != order.total_price:
+            kind = 'amount_mismatch'
+        elif not order.is_paid:
+            kind = 'missing_callback'
+        elif order.payment_id != payment_id:
+            kind = 'other_payment'
+        else:
+            result.matched += 1
+            continue
+
+        result.issues[kind] += 1
+        if on_issue:
+            on_issue(kind, payment_id, order_id, amount, order)
+        # Archived orders are only reported, mark_paid() works on live ones
+        if (kind == 'missing_callback' and apply and payment_id and isinstance(order, Order)
+                and paykeeper.mark_paid(order.pk, payment_id)):
+            PaymentEvent.objects.create(
+                order_id=order.pk, payment_id=payment_id[:100], amount=amount, outcome='reconciled',
+                payload=json.dumps(row, ensure_ascii=False, default=str),
+            )
+            # The next row for this order must see it paid
+            order.is_paid, order.payment_id = True, payment_id
+            result.applied += 1
@@ -0,0 +1,117 @@
+"""
+Compaction and retention for traffic rollups (see TrafficRollup).
+
+The traffic buffer writes hourly rows per path group. compact_traffic folds
+hours older than TRAFFIC_HOURLY_RETENTION_DAYS into days and days older than
+TRAFFIC_DAILY_RETENTION_DAYS into months, which are kept for good, so a year
+of traffic is a few hundred rows.
+
+Every day (or month) is moved in its own short transaction: sum the source
+rows, add them to the target row, delete them. The SQLite write lock is only
+held for one period at a time, and a view is always counted in exactly one
+row, so an interrupted run simply continues next time.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import DailyStats, TrafficRollup
+
+
+def day_start(moment):
+    return timezone.localtime(moment).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def month_start(moment):
+    return day_start(moment).replace(day=1)
+
+
+def add_months(moment, count):
+    years, month = divmod(moment.month - 1 + count, 12)
+    return moment.replace(year=moment.year + years, month=month + 1)
+
+
+def next_day(moment):
+    # Through localtime so DST-observing zones still land on midnight
+    return day_start(moment + timedelta(hours=36))
+
+
+def next_month(moment):
+    return add_months(moment, 1)
+
+
+def compact(source, target, cutoff, period_start, period_end):
+    """Moves `source` rows older than `cutoff` into `target` rows, one period per transaction."""
+    periods = 0
+    while True:
+        with transaction.atomic():
+            first = (TrafficRollup.objects
+                     .filter(resolution=source, period_start__lt=cutoff)
+                     .order_by('period_start')
+                     .values_list('period_start', flat=True)
+                     .first())
+            if first is None:
+                return periods
+
+            start = period_start(first)
+            rows = TrafficRollup.objects.filter(
+                resolution=source, period_start__gte=start, period_start__lt=min(period_end(start), cutoff),
+            )
+            totals = dict(rows.values_list('path_group').annotate(total=Sum('views')).order_by())
+
+            TrafficRollup.objects.bulk_create(
+                [TrafficRollup(resolution=target, period_start=start, path_group=group) for group in totals],
+                ignore_conflicts=True,
+            )
+            for group, views in totals.items():
+                TrafficRollup.objects.filter(
+                    resolution=target, period_start=start, path_group=group,
+                ).update(views=F('views') + views)
+            rows.delete()
+            periods += 1
+
+
+def compact_hours(retention_days):
+    cutoff = day_start(timezone.now() - timedelta(days=retention_days))
+    return compact(TrafficRollup.HOUR, TrafficRollup.DAY, cutoff, day_start, next_day)
+
+
+def compact_days(retention_days):
+    cutoff = month_start(timezone.now() - timedelta(days=retention_days))
+    return compact(TrafficRollup.DAY, TrafficRollup.MONTH, cutoff, month_start, next_month)
+
+
+def prune_sketches(retention_days, chunk_size=500):
+    """Drops visitor sketches of old days in small batches; the daily counts stay."""
+    cutoff = timezone.localdate() - timedelta(days=retention_days)
+    pruned = 0
+    while True:
+        with transaction.atomic():
+            ids = list(DailyStats.objects
+                       .filter(date__lt=cutoff, visitor_sketch__isnull=False)
+                       .values_list('pk', flat=True)[:chunk_size])
+            if not ids:
+                return pruned
+            DailyStats.objects.filter(pk__in=ids).update(visitor_sketch=None)
+            pruned += len(ids)
+
+
+def monthly_views(months=12):
+    """[(month, views)] for the last `months` months including the current one."""
+    start = add_months(month_start(timezone.now()), -(months - 1))
+    totals = {
+        timezone.localtime(row['month']).date(): row['views']
+        for row in (TrafficRollup.objects
+                    .filter(period_start__gte=start)
+                    .annotate(month=TruncMonth('period_start'))
+                    .values('month')
+                    .annotate(views=Sum('views'))
+                    .order_by())
+    }
+    return [
+        (month.date(), totals.get(month.date(), 0))
+        for month in (add_months(start, i) for i in range(months))
+    ]
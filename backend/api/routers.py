@@ -0,0 +1,44 @@
+"""
+Database router for the order archive.
+
+When ARCHIVE_DB_PATH is set, ArchivedOrder lives in its own SQLite file
+(the 'archive' database) and nothing else does, so the main database that
+every write locks only holds the live orders. Create its table with
+`manage.py migrate --database archive`. Without it the archive is a table
+in the main database and this router stays out of the way.
+"""
+from django.conf import settings
+
+ARCHIVE_DB = 'archive'
+
+
+def archive_enabled():
+    return ARCHIVE_DB in settings.DATABASES
+
+
+def is_archive(model):
+    return model._meta.app_label == 'api' and model._meta.model_name == 'archivedorder'
+
+
+class ArchiveRouter:
+    def db_for_read(self, model, **hints):
+        if is_archive(model) and archive_enabled():
+            return ARCHIVE_DB
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # ArchivedOrder.user points across databases, it has no constraint
+        if is_archive(type(obj1)) or is_archive(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not archive_enabled():
+            return None
+        if db == ARCHIVE_DB:
+            return app_label == 'api' and model_name == 'archivedorder'
+        if app_label == 'api' and model_name == 'archivedorder':
+            return False
+        return None
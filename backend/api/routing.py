@@ -0,0 +1,7 @@
+from django.urls import path
+
+from . import consumers
+
+websocket_urlpatterns = [
+    path('ws/admin/orders/', consumers.AdminOrdersConsumer.as_asgi()),
+]
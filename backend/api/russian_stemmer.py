@@ -0,0 +1,137 @@
+"""
+Snowball (Porter) stemmer for Russian.
+
+Pure Python port of https://snowballstem.org/algorithms/russian/stemmer.html,
+used by the dish search index so "шашлык", "шашлыки" and "шашлыками" end up
+under the same term. Expects lowercase input.
+"""
+
+VOWELS = set('аеиоуыэюя')
+
+PERFECTIVE_GERUND_1 = ('вшись', 'вши', 'в')  # preceded by а/я
+PERFECTIVE_GERUND_2 = ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв')
+
+ADJECTIVE = (
+    'ими', 'ыми', 'его', 'ого', 'ему', 'ому',
+    'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+    'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+)
+
+PARTICIPLE_1 = ('ем', 'нн', 'вш', 'ющ', 'щ')  # preceded by а/я
+PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+
+REFLEXIVE = ('ся', 'сь')
+
+VERB_1 = (  # preceded by а/я
+    'ете', 'йте', 'ешь', 'нно',
+    'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть',
+    'й', 'л', 'н',
+)
+VERB_2 = (
+    'ейте', 'уйте',
+    'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют',
+    'ены', 'ить', 'ыть', 'ишь',
+    'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую',
+    'ю',
+)
+
+NOUN = (
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях',
+    'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей', 'ой', 'ий', 'ям', 'ем', 'ам', 'ом',
+    'ах', 'ях', 'ию', 'ью', 'ия', 'ья',
+    'а', 'е', 'и', 'й', 'о', 'у', 'ы', 'ь', 'ю', 'я',
+)
+
+DERIVATIONAL = ('ость', 'ост')
+SUPERLATIVE = ('ейше', 'ейш')
+
+
+def _regions(word):
+    """Start offsets of RV and R2 (R1 is only needed to find R2)."""
+    length = len(word)
+    rv = length
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(start + 1, length):
+            if word[i] not in VOWELS and word[i - 1] in VOWELS:
+                return i + 1
+        return length
+
+    r1 = next_region(0)
+    r2 = next_region(r1)
+    return rv, r2
+
+
+def _longest(word, endings, start):
+    """Longest ending from `endings` that lies entirely after `start`."""
+    best = None
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= start:
+            if best is None or len(ending) > len(best):
+                best = ending
+    return best
+
+
+def _strip(word, endings_after_a, endings, start):
+    """
+    Removes the longest matching ending. Endings of the first group must be
+    preceded by а or я, which stays in the word.
+    """
+    first = _longest(word, endings_after_a, start + 1)
+    second = _longest(word, endings, start)
+    if first and word[-len(first) - 1] not in 'ая':
+        first = None
+    if first and (not second or len(first) > len(second)):
+        return word[:-len(first)], True
+    if second:
+        return word[:-len(second)], True
+    return word, False
+
+
+def stem(word):
+    word = word.replace('ё', 'е')
+    rv, r2 = _regions(word)
+
+    # Step 1
+    word, removed = _strip(word, PERFECTIVE_GERUND_1, PERFECTIVE_GERUND_2, rv)
+    if not removed:
+        ending = _longest(word, REFLEXIVE, rv)
+        if ending:
+            word = word[:-len(ending)]
+
+        ending = _longest(word, ADJECTIVE, rv)
+        if ending:
+            word = word[:-len(ending)]
+            word, _ = _strip(word, PARTICIPLE_1, PARTICIPLE_2, rv)
+        else:
+            word, removed = _strip(word, VERB_1, VERB_2, rv)
+            if not removed:
+                ending = _longest(word, NOUN, rv)
+                if ending:
+                    word = word[:-len(ending)]
+
+    # Step 2
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Step 3
+    ending = _longest(word, DERIVATIONAL, r2)
+    if ending:
+        word = word[:-len(ending)]
+
+    # Step 4
+    ending = _longest(word, SUPERLATIVE, rv)
+    if ending:
+        word = word[:-len(ending)]
+        if word.endswith('нн') and len(word) - 2 >= rv:
+            word = word[:-1]
+    elif word.endswith('нн') and len(word) - 2 >= rv:
+        word = word[:-1]
+    elif word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    return word
@@ -0,0 +1,160 @@
+"""
+Daily sales rollups (DailySales, DailyProductSales) for reports.
+
+An order is booked when it becomes completed, and taken back out if it
+leaves that status later (e.g. a completed order gets cancelled), against
+the local day it was placed. Range reports and the dashboard only read
+these rows, never the Order table. `manage.py backfill_sales` rebuilds them
+from the order history.
+"""
+from collections import Counter, defaultdict
+from decimal import Decimal
+from itertools import chain
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import order_lines
+from .models import ArchivedOrder, DailyProductSales, DailySales, Order
+
+PAYMENT_FIELDS = {
+    'cash': 'revenue_cash',
+    'online': 'revenue_online',
+    'transfer': 'revenue_transfer',
+}
+
+STATE_FIELDS = ('status', 'total_price', 'payment_method', 'items')
+
+
+def parse_items(items):
+    """[(title, quantity, line total)] from Order.items."""
+    return [(title, quantity, price * quantity) for _, title, quantity, price in order_lines.parse_items(items)]
+
+
+class DayTotals:
+    """What a set of orders adds to (or, with sign=-1, removes from) one day."""
+
+    def __init__(self):
+        self.orders = 0
+        self.revenue = Decimal(0)
+        self.by_payment = Counter()
+        self.dishes = defaultdict(lambda: [0, Decimal(0)])
+
+    def add(self, order, sign=1):
+        total = Decimal(order['total_price'] or 0) * sign
+        self.orders += sign
+        self.revenue += total
+        self.by_payment[PAYMENT_FIELDS.get(order['payment_method'], 'revenue_cash')] += total
+        for title, quantity, line_total in parse_items(order['items']):
+            dish = self.dishes[title]
+            dish[0] += quantity * sign
+            dish[1] += line_total * sign
+
+    def sales_fields(self):
+        return {'orders': self.orders, 'revenue': self.revenue, **{field: self.by_payment[field] for field in PAYMENT_FIELDS.values()}}
+
+
+def apply(day, totals):
+    with transaction.atomic():
+        DailySales.objects.bulk_create([DailySales(date=day)], ignore_conflicts=True)
+        DailySales.objects.filter(date=day).update(
+            **{field: F(field) + value for field, value in totals.sales_fields().items()}
+        )
+        DailyProductSales.objects.bulk_create(
+            [DailyProductSales(date=day, title=title) for title in totals.dishes],
+            ignore_conflicts=True,
+        )
+        for title, (quantity, revenue) in totals.dishes.items():
+            DailyProductSales.objects.filter(date=day, title=title).update(
+                quantity=F('quantity') + quantity,
+                revenue=F('revenue') + revenue,
+            )
+
+
+def record(order, before):
+    """post_save: books the order if it became completed, reverses it if it stopped being."""
+    current = {field: getattr(order, field) for field in STATE_FIELDS}
+    was_completed = before is not None and before['status'] == 'completed'
+    is_completed = order.status == 'completed'
+    if not was_completed and not is_completed:
+        return
+    if was_completed and is_completed and before == current:
+        return
+
+    totals = DayTotals()
+    if was_completed:
+        totals.add(before, sign=-1)
+    if is_completed:
+        totals.add(current)
+    apply(timezone.localdate(order.created_at), totals)
+
+
+def record_delete(order):
+    if order.status == 'completed':
+        totals = DayTotals()
+        totals.add({field: getattr(order, field) for field in STATE_FIELDS}, sign=-1)
+        apply(timezone.localdate(order.created_at), totals)
+
+
+def rebuild(chunk_size=2000):
+    """Recomputes all rollups from completed orders, live and archived, streaming them in chunks. Returns (orders, days)."""
+    with transaction.atomic():
+        days = defaultdict(DayTotals)
+        count = 0
+        orders = chain.from_iterable(
+            model.objects.filter(status='completed').values('created_at', *STATE_FIELDS).iterator(chunk_size=chunk_size)
+            for model in (Order, ArchivedOrder)
+        )
+        for order in orders:
+            days[timezone.localdate(order['created_at'])].add(order)
+            count += 1
+
+        DailyProductSales.objects.all().delete()
+        DailySales.objects.all().delete()
+        DailySales.objects.bulk_create(
+            [DailySales(date=day, **totals.sales_fields()) for day, totals in days.items()],
+            batch_size=500,
+        )
+        DailyProductSales.objects.bulk_create(
+            [DailyProductSales(date=day, title=title, quantity=quantity, revenue=revenue)
+             for day, totals in days.items()
+             for title, (quantity, revenue) in totals.dishes.items()],
+            batch_size=500,
+        )
+    return count, len(days)
+
+
+def top_dishes(start, end, limit=10):
+    return list(
+        DailyProductSales.objects.filter(date__range=(start, end))
+        .values('title')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('revenue'))
+        .filter(quantity__gt=0)
+        .order_by('-quantity', 'title')[:limit]
+    )
+
+
+def report(start, end, limit=10):
+    """Totals, per-day figures and top dishes for a date range (inclusive), from rollups only."""
+    days = list(DailySales.objects.filter(date__range=(start, end)).order_by('date'))
+    totals = DayTotals()
+    for day in days:
+        totals.orders += day.orders
+        totals.revenue += day.revenue
+        for field in PAYMENT_FIELDS.values():
+            totals.by_payment[field] += getattr(day, field)
+
+    return {
+        'start': start,
+        'end': end,
+        'orders': totals.orders,
+        'revenue': totals.revenue,
+        'average_check': round(totals.revenue / totals.orders) if totals.orders else 0,
+        'by_payment': {method: totals.by_payment[field] for method, field in PAYMENT_FIELDS.items()},
+        'days': [
+            {'date': day.date, 'orders': day.orders, 'revenue': day.revenue, 'average_check': day.average_check}
+            for day in days
+        ],
+        'top_dishes': top_dishes(start, end, limit),
+    }
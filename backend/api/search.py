@@ -0,0 +1,285 @@
+"""
+In-memory dish search for /api/menu/search/.
+
+Every worker keeps an inverted index over Product.title/description:
+
+    postings:  stem -> {product_id: weight}
+    trigrams:  trigram -> {stem}      (typo tolerance)
+    vocabulary: sorted stems          (prefix matching while typing)
+
+The index is built from the menu snapshot on first use (and warmed up when
+the WSGI app loads), updated right away from Product signals in this worker
+and brought up to date with other workers through the menu delta
+(menu_snapshot.get_changes), checked at most once per SEARCH_SYNC_INTERVAL.
+"""
+import bisect
+import heapq
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+
+from .models import MenuSnapshot
+from .russian_stemmer import stem
+
+TOKEN_RE = re.compile(r'[0-9a-zа-яё]+')
+
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'description': 1.0,
+}
+
+# How much a match counts depending on how it was found
+EXACT, PREFIX, FUZZY = 1.0, 0.8, 0.6
+
+
+# Menus reuse a small vocabulary, so stemming is mostly cache hits
+cached_stem = lru_cache(maxsize=50000)(stem)
+
+
+def tokenize(text):
+    return [cached_stem(token) for token in TOKEN_RE.findall((text or '').lower().replace('ё', 'е'))]
+
+
+def trigrams(term):
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def within_distance(a, b, limit):
+    """Damerau-Levenshtein distance between a and b is <= limit (banded, early exit)."""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return False
+        previous2, previous = previous, current
+    return previous[-1] <= limit
+
+
+class SearchIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.checked_at = 0.0
+        self.documents = {}   # product id -> serialized product
+        self.doc_terms = {}   # product id -> set of stems, to unindex on update
+        self.postings = defaultdict(dict)
+        self.ranked = {}      # stem -> product ids in result order (single-word queries)
+        self.trigrams = defaultdict(set)
+        self.vocabulary = []
+
+    # Building
+
+    def clear(self):
+        self.documents.clear()
+        self.doc_terms.clear()
+        self.postings.clear()
+        self.ranked.clear()
+        self.trigrams.clear()
+        self.vocabulary = []
+
+    def load(self, products, version):
+        with self.lock:
+            self.clear()
+            for product in products:
+                self._add(product)
+            self.vocabulary.sort()
+            self.version = version
+            self.checked_at = time.monotonic()
+
+    def upsert(self, product):
+        with self.lock:
+            self._remove(product['id'])
+            self._add(product, keep_sorted=True)
+
+    def remove(self, product_id):
+        with self.lock:
+            self._remove(product_id)
+
+    def _add(self, product, keep_sorted=False):
+        weights = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(product.get(field)):
+                weights[term] += weight
+
+        product_id = product['id']
+        self.documents[product_id] = product
+        self.doc_terms[product_id] = set(weights)
+        for term, weight in weights.items():
+            if term not in self.postings:
+                # New stem: register it for prefix and typo lookups
+                for gram in trigrams(term):
+                    self.trigrams[gram].add(term)
+                if keep_sorted:
+                    bisect.insort(self.vocabulary, term)
+                else:
+                    self.vocabulary.append(term)
+            self.postings[term][product_id] = weight
+            self.ranked.pop(term, None)
+
+    def _remove(self, product_id):
+        self.documents.pop(product_id, None)
+        for term in self.doc_terms.pop(product_id, ()):
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(product_id, None)
+            self.ranked.pop(term, None)
+        # Stems left without documents stay in the vocabulary, lookups skip them
+
+    # Keeping up with the menu
+
+    def ensure_current(self):
+        """Builds the index or applies the menu delta if another worker changed the menu."""
+        from . import menu_snapshot
+
+        if self.version is None:
+            with self.lock:
+                if self.version is None:
+                    snapshot = menu_snapshot.get_snapshot()
+                    self.load(json.loads(snapshot.payload)['products'], snapshot.version)
+            return
+
+        now = time.monotonic()
+        if now - self.checked_at < getattr(settings, 'SEARCH_SYNC_INTERVAL', 1.0):
+            return
+        self.checked_at = now
+
+        version = MenuSnapshot.objects.filter(pk=menu_snapshot.SNAPSHOT_ID).values_list('version', flat=True).first()
+        if version is None or version <= self.version:
+            return
+        changes = menu_snapshot.get_changes(self.version, version)
+        with self.lock:
+            for product_id in changes['deleted']['products']:
+                self._remove(product_id)
+            for product in changes['products']:
+                self.upsert(product)
+            self.version = version
+
+    # Querying
+
+    def _expand(self, term, is_last):
+        """Stems matching one query term with their match quality."""
+        matches = {}
+        if self.postings.get(term):
+            matches[term] = EXACT
+
+        if is_last and not matches and len(term) >= 2:
+            # Search-as-you-type: "шашл" should find "шашлык"
+            start = bisect.bisect_left(self.vocabulary, term)
+            for candidate in self.vocabulary[start:start + 50]:
+                if not candidate.startswith(term):
+                    break
+                matches.setdefault(candidate, PREFIX)
+
+        if not matches and len(term) >= 3:
+            # Typo tolerance: candidates share trigrams, then check the edit distance
+            limit = 1 if len(term) <= 5 else 2
+            grams = trigrams(term)
+            shared = defaultdict(int)
+            for gram in grams:
+                for candidate in self.trigrams.get(gram, ()):
+                    shared[candidate] += 1
+            # Each edit breaks at most 3 trigrams
+            needed = max(1, len(grams) - 3 * limit)
+            for candidate, count in shared.items():
+                if count >= needed and within_distance(term, candidate, limit):
+                    matches[candidate] = FUZZY
+
+        return {candidate: quality for candidate, quality in matches.items() if self.postings.get(candidate)}
+
+    def _ranked(self, term):
+        """Documents of one stem in result order, cached until the stem's postings change."""
+        ranked = self.ranked.get(term)
+        if ranked is None:
+            ranked = sorted(self.postings[term], key=lambda pid: self._sort_key(pid, self.postings[term][pid]))
+            self.ranked[term] = ranked
+        return ranked
+
+    def _sort_key(self, product_id, score):
+        document = self.documents[product_id]
+        return (-score, not document.get('is_popular'), document['title'])
+
+    def search(self, query, limit=20):
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self.lock:
+            expanded = [self._expand(term, is_last=(i == len(terms) - 1)) for i, term in enumerate(terms)]
+            if not all(expanded):
+                return []
+
+            if len(expanded) == 1:
+                # Single word: merge the pre-sorted lists of the matching stems
+                # lazily, only `limit` documents are ever looked at
+                streams = [
+                    ((self._sort_key(pid, self.postings[stem][pid] * quality), pid) for pid in self._ranked(stem))
+                    for stem, quality in expanded[0].items()
+                ]
+                results, seen = [], set()
+                for _, product_id in heapq.merge(*streams):
+                    if product_id not in seen:
+                        seen.add(product_id)
+                        results.append(self.documents[product_id])
+                        if len(results) == limit:
+                            break
+                return results
+
+            per_term = []
+            for matches in expanded:
+                if len(matches) == 1 and EXACT in matches.values():
+                    # Common case: use the postings as they are, no copying
+                    per_term.append(self.postings[next(iter(matches))])
+                    continue
+                scores = {}
+                for candidate, quality in matches.items():
+                    for product_id, weight in self.postings[candidate].items():
+                        if weight * quality > scores.get(product_id, 0):
+                            scores[product_id] = weight * quality
+                per_term.append(scores)
+
+            # Every query word has to match (AND): intersect starting from the rarest
+            per_term.sort(key=len)
+            candidates = per_term[0].keys()
+            for scores in per_term[1:]:
+                candidates = candidates & scores.keys()
+                if not candidates:
+                    return []
+
+            best = heapq.nsmallest(
+                limit,
+                candidates,
+                key=lambda pid: self._sort_key(pid, sum(scores[pid] for scores in per_term)),
+            )
+            return [self.documents[product_id] for product_id in best]
+
+
+index = SearchIndex()
+
+
+def warm_up():
+    """Builds the index in the background so the first search doesn't pay for it."""
+    def build():
+        from django.db import close_old_connections
+        try:
+            index.ensure_current()
+        except Exception as e:
+            # e.g. migrations not applied yet, the first search will retry
+            print(f"Search index warm-up failed: {e}")
+        finally:
+            close_old_connections()
+
+    threading.Thread(target=build, name='search-warm-up', daemon=True).start()
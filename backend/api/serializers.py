@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Category, Product, BusinessLunch, Order, Reservation, UserAddress, BanquetMenu
+from . import images
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -7,22 +8,56 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'order']
 
 class ProductSerializer(serializers.ModelSerializer):
+    image_srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = Product
-        fields = ['id', 'category', 'title', 'description', 'price', 'weight', 'image', 'is_popular']
+        fields = ['id', 'category', 'title', 'description', 'price', 'weight', 'image', 'image_srcset', 'is_popular']
+
+    def get_image_srcset(self, obj):
+        return images.srcset(obj, 'image')
 
 class BusinessLunchSerializer(serializers.ModelSerializer):
+    # Dishes pre-split by line so the frontend doesn't have to
+    salads_list = serializers.SerializerMethodField()
+    soups_list = serializers.SerializerMethodField()
+    hot_dishes_list = serializers.SerializerMethodField()
+    garnishes_list = serializers.SerializerMethodField()
+
     class Meta:
         model = BusinessLunch
         fields = '__all__'
 
+    @staticmethod
+    def split_lines(text):
+        return [line.strip() for line in (text or '').splitlines() if line.strip()]
+
+    def get_salads_list(self, obj):
+        return self.split_lines(obj.salads)
+
+    def get_soups_list(self, obj):
+        return self.split_lines(obj.soups)
+
+    def get_hot_dishes_list(self, obj):
+        return self.split_lines(obj.hot_dishes)
+
+    def get_garnishes_list(self, obj):
+        return self.split_lines(obj.garnishes)
+
 class OrderSerializer(serializers.ModelSerializer):
     items = serializers.JSONField() # Ensure items are handled as JSON if possible, or leave as TextField if that was intent. Using TextField in model but maybe JSON here is better? Let's stick to what works for now, but adding user.
 
     class Meta:
         model = Order
-        fields = ['id', 'user', 'name', 'phone', 'address', 'items', 'total_price', 'status', 'created_at']
-        read_only_fields = ['id', 'status', 'created_at', 'user']
+        fields = ['id', 'user', 'name', 'phone', 'address', 'items', 'total_price', 'payment_method', 'status', 'created_at']
+        # total_price is recomputed on the server, see api/pricing.py
+        read_only_fields = ['id', 'status', 'created_at', 'user', 'total_price']
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    # Profile order lists: no items blob, the detail endpoint has it
+    class Meta:
+        model = Order
+        fields = ['id', 'status', 'total_price', 'payment_method', 'is_paid', 'address', 'created_at']
 
 class UserAddressSerializer(serializers.ModelSerializer):
     class Meta:
@@ -33,7 +68,8 @@ class ReservationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reservation
         fields = '__all__'
-        read_only_fields = ['id', 'created_at']
+        # The table is picked by api/slots.py, the status is the manager's
+        read_only_fields = ['id', 'created_at', 'status', 'table']
 
 from django.contrib.auth.models import User
 
@@ -59,6 +95,15 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 class BanquetMenuSerializer(serializers.ModelSerializer):
+    cover_image_srcset = serializers.SerializerMethodField()
+    content_image_srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = BanquetMenu
-        fields = '__all__'
+        exclude = ['image_derivatives']
+
+    def get_cover_image_srcset(self, obj):
+        return images.srcset(obj, 'cover_image')
+
+    def get_content_image_srcset(self, obj):
+        return images.srcset(obj, 'content_image')
@@ -0,0 +1,103 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import changefeed, events, images, ledger, lunch, menu_snapshot, sales, search, slots
+from .models import Category, Product, BanquetMenu, BusinessLunch, Order, Reservation
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+def menu_row_saved(sender, instance, **kwargs):
+    # Covers admin edits and list_editable `order` changes.
+    # Note: QuerySet.update() does not send signals, call
+    # menu_snapshot.mark_dirty() manually after bulk updates.
+    menu_snapshot.mark_dirty(sender._meta.model_name, instance.pk)
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+def menu_row_deleted(sender, instance, **kwargs):
+    # Deleting a category also sends post_delete for each cascaded product
+    menu_snapshot.mark_dirty(sender._meta.model_name, instance.pk, deleted=True)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=BanquetMenu)
+def image_uploaded(sender, instance, **kwargs):
+    # Resized copies are rendered in a background pool after commit
+    images.schedule(instance)
+
+
+@receiver(post_save, sender=Product)
+def product_search_update(sender, instance, **kwargs):
+    # Other workers catch up through the menu delta, see search.py
+    if search.index.version is not None:
+        from .serializers import ProductSerializer
+        data = ProductSerializer(instance).data
+        transaction.on_commit(lambda: search.index.upsert(data))
+
+
+@receiver(post_delete, sender=Product)
+def product_search_remove(sender, instance, **kwargs):
+    if search.index.version is not None:
+        product_id = instance.pk
+        transaction.on_commit(lambda: search.index.remove(product_id))
+
+
+@receiver(post_save, sender=BusinessLunch)
+@receiver(post_delete, sender=BusinessLunch)
+def business_lunch_changed(sender, **kwargs):
+    transaction.on_commit(lunch.invalidate)
+
+
+@receiver(pre_save, sender=Order)
+def order_saving(sender, instance, **kwargs):
+    # One query for everything the post_save bookkeeping needs to compare against
+    instance._saved_state = ledger.saved_state(instance)
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, **kwargs):
+    before = getattr(instance, '_saved_state', None)
+    ledger.record(instance, before)
+    sales.record(instance, before)
+    if created:
+        payload = events.order_event(instance)
+        transaction.on_commit(lambda: events.publish(payload))
+        transaction.on_commit(lambda: changefeed.bump(changefeed.ORDERS))
+    elif before is not None and before['status'] != instance.status:
+        transaction.on_commit(lambda: changefeed.bump(changefeed.STATUS))
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    ledger.record_delete(instance)
+    sales.record_delete(instance)
+
+
+@receiver(pre_save, sender=Reservation)
+def reservation_saving(sender, instance, **kwargs):
+    # The day it was on before, in case the admin moves it to another one
+    if not instance._state.adding and instance.pk is not None:
+        instance._saved_date = Reservation.objects.filter(pk=instance.pk).values_list('date', flat=True).first()
+
+
+@receiver(post_save, sender=Reservation)
+def reservation_saved(sender, instance, created, **kwargs):
+    if created:
+        payload = events.reservation_event(instance)
+        transaction.on_commit(lambda: events.publish(payload))
+        transaction.on_commit(lambda: changefeed.bump(changefeed.RESERVATIONS))
+
+    # Rebuild the cached availability of the day(s) on the next read (api/slots.py)
+    day, old_day = instance.date, getattr(instance, '_saved_date', None)
+    if old_day and old_day != day:
+        transaction.on_commit(lambda: slots.invalidate(old_day))
+    transaction.on_commit(lambda: slots.invalidate(day))
+
+
+@receiver(post_delete, sender=Reservation)
+def reservation_deleted(sender, instance, **kwargs):
+    day = instance.date
+    transaction.on_commit(lambda: slots.invalidate(day))
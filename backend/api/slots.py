@@ -0,0 +1,211 @@
+"""
+Reservation slots: which times can seat N guests on a date.
+
+The hall is RESERVATION_TABLES (seats per table, numbered from 1). A
+reservation takes one table big enough for the party for
+RESERVATION_TURN_MINUTES from its time; bookable times are every
+RESERVATION_SLOT_MINUTES from RESERVATION_OPEN to RESERVATION_LAST_SEATING.
+
+A day is indexed as a bitmask per table, one bit per slot-sized bucket of
+the day, set where the table is taken (DayIndex). "Is there a table for N
+guests at T" is a mask test per table, so availability for a whole day
+never rereads its reservations.
+
+The index of a day is cached for RESERVATION_INDEX_SECONDS under the day's
+generation, a counter in the cache. The Reservation signals bump it (an
+atomic incr) once a booking is created, moved, cancelled or deleted, and the
+next read rebuilds the day from the database. An index built from data
+older than the bump is stored under the old generation and never read, so
+concurrent changes can't be lost. With the per-process cache other
+processes don't see the bump and lag up to RESERVATION_INDEX_SECONDS behind;
+set REDIS_URL when running more than one.
+
+The cache only serves availability(). book() rebuilds the day from the
+database inside its write transaction (BEGIN IMMEDIATE, see DATABASES), so
+two requests for the last table can't both get it even if a worker's cache
+lags behind (per-process cache without REDIS_URL).
+
+Parties bigger than the largest table aren't seated automatically: they
+are accepted without a table and a manager arranges it by phone, as before.
+"""
+import hashlib
+from datetime import time as Time
+from time import time_ns
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Reservation
+
+
+class SlotError(ValueError):
+    pass
+
+
+class SlotUnavailable(SlotError):
+    pass
+
+
+def minutes(value):
+    """Minutes since midnight of a time or an "HH:MM" string."""
+    if isinstance(value, str):
+        hours, mins = value.split(':')
+        return int(hours) * 60 + int(mins)
+    return value.hour * 60 + value.minute
+
+
+def as_time(value):
+    return Time(value // 60, value % 60)
+
+
+class Hall:
+    """The reservation settings, and bucket arithmetic over them."""
+
+    def __init__(self):
+        self.tables = list(settings.RESERVATION_TABLES)
+        self.largest = max(self.tables)
+        self.slot = settings.RESERVATION_SLOT_MINUTES
+        self.turn = settings.RESERVATION_TURN_MINUTES
+        self.open = minutes(settings.RESERVATION_OPEN)
+        self.last = minutes(settings.RESERVATION_LAST_SEATING)
+        config = repr((self.tables, self.slot, self.turn, self.open, self.last))
+        self.version = hashlib.md5(config.encode()).hexdigest()[:8]
+
+    def generation_key(self, day):
+        # A new hall layout starts new indexes instead of reusing stale ones
+        return f"slots:{self.version}:{day.isoformat()}"
+
+    def cache_key(self, day, generation):
+        return f"{self.generation_key(day)}:{generation}"
+
+    def start_times(self):
+        return range(self.open, self.last + 1, self.slot)
+
+    def span(self, start):
+        """Buckets taken by a party seated at `start` minutes: every bucket the turn touches."""
+        first = max((start - self.open) // self.slot, 0)
+        end = -(-(start + self.turn - self.open) // self.slot)
+        if end <= first:
+            return 0
+        return ((1 << (end - first)) - 1) << first
+
+
+class DayIndex:
+    """Taken buckets of every table on one day."""
+
+    def __init__(self, table_count):
+        self.busy = [0] * table_count
+        self.entries = {}  # reservation id -> (table number, mask)
+
+    def free_table(self, hall, guests, mask):
+        """Number of the smallest table that seats `guests` and is free for `mask`, or None."""
+        best = None
+        for number, seats in enumerate(hall.tables, 1):
+            if seats >= guests and not self.busy[number - 1] & mask:
+                if best is None or seats < hall.tables[best - 1]:
+                    best = number
+        return best
+
+    def place(self, hall, reservation_id, time, guests, table=None):
+        mask = hall.span(minutes(time))
+        if not table or table > len(hall.tables):
+            # Bookings made before tables were assigned get one here
+            table = self.free_table(hall, guests, mask) if guests <= hall.largest else None
+        if table and mask:
+            self.entries[reservation_id] = (table, mask)
+            self.busy[table - 1] |= mask
+
+
+def load(hall, day):
+    """The day's index built from the database."""
+    index = DayIndex(len(hall.tables))
+    rows = (Reservation.objects.filter(date=day).exclude(status='cancelled')
+            .order_by('time', 'pk').values_list('pk', 'time', 'guests', 'table'))
+    for pk, time, guests, table in rows:
+        index.place(hall, pk, time, guests, table)
+    return index
+
+
+def generation(hall, day):
+    key = hall.generation_key(day)
+    value = cache.get(key)
+    if value is None:
+        # Seeded from the clock: a counter that expired never repeats an old value
+        cache.add(key, time_ns(), settings.RESERVATION_INDEX_SECONDS)
+        value = cache.get(key, 0)
+    return value
+
+
+def day_index(hall, day):
+    key = hall.cache_key(day, generation(hall, day))
+    index = cache.get(key)
+    if index is None:
+        index = load(hall, day)
+        cache.set(key, index, settings.RESERVATION_INDEX_SECONDS)
+    return index
+
+
+def earliest_start(day):
+    """First bookable minute of the day; SlotError for days in the past."""
+    now = timezone.localtime()
+    if day < now.date():
+        raise SlotError("Нельзя забронировать стол на прошедшую дату")
+    return now.hour * 60 + now.minute + 1 if day == now.date() else 0
+
+
+def check_guests(guests):
+    if guests < 1:
+        raise SlotError("Некорректное количество гостей")
+
+
+def availability(day, guests):
+    """Times on `day` a party of `guests` can book, all of them for parties arranged by phone."""
+    hall = Hall()
+    check_guests(guests)
+    earliest = earliest_start(day)
+    starts = [start for start in hall.start_times() if start >= earliest]
+    if guests > hall.largest:
+        return [as_time(start) for start in starts]
+    index = day_index(hall, day)
+    return [as_time(start) for start in starts if index.free_table(hall, guests, hall.span(start)) is not None]
+
+
+def book(serializer):
+    """
+    Saves a valid ReservationSerializer at a free table and returns the
+    reservation. SlotError if the time can't be booked at all,
+    SlotUnavailable if every fitting table is taken.
+    """
+    hall = Hall()
+    day, time, guests = (serializer.validated_data[field] for field in ('date', 'time', 'guests'))
+    check_guests(guests)
+    start = minutes(time)
+    if start < earliest_start(day):
+        raise SlotError("Это время уже прошло")
+    if start not in hall.start_times() or time.second:
+        raise SlotError(
+            f"Бронирование возможно с {settings.RESERVATION_OPEN} до {settings.RESERVATION_LAST_SEATING} "
+            f"каждые {hall.slot} минут"
+        )
+    if guests > hall.largest:
+        return serializer.save()
+
+    with transaction.atomic():
+        # Read and insert under the write lock: the day can't change in between
+        index = load(hall, day)
+        table = index.free_table(hall, guests, hall.span(start))
+        if table is None:
+            # Whatever the cache said, it's this now
+            cache.set(hall.cache_key(day, generation(hall, day)), index, settings.RESERVATION_INDEX_SECONDS)
+            raise SlotUnavailable("На это время нет свободных столов, выберите другое")
+        return serializer.save(table=table)
+
+
+def invalidate(day):
+    """Retires the cached index of `day`, the next read rebuilds it."""
+    try:
+        cache.incr(Hall().generation_key(day))
+    except ValueError:
+        pass  # no counter, so no index of the current generation either
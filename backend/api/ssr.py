@@ -0,0 +1,55 @@
+"""
+Server-side rendered menu for the home page.
+
+The menu section of index.html is rendered from the same snapshot that
+serves /api/menu/, split into fragments (category buttons, product grid)
+that are cached under the snapshot version. A page view costs one version
+lookup and a cache hit; fragments are re-rendered only after the menu changes.
+"""
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import menu_snapshot
+
+FRAGMENTS = {
+    'categories': 'fragments/menu_categories.html',
+    'products': 'fragments/menu_products.html',
+}
+
+
+def _srcset(candidates):
+    # {"320": url, "640": url} -> "url 320w, url 640w"
+    return ', '.join(f"{url} {width}w" for width, url in sorted(candidates.items(), key=lambda c: int(c[0])))
+
+
+def render_fragments(payload):
+    data = json.loads(payload)
+    for product in data['products']:
+        srcset = product.get('image_srcset') or {}
+        product['srcset_webp'] = _srcset(srcset.get('webp', {}))
+        product['srcset_jpeg'] = _srcset(srcset.get('jpeg', {}))
+
+    context = {'categories': data['categories'], 'products': data['products']}
+    return {name: render_to_string(template, context) for name, template in FRAGMENTS.items()}
+
+
+def menu_fragments():
+    """Returns (version, {fragment name: safe html}) for the current menu."""
+    snapshot = menu_snapshot.get_snapshot()
+    keys = {name: f"ssr:menu:{snapshot.version}:{name}" for name in FRAGMENTS}
+
+    cached = cache.get_many(keys.values())
+    if len(cached) == len(keys):
+        fragments = {name: cached[key] for name, key in keys.items()}
+    else:
+        fragments = render_fragments(snapshot.payload)
+        # Old versions are never read again, they only need to outlive a rebuild
+        cache.set_many(
+            {keys[name]: html for name, html in fragments.items()},
+            getattr(settings, 'SSR_FRAGMENT_TIMEOUT', 60 * 60 * 24),
+        )
+    return snapshot.version, {name: mark_safe(html) for name, html in fragments.items()}
@@ -1,58 +1,97 @@
+from datetime import timedelta
+
 from django import template
-from django.db.models import Sum
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
 from django.utils import timezone
-from api.models import DailyStats, Order, Reservation
+from api.hll import VisitorSketch
+from api.models import DailyStats, Order, Reservation, RevenueLedger
+from api import sales
+from api.rollups import day_start, monthly_views
 
 register = template.Library()
 
+CACHE_KEY = 'dashboard:stats'
+
 @register.inclusion_tag('admin/dashboard_stats.html')
 def dashboard_stats():
+    # Every admin page load renders this, a few seconds of staleness is fine
+    stats = cache.get(CACHE_KEY)
+    if stats is None:
+        stats = build_stats()
+        cache.set(CACHE_KEY, stats, getattr(settings, 'DASHBOARD_CACHE_SECONDS', 5))
+    return stats
+
+def build_stats():
+    # Traffic is keyed by UTC date (see TrafficMonitorMiddleware)
     today = timezone.now().date()
-    
-    # Traffic
-    try:
-        stats = DailyStats.objects.get(date=today)
-        unique_visitors = stats.unique_visitors
-        total_views = stats.total_views
-    except DailyStats.DoesNotExist:
-        unique_visitors = 0
-        total_views = 0
-        
-    # Revenue (Today) - Including NEW orders so user sees immediate results
-    orders_today = Order.objects.filter(
-        created_at__date=today
-    ).exclude(status='cancelled')
-    
-    revenue_today = orders_today.aggregate(Sum('total_price'))['total_price__sum'] or 0
-    orders_count_today = orders_today.count()
-    
-    # New Orders Count (Actionable)
-    new_orders_count = orders_today.filter(status='new').count()
-
-    # Revenue (Total)
-    orders_total = Order.objects.exclude(status='cancelled')
-    revenue_total = orders_total.aggregate(Sum('total_price'))['total_price__sum'] or 0
-    
+
+    # Traffic: today's counters and 7/30-day uniques from one query over
+    # the last 30 daily rows (union of the sketches, no rescans)
+    days = DailyStats.objects.filter(date__gt=today - timedelta(days=30)).values_list(
+        'date', 'unique_visitors', 'total_views', 'visitor_sketch',
+    )
+    unique_visitors = total_views = 0
+    week, month = VisitorSketch(), VisitorSketch()
+    for date, visitors, views, data in days:
+        if date == today:
+            unique_visitors, total_views = visitors, views
+        sketch = VisitorSketch.from_bytes(data)
+        month.update(sketch)
+        if date > today - timedelta(days=7):
+            week.update(sketch)
+
+    # Year chart from the compacted rollups (a few hundred rows at most)
+    months = monthly_views(12)
+    peak = max(views for _, views in months) or 1
+    traffic_by_month = [
+        {'month': month_start, 'views': views, 'height': round(views * 100 / peak)}
+        for month_start, views in months
+    ]
+
+    # Orders today in one pass - including NEW orders so user sees immediate results
+    not_cancelled = ~Q(status='cancelled')
+    orders_today = Order.objects.filter(created_at__gte=day_start(timezone.now())).aggregate(
+        revenue_today=Sum('total_price', filter=not_cancelled),
+        orders_count_today=Count('id', filter=not_cancelled),
+        new_orders_count=Count('id', filter=Q(status='new')),
+    )
+
+    # Revenue (Total) from the per-day ledger, not from every order ever placed
+    revenue_total = RevenueLedger.objects.aggregate(total=Sum('revenue'))['total'] or 0
+
+    local_today = timezone.localdate()
+
+    # Completed orders this week / month and top dishes, from the sales rollups
+    sales_week = sales.report(local_today - timedelta(days=6), local_today, limit=0)
+    sales_month = sales.report(local_today.replace(day=1), local_today, limit=5)
+
     # Reservations (Today)
-    reservations_today = Reservation.objects.filter(date=today).count()
-    
+    reservations_today = Reservation.objects.filter(date=local_today).count()
+
     # Upcoming Reservations (for the dashboard table)
-    upcoming_reservations = Reservation.objects.filter(
-        date__gte=today
-    ).order_by('date', 'time')[:10] # Show next 10 reservations
-    
+    upcoming_reservations = list(Reservation.objects.filter(
+        date__gte=local_today
+    ).order_by('date', 'time')[:10]) # Show next 10 reservations
+
     # Latest New Orders (Actionable items)
-    latest_new_orders = Order.objects.filter(
+    latest_new_orders = list(Order.objects.filter(
         status='new'
-    ).order_by('-created_at')[:10]
+    ).order_by('-created_at')[:10])
 
     return {
         'unique_visitors': unique_visitors,
         'total_views': total_views,
-        'revenue_today': revenue_today,
-        'orders_count_today': orders_count_today,
-        'new_orders_count': new_orders_count,
+        'unique_visitors_week': len(week),
+        'unique_visitors_month': len(month),
+        'traffic_by_month': traffic_by_month,
+        'revenue_today': orders_today['revenue_today'] or 0,
+        'orders_count_today': orders_today['orders_count_today'],
+        'new_orders_count': orders_today['new_orders_count'],
         'revenue_total': revenue_total,
+        'sales_week': sales_week,
+        'sales_month': sales_month,
         'reservations_today': reservations_today,
         'upcoming_reservations': upcoming_reservations,
         'latest_new_orders': latest_new_orders,
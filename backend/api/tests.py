@@ -1,3 +1,1676 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from urllib.parse import parse_qs
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import archive, changefeed, events, idempotency, images, ledger, lunch, lunch_import, menu_snapshot, metrics, order_lines, paykeeper, pricing, reconcile, rollups, russian_stemmer, sales, search, slots
+from .consumers import AdminOrdersConsumer
+from .hll import VisitorSketch
+from .models import (
+    ArchivedOrder, BanquetMenu, BusinessLunch, Category, DailyProductSales, DailySales, DailyStats, IdempotencyKey, Order, PaymentEvent, OrderLine, Product, Reservation, RevenueLedger, TrafficRollup,
+)
+from .serializers import BanquetMenuSerializer, ProductSerializer
+from .templatetags.dashboard_stats import CACHE_KEY as DASHBOARD_CACHE_KEY, dashboard_stats
+from .traffic import TrafficBuffer, unique_visitors_between
+
+
+def fake_ips(start, count):
+    return [f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}" for i in range(start, start + count)]
+
+
+class MenuSnapshotTests(TransactionTestCase):
+    # The snapshot is rebuilt on commit
+
+    def setUp(self):
+        menu_snapshot._local_snapshot = None
+        self.category = Category.objects.create(name="Супы")
+        self.soup = Product.objects.create(category=self.category, title="Борщ", price=350)
+
+    def version(self):
+        return int(self.client.get('/api/menu/')['X-Menu-Version'])
+
+    def test_etag_is_stable_and_revalidated(self):
+        first = self.client.get('/api/menu/')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['Cache-Control'], 'no-cache')
+        # Same ETag and bytes from this worker's memory and from the database
+        self.assertEqual(self.client.get('/api/menu/')['ETag'], first['ETag'])
+        menu_snapshot._local_snapshot = None
+        second = self.client.get('/api/menu/')
+        self.assertEqual((second['ETag'], second.content), (first['ETag'], first.content))
+
+        response = self.client.get('/api/menu/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], first['ETag'])
+
+        self.soup.price = 400
+        self.soup.save()
+        response = self.client.get('/api/menu/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.json()['products'][0]['price'], '400')
+
+    def test_version_moves_on_save_and_delete(self):
+        version = self.version()
+        for change in (
+            lambda: self.category.save(),
+            lambda: self.soup.save(),
+            lambda: Product.objects.create(category=self.category, title="Щи", price=300),
+            lambda: self.soup.delete(),
+            lambda: self.category.delete(),  # with Щи: still one rebuild
+        ):
+            change()
+            version += 1
+            self.assertEqual(self.version(), version)
+        self.assertEqual(self.client.get('/api/menu/').json()['categories'], [])
+
+    def test_one_rebuild_per_transaction(self):
+        version = self.version()
+        with transaction.atomic():
+            for i in range(5):
+                Product.objects.create(category=self.category, title=f"Суп {i}", price=300)
+            self.category.save()
+            self.soup.delete()
+            self.assertEqual(self.version(), version)  # nothing until commit
+        self.assertEqual(self.version(), version + 1)
+        self.assertEqual(len(self.client.get('/api/menu/').json()['products']), 5)
+
+
+class MenuDeltaTests(TransactionTestCase):
+    def setUp(self):
+        menu_snapshot._local_snapshot = None
+        self.soups = Category.objects.create(name="Супы")
+        self.salads = Category.objects.create(name="Салаты")
+        self.borsch = Product.objects.create(category=self.soups, title="Борщ", price=350)
+        self.shchi = Product.objects.create(category=self.soups, title="Щи", price=300)
+        self.caesar = Product.objects.create(category=self.salads, title="Цезарь", price=450)
+        self.since = int(self.client.get('/api/menu/')['X-Menu-Version'])
+
+    def delta(self, since):
+        response = self.client.get('/api/menu/', {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_only_changed_rows(self):
+        self.borsch.price = 390
+        self.borsch.save()
+        data = self.delta(self.since)
+        self.assertEqual((data['since'], data['version']), (self.since, self.since + 1))
+        self.assertEqual([p['id'] for p in data['products']], [self.borsch.pk])
+        self.assertEqual(data['products'][0]['price'], '390')
+        self.assertEqual(data['categories'], [])
+        self.assertEqual(data['deleted'], {'categories': [], 'products': []})
+
+    def test_deleted_rows_come_as_tombstones(self):
+        shchi, salads, caesar = self.shchi.pk, self.salads.pk, self.caesar.pk
+        self.shchi.delete()
+        self.salads.delete()  # takes Цезарь along
+        data = self.delta(self.since)
+        self.assertEqual(data['deleted']['categories'], [salads])
+        self.assertEqual(sorted(data['deleted']['products']), sorted([shchi, caesar]))
+        self.assertEqual((data['categories'], data['products']), ([], []))
+
+    def test_up_to_date_client_gets_an_empty_delta(self):
+        data = self.delta(self.since)
+        self.assertEqual((data['version'], data['categories'], data['products']), (self.since, [], []))
+        self.assertEqual(data['deleted'], {'categories': [], 'products': []})
+        with self.assertNumQueries(0):
+            self.assertEqual(menu_snapshot.get_changes(self.since + 3, self.since)['products'], [])
+
+    def test_unknown_since_gets_the_full_menu(self):
+        for since in ('0', '-1', 'abc', '1.5', str(self.since + 1)):
+            with self.subTest(since=since):
+                data = self.delta(since)
+                self.assertNotIn('since', data)
+                self.assertEqual(data['version'], self.since)
+                self.assertEqual(len(data['products']), 3)
+
+
+class HomePageTests(TransactionTestCase):
+    # Fragments follow the menu snapshot, which is rebuilt on commit
+
+    def setUp(self):
+        cache.clear()
+        menu_snapshot._local_snapshot = None
+        self.category = Category.objects.create(name="Супы")
+        self.soup = Product.objects.create(category=self.category, title="Борщ", price=350)
+
+    def test_page_renders(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'index.html')
+        self.assertContains(response, f'data-filter="{self.category.pk}"')
+        self.assertContains(response, "Борщ")
+        for name in ('auth_login', 'auth_register', 'create_order', 'create_reservation'):
+            self.assertContains(response, f'action="{reverse(name)}"')
+
+    def test_fragments_are_keyed_by_menu_version(self):
+        self.client.get('/')
+        version = menu_snapshot.get_snapshot().version
+        self.assertIn("Борщ", cache.get(f"ssr:menu:{version}:products"))
+        with self.assertNumQueries(1):  # the version check
+            self.assertContains(self.client.get('/'), "Борщ")
+
+        self.soup.title = "Солянка"
+        self.soup.save()
+        response = self.client.get('/')
+        self.assertContains(response, "Солянка")
+        self.assertNotContains(response, "Борщ")
+        self.assertIn("Солянка", cache.get(f"ssr:menu:{version + 1}:products"))
+
+
+class SearchTests(TransactionTestCase):
+    # Signals update the index on commit
+
+    def setUp(self):
+        menu_snapshot._local_snapshot = None
+        self.addCleanup(setattr, search, 'index', search.index)
+        search.index = search.SearchIndex()
+        category = Category.objects.create(name="Горячее")
+        self.cutlets = Product.objects.create(category=category, title="Котлеты по-киевски", price=450,
+                                              description="Куриное филе, сливочное масло")
+        self.kebab = Product.objects.create(category=category, title="Шашлык из свинины", price=600, is_popular=True)
+        self.borsch = Product.objects.create(category=category, title="Борщ с говядиной", price=350,
+                                             description="Свёкла, капуста, сметана")
+        self.soup = Product.objects.create(category=category, title="Суп куриный", price=300)
+
+    def titles(self, query):
+        response = self.client.get('/api/menu/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [product['title'] for product in response.json()['results']]
+
+    def test_stemming(self):
+        for forms in (('котлеты', 'котлета', 'котлету', 'котлет'), ('салатов', 'салат'),
+                      ('говядиной', 'говядина'), ('шашлыки', 'шашлык'), ('борща', 'борщ')):
+            with self.subTest(forms=forms):
+                self.assertEqual(len({russian_stemmer.stem(word) for word in forms}), 1)
+        self.assertNotEqual(russian_stemmer.stem('суп'), russian_stemmer.stem('сок'))
+        self.assertEqual(search.tokenize("Свёкла, КАПУСТА!"), [russian_stemmer.stem('свекла'), russian_stemmer.stem('капуста')])
+
+        self.assertEqual(self.titles("котлету"), ["Котлеты по-киевски"])
+        self.assertEqual(self.titles("говядина"), ["Борщ с говядиной"])
+        self.assertEqual(self.titles("свекла"), ["Борщ с говядиной"])  # ё and е are the same letter
+
+    def test_typos_prefixes_and_all_words(self):
+        self.assertTrue(search.within_distance('шашлык', 'шашлик', 1))
+        self.assertTrue(search.within_distance('борщ', 'брощ', 1))  # transposition
+        self.assertFalse(search.within_distance('борщ', 'суп', 1))
+
+        self.assertEqual(self.titles("шашлик"), ["Шашлык из свинины"])
+        self.assertEqual(self.titles("говядни"), ["Борщ с говядиной"])
+        self.assertEqual(self.titles("шаш"), ["Шашлык из свинины"])  # typing in progress
+        self.assertEqual(self.titles("суп куриный"), ["Суп куриный"])
+        # Title matches rank above description matches
+        self.assertEqual(self.titles("куриный"), ["Суп куриный", "Котлеты по-киевски"])
+        self.assertEqual(self.titles("пицца"), [])
+        self.assertEqual(self.titles(""), [])
+
+    def test_index_follows_product_changes(self):
+        self.assertEqual(self.titles("шашлык"), ["Шашлык из свинины"])
+        self.kebab.title = "Люля-кебаб"
+        self.kebab.save()
+        self.assertEqual(self.titles("шашлык"), [])
+        self.assertEqual(self.titles("кебаб"), ["Люля-кебаб"])
+        self.borsch.delete()
+        self.assertEqual(self.titles("борщ"), [])
+
+    def test_other_workers_catch_up_through_the_menu_delta(self):
+        other = search.SearchIndex()
+        other.ensure_current()
+        self.soup.title = "Солянка"
+        self.soup.save()  # only this worker's index hears the signal
+        self.kebab.delete()
+
+        other.checked_at = 0
+        other.ensure_current()
+        self.assertEqual([p['title'] for p in other.search("солянка")], ["Солянка"])
+        self.assertEqual(other.search("суп"), [])
+        self.assertEqual(other.search("шашлык"), [])
+        self.assertEqual(other.version, menu_snapshot.get_snapshot().version)
+
+
+class VisitorSketchTests(TestCase):
+    def test_exact_below_limit(self):
+        sketch = VisitorSketch()
+        for ip in fake_ips(0, 300) * 2:
+            sketch.add(ip)
+        self.assertTrue(sketch.is_exact)
+        self.assertEqual(len(sketch), 300)
+
+    @override_settings(TRAFFIC_EXACT_VISITORS=0)
+    def test_estimate_close_to_exact_count(self):
+        for count in [100, 1000, 10000, 100000]:
+            ips = fake_ips(0, count)
+            sketch = VisitorSketch()
+            for ip in ips:
+                sketch.add(ip)
+            exact = len(set(ips))
+            # Standard error is 1.6%, allow ~3 sigma
+            self.assertLess(abs(len(sketch) - exact) / exact, 0.05, f"{count} visitors: {len(sketch)}")
+
+    def test_union_of_days_matches_exact_count(self):
+        # Overlapping visitors across days, the union must not double count them
+        days = [fake_ips(i * 3000, 5000) for i in range(7)]
+        sketches = []
+        for ips in days:
+            sketch = VisitorSketch()
+            for ip in ips:
+                sketch.add(ip)
+            sketches.append(VisitorSketch.from_bytes(sketch.to_bytes()))
+
+        exact = len(set().union(*days))
+        estimate = len(VisitorSketch.union(sketches))
+        self.assertLess(abs(estimate - exact) / exact, 0.05)
+
+    def test_serialization_round_trip(self):
+        for count in [10, 5000]:
+            sketch = VisitorSketch()
+            for ip in fake_ips(0, count):
+                sketch.add(ip)
+            restored = VisitorSketch.from_bytes(sketch.to_bytes())
+            self.assertEqual(len(restored), len(sketch))
+        self.assertEqual(len(VisitorSketch().to_bytes()), 1)
+        self.assertLessEqual(len(sketch.to_bytes()), 4096 + 2)
+
+
+@override_settings(TRAFFIC_FLUSH_INTERVAL=0)
+class TrafficBufferTests(TestCase):
+    def test_flushes_from_several_workers(self):
+        day = datetime.datetime(2026, 1, 1, 12, tzinfo=datetime.timezone.utc)
+        first, second = TrafficBuffer(), TrafficBuffer()
+        for ip in fake_ips(0, 200):
+            first.record(day, ip)
+        for ip in fake_ips(100, 200):
+            second.record(day, ip)
+        first.flush()
+        second.flush()
+
+        stats = DailyStats.objects.get(date=day.date())
+        self.assertEqual(stats.total_views, 400)
+        self.assertEqual(stats.unique_visitors, 300)
+
+    def test_unique_visitors_between(self):
+        buffer = TrafficBuffer()
+        for offset in range(3):
+            day = datetime.datetime(2026, 1, 1, 12, tzinfo=datetime.timezone.utc) + datetime.timedelta(days=offset)
+            for ip in fake_ips(offset * 50, 100):
+                buffer.record(day, ip)
+        buffer.flush()
+
+        self.assertEqual(unique_visitors_between(datetime.date(2026, 1, 1), datetime.date(2026, 1, 3)), 200)
+        self.assertEqual(unique_visitors_between(datetime.date(2026, 1, 2), datetime.date(2026, 1, 2)), 100)
+
+
+@override_settings(TRAFFIC_FLUSH_INTERVAL=0)
+class TrafficRollupTests(TestCase):
+    def test_compaction_keeps_totals(self):
+        buffer = TrafficBuffer()
+        start = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+        for hour in range(24 * 40):
+            when = start + datetime.timedelta(hours=hour)
+            buffer.record(when, '10.0.0.1', '/api/menu/')
+            buffer.record(when, '10.0.0.1', '/')
+        buffer.flush()
+        self.assertEqual(TrafficRollup.objects.filter(resolution=TrafficRollup.HOUR).count(), 24 * 40 * 2)
+
+        rollups.compact_hours(0)
+        rollups.compact_days(0)
+        rollups.compact_days(0)  # nothing left to move, totals stay the same
+
+        self.assertFalse(TrafficRollup.objects.filter(resolution=TrafficRollup.HOUR).exists())
+        self.assertFalse(TrafficRollup.objects.filter(resolution=TrafficRollup.DAY).exists())
+        # Local time is UTC+5: the hours span Jan 1 05:00 - Feb 10 04:00, two months per group
+        self.assertEqual(TrafficRollup.objects.filter(resolution=TrafficRollup.MONTH).count(), 4)
+        self.assertEqual(sum(TrafficRollup.objects.values_list('views', flat=True)), 24 * 40 * 2)
+
+        views = dict(rollups.monthly_views(12))
+        self.assertEqual(sum(views.values()), 24 * 40 * 2)
+        self.assertEqual(len(views), 12)
+
+    def test_prune_sketches(self):
+        old = timezone.localdate() - datetime.timedelta(days=500)
+        DailyStats.objects.create(date=old, unique_visitors=3, visitor_sketch=b'E')
+        DailyStats.objects.create(date=timezone.localdate(), unique_visitors=1, visitor_sketch=b'E')
+
+        self.assertEqual(rollups.prune_sketches(400, chunk_size=1), 1)
+        self.assertIsNone(DailyStats.objects.get(date=old).visitor_sketch)
+        self.assertEqual(DailyStats.objects.get(date=old).unique_visitors, 3)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(METRICS_DIR=directory.name, TRAFFIC_FLUSH_INTERVAL=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        metrics.registry.reset()
+
+    def test_histogram_quantiles(self):
+        histogram = metrics.Histogram(metrics.DURATION_BUCKETS)
+        for i in range(100):
+            histogram.observe(0.004 if i < 90 else 0.2)
+        self.assertTrue(0.0025 < histogram.quantile(0.5) <= 0.005)
+        self.assertTrue(0.1 < histogram.quantile(0.95) <= 0.25)
+        self.assertEqual(histogram.count, 100)
+
+    def test_endpoint_is_staff_only(self):
+        self.assertEqual(self.client.get('/api/admin/metrics/').status_code, 403)
+
+    def test_export_merges_workers(self):
+        self.client.get('/api/status/')
+        # Another worker's file in the same directory
+        other = metrics.Histogram(metrics.DURATION_BUCKETS)
+        other.observe(0.5)
+        with open(f"{metrics.registry.directory()}/worker-other.json", 'w') as f:
+            f.write(f'[["http_request_duration_seconds", "api/status/", {other.counts}, 0.5]]')
+
+        User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.login(username='staff', password='pw')
+        response = self.client.get('/api/admin/metrics/')
+        text = response.content.decode()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('http_request_duration_seconds_count{route="api/status/"} 2', text)
+        self.assertIn('http_request_db_queries_bucket{route="api/status/",le="+Inf"}', text)
+        self.assertIn('traffic_monitor_duration_seconds_quantile{route="all",quantile="0.99"}', text)
+
+    def test_exited_workers_are_folded_in(self):
+        process = subprocess.Popen(['true'])
+        process.wait()  # a pid that no longer exists
+        dead = metrics.Histogram(metrics.DURATION_BUCKETS)
+        dead.observe(0.5)
+        path = f"{metrics.registry.directory()}/worker-{process.pid}-0123abcd.json"
+        os.makedirs(metrics.registry.directory(), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(f'[["http_request_duration_seconds", "api/status/", {dead.counts}, 0.5]]')
+
+        self.client.get('/api/status/')
+        for _ in range(2):
+            merged = metrics.registry.collect()
+            self.assertEqual(merged['http_request_duration_seconds', 'api/status/'].count, 2)
+        self.assertEqual(os.listdir(metrics.registry.directory()), [os.path.basename(metrics.registry.path)])
+
+
+def make_order(total, status='new', items='[]', **fields):
+    return Order.objects.create(name="Тест", phone="+70000000000", address="ул. Тестовая", items=items,
+                                total_price=total, status=status, **fields)
+
+
+class RevenueLedgerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def ledger_total(self):
+        row = RevenueLedger.objects.get(date=timezone.localdate())
+        return row.revenue, row.orders
+
+    def test_status_changes_and_cancellation(self):
+        first = make_order(500)
+        second = make_order(300)
+        self.assertEqual(self.ledger_total(), (800, 2))
+
+        first.status = 'cancelled'
+        first.save()
+        self.assertEqual(self.ledger_total(), (300, 1))
+
+        first.status = 'kitchen'
+        first.total_price = 450
+        first.save()
+        self.assertEqual(self.ledger_total(), (750, 2))
+
+        # Admin bulk actions go through set_status, not QuerySet.update()
+        ledger.set_status(Order.objects.filter(pk=second.pk), 'cancelled')
+        self.assertEqual(self.ledger_total(), (450, 1))
+        ledger.set_status(Order.objects.all(), 'completed')
+        self.assertEqual(self.ledger_total(), (750, 2))
+
+        Order.objects.get(pk=second.pk).delete()
+        self.assertEqual(self.ledger_total(), (450, 1))
+
+    def test_dashboard_is_cached(self):
+        make_order(500)
+        make_order(200, status='cancelled')
+        stats = dashboard_stats()
+        self.assertEqual(stats['revenue_today'], 500)
+        self.assertEqual(stats['orders_count_today'], 1)
+        self.assertEqual(stats['new_orders_count'], 1)
+        self.assertEqual(stats['revenue_total'], 500)
+
+        with self.assertNumQueries(0):
+            dashboard_stats()
+
+
+class DailySalesTests(TestCase):
+    items = '[{"title": "Цезарь", "quantity": 2, "price": 350}, {"title": "Борщ", "quantity": 1, "price": 300}]'
+
+    def test_booked_on_completion_and_reversed(self):
+        order = make_order(1000, items=self.items, payment_method='online')
+        make_order(300, items='[{"title": "Борщ", "quantity": 1, "price": 300}]')
+        self.assertFalse(DailySales.objects.exists())
+
+        ledger.set_status(Order.objects.all(), 'completed')
+        day = DailySales.objects.get()
+        self.assertEqual((day.orders, day.revenue, day.revenue_online, day.revenue_cash), (2, 1300, 1000, 300))
+        self.assertEqual(day.average_check, 650)
+        self.assertEqual(DailyProductSales.objects.get(title="Борщ").quantity, 2)
+
+        order.status = 'cancelled'
+        order.save()
+        day.refresh_from_db()
+        self.assertEqual((day.orders, day.revenue, day.revenue_online), (1, 300, 0))
+        self.assertEqual(DailyProductSales.objects.get(title="Цезарь").quantity, 0)
+
+    def test_report_and_backfill_match(self):
+        for status in ['completed', 'completed', 'cancelled', 'new']:
+            make_order(1000, status=status, items=self.items)
+        today = timezone.localdate()
+        live = sales.report(today, today)
+
+        DailySales.objects.all().delete()
+        DailyProductSales.objects.all().delete()
+        self.assertEqual(sales.rebuild(chunk_size=1), (2, 1))
+        rebuilt = sales.report(today, today)
+
+        self.assertEqual(live, rebuilt)
+        self.assertEqual(rebuilt['orders'], 2)
+        self.assertEqual(rebuilt['top_dishes'][0], {'title': "Цезарь", 'quantity': 4, 'revenue': 1400})
+
+    @override_settings(TRAFFIC_FLUSH_INTERVAL=0)
+    def test_report_endpoint_clamps_limit(self):
+        make_order(1000, status='completed', items=self.items)
+        User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.login(username='staff', password='pw')
+        for limit, dishes in (('-5', 1), ('0', 1), ('1000', 2)):
+            with self.subTest(limit=limit):
+                response = self.client.get('/api/admin/sales/', {'limit': limit})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['top_dishes']), dishes)
+        self.assertEqual(self.client.get('/api/admin/sales/', {'limit': 'x'}).status_code, 400)
+
+
+@override_settings(TRAFFIC_FLUSH_INTERVAL=0)
+class OrderLineTests(TestCase):
+    def setUp(self):
+        menu_snapshot._local_snapshot = None
+        pricing.table.version = None
+        category = Category.objects.create(name="Салаты")
+        self.caesar = Product.objects.create(category=category, title="Цезарь", price=350)
+
+    def test_create_order_writes_lines(self):
+        mors = Product.objects.create(category=self.caesar.category, title="Морс", price=100)
+        # Old carts only have titles
+        items = f'[{{"id": {self.caesar.pk}, "title": "Цезарь", "quantity": 2, "price": 350}}, {{"title": "Морс", "quantity": 1, "price": 100}}]'
+        response = self.client.post('/api/orders/', {
+            'name': "Тест", 'phone': "+70000000000", 'address': "Самовывоз", 'items': items,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+        lines = OrderLine.objects.filter(order_id=response.json()['order_id']).order_by('title')
+        self.assertEqual([(line.title, line.product_id, line.quantity) for line in lines],
+                         [("Морс", mors.pk, 1), ("Цезарь", self.caesar.pk, 2)])
+
+    def test_backfill_is_resumable(self):
+        for _ in range(5):
+            make_order(700, items='[{"title": "Цезарь", "quantity": 2, "price": 350}]')
+        make_order(0, items='not json')
+
+        # Pretend the first run stopped after two orders
+        order_lines.create_for(Order.objects.order_by('pk')[0])
+        order_lines.create_for(Order.objects.order_by('pk')[1])
+        self.assertEqual(order_lines.backfill(chunk_size=2), (4, 3))
+        self.assertEqual(order_lines.backfill(chunk_size=2), (1, 0))
+
+        start = timezone.now() - datetime.timedelta(days=30)
+        with self.assertNumQueries(1):
+            sold = OrderLine.objects.filter(product=self.caesar, created_at__gte=start).aggregate(total=Sum('quantity'))
+        self.assertEqual(sold['total'], 10)
+
+
+@override_settings(TRAFFIC_FLUSH_INTERVAL=0, DELIVERY_FEE=150, FREE_DELIVERY_FROM=1000)
+class PricingTests(TransactionTestCase):
+    # The price table follows the menu snapshot, which is rebuilt on commit
+
+    def setUp(self):
+        cache.clear()
+        # Versions start over in every test, drop what this process remembers
+        menu_snapshot._local_snapshot = None
+        pricing.table.version = None
+        category = Category.objects.create(name="Горячее")
+        self.products = [
+            Product.objects.create(category=category, title=f"Блюдо {i}", price=100 + i)
+            for i in range(30)
+        ]
+
+    def test_quote_has_no_per_item_queries(self):
+        cart = [{'id': product.pk, 'quantity': 2} for product in self.products]
+        pricing.quote(cart)  # builds the price table
+        with self.assertNumQueries(1):  # menu version check only
+            priced = pricing.quote(cart)
+        self.assertEqual(priced['items_total'], sum((100 + i) * 2 for i in range(30)))
+        self.assertEqual(priced['delivery_fee'], 0)
+
+    def test_price_change_is_picked_up(self):
+        product = self.products[0]
+        self.assertEqual(pricing.quote([{'id': product.pk, 'quantity': 1}])['total'], 100 + 150)
+        product.price = 900
+        product.save()
+        self.assertEqual(pricing.quote([{'id': product.pk, 'quantity': 1}], delivery=False)['total'], 900)
+
+    def test_lunch_combo_and_unknown_items(self):
+        BusinessLunch.objects.create(date=timezone.localdate(), salads="Цезарь", soups="Борщ",
+                                     hot_dishes="Плов", garnishes="", price_3_course=370)
+        priced = pricing.quote([{'lunch': '3_course', 'quantity': 2}], delivery=False)
+        self.assertEqual(priced['total'], 740)
+
+        with self.assertRaises(pricing.PricingError):
+            pricing.quote([{'id': 0, 'title': "Нет такого", 'quantity': 1}])
+        with self.assertRaises(pricing.PricingError):
+            pricing.quote([{'id': self.products[0].pk, 'quantity': -3}])
+
+    def test_order_total_comes_from_server(self):
+        product = self.products[5]
+        response = self.client.post('/api/cart/quote/', {
+            'items': [{'id': product.pk, 'quantity': 3}], 'delivery': 'delivery',
+        }, content_type='application/json')
+        self.assertEqual(response.json()['total'], 105 * 3 + 150)
+
+        response = self.client.post('/api/orders/', {
+            'name': "Тест", 'phone': "+70000000000", 'address': "ул. Ленина, 1", 'payment_method': 'transfer',
+            'total_price': 1, 'items': f'[{{"id": {product.pk}, "title": "{product.title}", "quantity": 3, "price": 1}}]',
+        }, content_type='application/json')
+        order = Order.objects.get(pk=response.json()['order_id'])
+        self.assertEqual((order.total_price, order.payment_method), (105 * 3 + 150, 'transfer'))
+
+
+class LunchImportTests(TestCase):
+    def test_rows_only_overwrite_their_columns(self):
+        BusinessLunch.objects.create(date=datetime.date(2026, 5, 4), salads="Старый", soups="-", hot_dishes="-",
+                                     garnishes="-", price_3_course=450)
+        sheet = "Дата;Салаты;Супы\n04.05.2026;Цезарь;Борщ\n05.05.2026;Овощной;Солянка\n".encode()
+        self.assertEqual(lunch_import.import_schedule(BytesIO(sheet), 'menu.csv'), 2)
+
+        updated = BusinessLunch.objects.get(date=datetime.date(2026, 5, 4))
+        self.assertEqual((updated.salads, updated.soups, updated.hot_dishes), ("Цезарь", "Борщ", "-"))
+        self.assertEqual(updated.price_3_course, 450)
+        self.assertEqual(BusinessLunch.objects.get(date=datetime.date(2026, 5, 5)).price_3_course, 370)
+
+        prices = "date,price_3_course,price_soup_hot\n2026-05-04,500,\n".encode()
+        lunch_import.import_schedule(BytesIO(prices), 'prices.csv')
+        updated.refresh_from_db()
+        self.assertEqual((updated.salads, updated.price_3_course, updated.price_soup_hot), ("Цезарь", 500, 320))
+
+
+class LunchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def make(self, day, **fields):
+        values = {'salads': "Цезарь", 'soups': "Борщ", 'hot_dishes': "Плов", 'garnishes': "Морс", **fields}
+        with self.captureOnCommitCallbacks(execute=True):
+            return BusinessLunch.objects.create(date=day, **values)
+
+    def get(self):
+        response = self.client.get('/api/lunch/')
+        self.assertEqual(response.status_code, 200)
+        return response.json() if response.content else None  # empty without any lunch
+
+    def test_cached_until_local_midnight(self):
+        tz = timezone.get_current_timezone()
+        late = timezone.make_aware(datetime.datetime(2026, 3, 1, 23, 59, 30), tz)
+        self.assertEqual(lunch.seconds_until_midnight(late), 31)
+        self.assertEqual(lunch.seconds_until_midnight(late.replace(hour=0, minute=0, second=0)), 24 * 3600 + 1)
+        # 19:30 UTC is already 00:30 of the next day in Yekaterinburg
+        utc = datetime.datetime(2026, 3, 1, 19, 30, tzinfo=datetime.timezone.utc)
+        self.assertEqual(lunch.seconds_until_midnight(utc), 23 * 3600 + 30 * 60 + 1)
+
+        today = timezone.localdate()
+        self.make(today)
+        self.get()
+        self.assertEqual(lunch.cache_key(today), f"lunch:{today.isoformat()}")
+        self.assertEqual(cache.get(lunch.cache_key(today))['lunch']['salads'], "Цезарь")
+        with self.assertNumQueries(0):
+            self.get()
+
+    def test_saving_or_deleting_drops_the_entry(self):
+        self.assertIsNone(self.get())  # "no lunch" is cached as well
+        with self.assertNumQueries(0):
+            self.get()
+
+        older = self.make(timezone.localdate() - datetime.timedelta(days=3))
+        self.assertEqual(self.get()['id'], older.pk)  # today's menu isn't filled in yet
+        today = self.make(timezone.localdate())
+        self.assertEqual(self.get()['id'], today.pk)
+
+        today.soups = "Солянка"
+        with self.captureOnCommitCallbacks(execute=True):
+            today.save()
+        self.assertEqual(self.get()['soups'], "Солянка")
+        with self.captureOnCommitCallbacks(execute=True):
+            today.delete()
+        self.assertEqual(self.get()['id'], older.pk)
+
+    def test_dishes_are_split_by_line(self):
+        self.make(timezone.localdate(), salads="Цезарь\r\n\n  Овощной  \n", garnishes="")
+        data = self.get()
+        self.assertEqual(data['salads_list'], ["Цезарь", "Овощной"])
+        self.assertEqual(data['soups_list'], ["Борщ"])
+        self.assertEqual(data['hot_dishes_list'], ["Плов"])
+        self.assertEqual(data['garnishes_list'], [])
+
+
+# In-process layer in place of Redis, same group_send/receive contract
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class AdminEventTests(TransactionTestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('manager', password='x', is_staff=True)
+
+    async def connect(self, user):
+        socket = ApplicationCommunicator(AdminOrdersConsumer.as_asgi(), {
+            'type': 'websocket', 'path': '/ws/admin/orders/', 'headers': [], 'subprotocols': [], 'user': user,
+        })
+        await socket.send_input({'type': 'websocket.connect'})
+        return socket, await socket.receive_output(timeout=1)
+
+    # Autocommit here, so the after-commit publish runs right away
+    def create_order(self):
+        return Order.objects.create(name="Анна", phone="1", address="-", items='[]', total_price=700)
+
+    def create_reservation(self):
+        return Reservation.objects.create(
+            name="Олег", phone="1", date=datetime.date(2026, 3, 1), time=datetime.time(19, 30), guests=4,
+        )
+
+    async def test_staff_receives_new_orders_and_reservations(self):
+        socket, reply = await self.connect(self.staff)
+        self.assertEqual(reply['type'], 'websocket.accept')
+
+        order = await sync_to_async(self.create_order)()
+        message = await socket.receive_output(timeout=1)
+        self.assertEqual(json.loads(message['text']), {
+            'event': 'order', 'id': order.pk, 'name': "Анна", 'total_price': 700, 'payment_method': 'cash',
+        })
+
+        await sync_to_async(self.create_reservation)()
+        message = await socket.receive_output(timeout=1)
+        self.assertEqual(json.loads(message['text'])['time'], '19:30')
+
+        # Status changes are not announced
+        await sync_to_async(ledger.set_status)(Order.objects.filter(pk=order.pk), 'kitchen')
+        self.assertTrue(await socket.receive_nothing())
+        await socket.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await socket.wait(timeout=1)
+
+    async def test_non_staff_is_rejected(self):
+        customer = await sync_to_async(User.objects.create_user)('guest', password='x')
+        socket, reply = await self.connect(customer)
+        self.assertEqual(reply, {'type': 'websocket.close', 'code': 4403})
+
+    def test_publish_survives_broken_layer(self):
+        with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'api.missing.Layer'}}):
+            events.publish({'event': 'order'})
+
+
+@override_settings(CHANGEFEED_SHARED=True, ADMIN_POLL_TIMEOUT=0.3, ADMIN_POLL_INTERVAL=0.05, TRAFFIC_FLUSH_INTERVAL=0)
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user('manager', password='x', is_staff=True)
+        self.client.force_login(self.manager)
+        self.async_client.force_login(self.manager)
+
+    def poll(self, since=''):
+        # Over ASGI, like production
+        response = async_to_sync(self.async_client.get)('/api/admin/poll/', {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def create_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Order.objects.create(name="Анна", phone="1", address="-", items='[]', total_price=700)
+
+    def test_counters_are_seeded_from_tables_and_then_cached(self):
+        order = self.create_order()
+        cache.clear()
+        self.assertEqual(changefeed.current(), (order.pk, 0, 0))
+        with self.assertNumQueries(0):
+            self.assertEqual(changefeed.current(), (order.pk, 0, 0))
+
+    def test_poll_reports_changes_since_token(self):
+        token = self.poll()['token']
+
+        order = self.create_order()
+        self.create_order()
+        result = self.poll(token)
+        self.assertTrue(result['changed'])
+        self.assertEqual((result['new_orders'], result['new_reservations']), (2, 0))
+        self.assertTrue(result['play_sound'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.set_status(Order.objects.filter(pk=order.pk), 'kitchen')
+        result = self.poll(result['token'])
+        self.assertEqual(result['status_changes'], 1)
+        self.assertFalse(result['play_sound'])
+
+    def test_idle_poll_times_out(self):
+        token = self.poll()['token']
+        started = timezone.now()
+        result = self.poll(token)
+        self.assertFalse(result['changed'])
+        self.assertEqual(result['token'], token)
+        self.assertGreaterEqual((timezone.now() - started).total_seconds(), 0.3)
+
+    def test_staff_only(self):
+        self.client.force_login(User.objects.create_user('guest', password='x'))
+        self.assertEqual(self.client.get('/api/admin/poll/').status_code, 403)
+
+    def test_no_held_request_under_wsgi_or_without_shared_cache(self):
+        token = self.poll()['token']
+        self.assertEqual(self.client.get('/api/admin/poll/', {'since': token}).json(), {'long_poll': False})
+        with override_settings(CHANGEFEED_SHARED=False):
+            self.assertEqual(self.poll(token), {'long_poll': False})
+
+    def test_check_new_answers_from_the_counters(self):
+        client = Client()  # without a session to load
+        token = client.get('/api/admin/check-new/').json()['token']
+        self.create_order()
+        with self.assertNumQueries(0):
+            result = client.get('/api/admin/check-new/', {'since': token}).json()
+        self.assertEqual((result['new_orders'], result['play_sound']), (1, True))
+
+        # Counters that miss other processes' changes: read the tables
+        with override_settings(CHANGEFEED_SHARED=False):
+            Order.objects.create(name="Анна", phone="1", address="-", items='[]', total_price=700)  # no bump
+            result = client.get('/api/admin/check-new/', {'since': result['token']}).json()
+        self.assertEqual(result['new_orders'], 1)
+
+
+@override_settings(TRAFFIC_FLUSH_INTERVAL=0)
+class QueryBudgetTests(TestCase):
+    """
+    Pins the number of SQL queries per endpoint and admin page. Each check
+    runs with few and with many rows, so an N+1 fails even if the budget
+    itself gets bumped.
+    """
+
+    def setUp(self):
+        cache.clear()
+        menu_snapshot._local_snapshot = None
+        pricing.table.version = None
+        category = Category.objects.create(name="Супы")
+        self.products = [Product.objects.create(category=category, title=f"Суп {i}", price=100 + i) for i in range(12)]
+        self.staff = User.objects.create_user('manager', password='x', is_staff=True, is_superuser=True)
+        self.customer = User.objects.create_user('guest', password='x')
+
+    def add_orders(self, count, user=None):
+        for i in range(count):
+            order = Order.objects.create(
+                user=user, name="Анна", phone="1", address="-", total_price=300,
+                items=json.dumps([{'id': p.pk, 'title': p.title, 'quantity': 1, 'price': 100} for p in self.products[:3]]),
+            )
+            order_lines.create_for(order)
+            Reservation.objects.create(name="Олег", phone="1", date=timezone.localdate(), time=datetime.time(12, i % 60), guests=2)
+
+    def assertBudget(self, queries, url, status=200, method='get', **kwargs):
+        for rows in (2, 10):
+            self.add_orders(rows, user=self.customer)
+            cache.delete(DASHBOARD_CACHE_KEY)
+            with self.assertNumQueries(queries, msg=f"{url} with {rows} more orders"):
+                response = getattr(self.client, method)(url, **kwargs)
+            self.assertEqual(response.status_code, status)
+
+    def test_public_endpoints(self):
+        # Both are cached after the first request: the menu costs its version check
+        self.client.get('/api/menu/')
+        self.client.get('/api/lunch/')
+        self.assertBudget(1, '/api/menu/')
+        self.assertBudget(0, '/api/lunch/')
+
+    def test_create_order_does_not_query_per_line(self):
+        self.client.get('/api/menu/')  # builds the snapshot once
+        for count in (1, 12):
+            cart = [{'id': p.pk, 'title': p.title, 'quantity': 2} for p in self.products[:count]]
+            with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(10, msg=f"{count} lines"):
+                response = self.client.post('/api/orders/', {
+                    'name': "Анна", 'phone': "1", 'address': "-", 'items': cart,
+                }, content_type='application/json')
+            self.assertEqual(response.status_code, 201, response.content)
+
+    def test_profile(self):
+        self.client.force_login(self.customer)
+        self.assertBudget(5, '/api/profile/data/')
+        self.assertBudget(4, '/api/profile/orders/?limit=5')
+
+    def test_check_new(self):
+        self.client.force_login(self.staff)
+        self.client.get('/api/admin/check-new/')  # seeds the change counters
+        self.assertBudget(2, '/api/admin/check-new/')
+
+    def test_admin_pages(self):
+        self.client.force_login(self.staff)
+        self.assertBudget(13, '/admin/')
+        self.assertBudget(6, '/admin/api/order/')
+        self.assertBudget(5, '/admin/api/reservation/')
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        # A million orders in production, enough here for the planner to prefer an index anyway
+        out = StringIO()
+        call_command('check_query_plans', seed=20000, stdout=out)
+        self.assertIn("All hot queries use an index", out.getvalue())
+        self.assertEqual(Order.objects.count(), 0)
+
+
+@override_settings(TRAFFIC_FLUSH_INTERVAL=0)
+class ProfileOrdersTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('guest', password='x')
+        self.client.force_login(self.user)
+        # Pairs of orders with the same created_at, so ties are broken by id
+        moment = timezone.now()
+        self.orders = []
+        for i in range(7):
+            order = Order.objects.create(user=self.user, name="Анна", phone="1", address="-", total_price=100 + i, items='[]')
+            Order.objects.filter(pk=order.pk).update(created_at=moment - datetime.timedelta(minutes=i // 2))
+            self.orders.append(order.pk)
+        self.newest_first = sorted(
+            self.orders, key=lambda pk: (Order.objects.get(pk=pk).created_at, pk), reverse=True,
+        )
+
+    def test_pages_cover_all_orders_once(self):
+        seen = []
+        url = '/api/profile/orders/?limit=3'
+        while True:
+            data = self.client.get(url).json()
+            self.assertLessEqual(len(data['results']), 3)
+            seen += [order['id'] for order in data['results']]
+            if not data['next']:
+                break
+            url = f"/api/profile/orders/?limit=3&cursor={data['next']}"
+        self.assertEqual(seen, self.newest_first)
+
+    def test_profile_data_is_the_first_page(self):
+        data = self.client.get('/api/profile/data/').json()
+        self.assertEqual([order['id'] for order in data['orders']], self.newest_first)
+        self.assertIsNone(data['orders_next'])
+        self.assertNotIn('items', data['orders'][0])
+
+    def test_new_orders_do_not_shift_pages(self):
+        first = self.client.get('/api/profile/orders/?limit=4').json()
+        Order.objects.create(user=self.user, name="Анна", phone="1", address="-", total_price=1, items='[]')
+        rest = self.client.get(f"/api/profile/orders/?limit=4&cursor={first['next']}").json()
+        self.assertEqual([o['id'] for o in first['results'] + rest['results']], self.newest_first)
+
+    def test_bad_cursor(self):
+        for cursor in ('garbage', 'bm90IGEgY3Vyc29y', '!!!'):
+            self.assertEqual(self.client.get(f'/api/profile/orders/?cursor={cursor}').status_code, 400)
+        self.assertEqual(self.client.get('/api/profile/orders/?limit=x').status_code, 400)
+
+    def test_order_detail(self):
+        response = self.client.get(f'/api/profile/orders/{self.orders[0]}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'], '[]')
+
+        other = User.objects.create_user('other', password='x')
+        foreign = Order.objects.create(user=other, name="Олег", phone="1", address="-", total_price=1, items='[]')
+        self.assertEqual(self.client.get(f'/api/profile/orders/{foreign.pk}/').status_code, 404)
+        self.assertNotIn(foreign.pk, [o['id'] for o in self.client.get('/api/profile/orders/').json()['results']])
+
+        self.client.logout()
+        self.assertEqual(self.client.get(f'/api/profile/orders/{self.orders[0]}/').status_code, 401)
+
+
+@override_settings(IDEMPOTENCY_WAIT_SECONDS=0.3, TRAFFIC_FLUSH_INTERVAL=0)
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        menu_snapshot._local_snapshot = None
+        pricing.table.version = None
+        category = Category.objects.create(name="Супы")
+        self.soup = Product.objects.create(category=category, title="Борщ", price=350)
+        self.client.get('/api/menu/')
+
+    def post_order(self, key, quantity=2):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/orders/', {
+                'name': "Анна", 'phone': "1", 'address': "-", 'items': [{'id': self.soup.pk, 'quantity': quantity}],
+            }, content_type='application/json', headers={'Idempotency-Key': key})
+
+    def test_retry_replays_first_response_without_touching_orders(self):
+        first = self.post_order('key-1')
+        self.assertEqual(first.status_code, 201)
+
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.post_order('key-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertFalse([q for q in queries if 'api_order' in q['sql']])
+        self.assertEqual(Order.objects.count(), 1)
+
+        self.assertEqual(self.post_order('key-2').status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_key_reused_for_another_request(self):
+        self.post_order('key-1')
+        self.assertEqual(self.post_order('key-1', quantity=3).status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_failed_request_releases_key(self):
+        response = self.client.post('/api/orders/', {'name': "Анна"}, content_type='application/json',
+                                    headers={'Idempotency-Key': 'key-1'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_concurrent_duplicate_waits_for_the_first(self):
+        # The first request holds the key and hasn't answered yet
+        key = hashlib.sha256(b"orders:key-1").hexdigest()
+        body = json.dumps({'name': "Анна", 'phone': "1", 'address': "-", 'items': [{'id': self.soup.pk, 'quantity': 2}]})
+        IdempotencyKey.objects.create(key=key, fingerprint=hashlib.sha256(body.encode()).hexdigest(), created_at=timezone.now())
+
+        response = self.client.post('/api/orders/', body, content_type='application/json', headers={'Idempotency-Key': 'key-1'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.count(), 0)
+
+        # A claim nobody finished is taken over after IDEMPOTENCY_LOCK_SECONDS
+        IdempotencyKey.objects.filter(key=key).update(created_at=timezone.now() - datetime.timedelta(minutes=5))
+        self.assertEqual(self.post_order('key-1').status_code, 201)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_expired_keys_are_purged(self):
+        self.post_order('key-1')
+        IdempotencyKey.objects.update(created_at=timezone.now() - datetime.timedelta(days=2))
+        self.post_order('key-2')
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+
+class StubPayKeeper(BaseHTTPRequestHandler):
+    """The two PayKeeper JSON API calls the client makes, with scripted failures."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def answer(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.server.state
+        state['connections'].add(self.client_address)
+        if self.path == '/info/settings/token/' and self.headers.get('Authorization', '').startswith('Basic '):
+            state['tokens'] += 1
+            return self.answer(200, {'token': f"token-{state['tokens']}"})
+        self.answer(404, {})
+
+    def do_POST(self):
+        state = self.server.state
+        state['connections'].add(self.client_address)
+        form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        if state['failures']:
+            return self.answer(state['failures'].pop(0), {})
+        if self.path == '/change/invoice/preview/' and form.get('token', [''])[0].startswith('token-'):
+            state['invoices'].append(form)
+            return self.answer(200, {'invoice_id': f"inv{len(state['invoices'])}"})
+        self.answer(404, {})
+
+
+@override_settings(PAYKEEPER_USER='api', PAYKEEPER_PASSWORD='secret', PAYKEEPER_BACKOFF=0.01, TRAFFIC_FLUSH_INTERVAL=0)
+class PayKeeperClientTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubPayKeeper)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.state = {'tokens': 0, 'invoices': [], 'failures': [], 'connections': set()}
+        paykeeper.client.close()
+        self.addCleanup(paykeeper.client.close)
+        settings_override = override_settings(PAYKEEPER_SERVER_URL=self.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def make_order(self, total=990):
+        return Order.objects.create(name="Анна", phone="79990000000", address="-", items='[]',
+                                    total_price=total, payment_method='online')
+
+    def test_invoice_is_created_once_and_cached_on_the_order(self):
+        order = self.make_order()
+        url = paykeeper.get_payment_url(order)
+        self.assertEqual(url, f"{self.url}/bill/inv1/")
+        self.assertEqual(self.server.state['invoices'][0]['pay_amount'], ['990'])
+        self.assertEqual(self.server.state['invoices'][0]['orderid'], [str(order.pk)])
+
+        # Asking again (e.g. the customer retries payment) reuses the invoice
+        self.assertEqual(paykeeper.get_payment_url(Order.objects.get(pk=order.pk)), url)
+        self.assertEqual(len(self.server.state['invoices']), 1)
+
+        # One token and one kept-alive connection for all calls
+        paykeeper.get_payment_url(self.make_order())
+        self.assertEqual(self.server.state['tokens'], 1)
+        self.assertEqual(len(self.server.state['connections']), 1)
+
+    def test_retries_gateway_errors_but_not_server_errors(self):
+        self.server.state['failures'] = [503, 502]
+        self.assertEqual(paykeeper.get_payment_url(self.make_order()), f"{self.url}/bill/inv1/")
+
+        self.server.state['failures'] = [500]
+        order = self.make_order()
+        with self.assertRaises(paykeeper.PayKeeperError):
+            paykeeper.get_payment_url(order)
+        order.refresh_from_db()
+        self.assertEqual(order.invoice_url, '')
+        self.assertIsNone(paykeeper.client.token)
+
+    def test_unreachable_server(self):
+        with override_settings(PAYKEEPER_SERVER_URL='http://127.0.0.1:9', PAYKEEPER_RETRIES=1):
+            with self.assertRaises(paykeeper.PayKeeperError):
+                paykeeper.get_payment_url(self.make_order())
+
+    def test_payment_endpoint_uses_pooled_client(self):
+        cache.clear()
+        menu_snapshot._local_snapshot = None
+        pricing.table.version = None
+        soup = Product.objects.create(category=Category.objects.create(name="Супы"), title="Борщ", price=350)
+        self.client.get('/api/menu/')
+        created = self.client.post('/api/orders/', {
+            'name': "Анна", 'phone': "1", 'address': "-", 'payment_method': 'online',
+            'items': [{'id': soup.pk, 'quantity': 3}],
+        }, content_type='application/json').json()
+        self.assertNotIn('payment_url', created)
+        self.assertEqual(self.server.state['invoices'], [])
+
+        url = f"/api/orders/{created['order_id']}/payment/"
+        response = self.client.get(url, {'token': created['payment_token']})
+        self.assertEqual(response.json(), {'payment_url': f"{self.url}/bill/inv1/"})
+        self.assertEqual(self.client.get(url, {'token': created['payment_token']}).json(), response.json())
+        self.assertEqual(len(self.server.state['invoices']), 1)
+        self.assertEqual(Order.objects.get(pk=created['order_id']).invoice_id, 'inv1')
+
+        self.assertEqual(self.client.get(url, {'token': 'forged'}).status_code, 403)
+        other = self.make_order()
+        self.assertEqual(self.client.get(f"/api/orders/{other.pk}/payment/", {'token': created['payment_token']}).status_code, 403)
+
+        # Under WSGI every async view gets its own loop: the sync client serves it
+        self.assertIsNone(paykeeper.client.async_client)
+
+        # Over ASGI the async client does
+        created = self.client.post('/api/orders/', {
+            'name': "Анна", 'phone': "1", 'address': "-", 'payment_method': 'online',
+            'items': [{'id': soup.pk, 'quantity': 1}],
+        }, content_type='application/json').json()
+        response = async_to_sync(self.async_client.get)(
+            f"/api/orders/{created['order_id']}/payment/", {'token': created['payment_token']},
+        )
+        self.assertEqual(response.json(), {'payment_url': f"{self.url}/bill/inv2/"})
+        self.assertIsNotNone(paykeeper.client.async_client)
+        self.assertEqual(Order.objects.get(pk=created['order_id']).invoice_id, 'inv2')
+
+
+def callback_form(order, payment_id='pk-1', **extra):
+    return {'id': payment_id, 'orderid': str(order.pk), 'sum': '990.00',
+            'key': paykeeper.notification_hash(payment_id), **extra}
+
+
+@override_settings(PAYKEEPER_SECRET_KEY='callback-secret', TRAFFIC_FLUSH_INTERVAL=0)
+class PayKeeperCallbackTests(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(name="Анна", phone="1", address="-", items='[]', total_price=990)
+
+    def test_marks_order_paid_once_and_logs_every_notification(self):
+        response = self.client.post('/api/paykeeper/callback/', callback_form(self.order))
+        self.assertEqual(response.content.decode(), f"OK {paykeeper.notification_hash('pk-1')}")
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.is_paid)
+        self.assertEqual((self.order.payment_id, self.order.payment_method), ('pk-1', 'online'))
+
+        # PayKeeper repeats it: same answer, no second transition
+        with self.assertNumQueries(5):  # UPDATE (no row), EXISTS, event, in a savepoint
+            again = self.client.post('/api/paykeeper/callback/', callback_form(self.order))
+        self.assertEqual(again.content, response.content)
+        self.assertEqual(
+            list(PaymentEvent.objects.order_by('pk').values_list('outcome', 'order_id', 'amount')),
+            [('paid', self.order.pk, Decimal('990.00')), ('duplicate', self.order.pk, Decimal('990.00'))],
+        )
+
+    def test_rejected_notifications_are_logged(self):
+        forged = callback_form(self.order, key='0' * 32)
+        self.assertEqual(self.client.post('/api/paykeeper/callback/', forged).status_code, 403)
+        self.assertEqual(self.client.post('/api/paykeeper/callback/', callback_form(self.order, key='ключ')).status_code, 403)
+        self.assertEqual(self.client.post('/api/paykeeper/callback/', {'id': 'pk-1'}).status_code, 400)
+        missing = callback_form(self.order, orderid='999999')
+        self.assertEqual(self.client.post('/api/paykeeper/callback/', missing).status_code, 404)
+
+        self.assertFalse(Order.objects.get(pk=self.order.pk).is_paid)
+        self.assertEqual(
+            list(PaymentEvent.objects.order_by('pk').values_list('outcome', flat=True)),
+            ['bad_signature', 'bad_signature', 'invalid', 'unknown_order'],
+        )
+
+    def test_completed_cash_order_paid_online_moves_in_sales(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.set_status(Order.objects.filter(pk=self.order.pk), 'completed')
+        self.client.post('/api/paykeeper/callback/', callback_form(self.order))
+        day = DailySales.objects.get()
+        self.assertEqual((day.revenue_cash, day.revenue_online), (0, 990))
+
+
+@override_settings(PAYKEEPER_SECRET_KEY='callback-secret', TRAFFIC_FLUSH_INTERVAL=0)
+class PayKeeperCallbackLoadTests(TransactionTestCase):
+    def test_concurrent_duplicates_make_one_transition(self):
+        order = Order.objects.create(name="Анна", phone="1", address="-", items='[]', total_price=990)
+        form = callback_form(order)
+
+        def notify(_):
+            return Client().post('/api/paykeeper/callback/', form).status_code
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            statuses = list(pool.map(notify, range(2000)))
+
+        self.assertEqual(set(statuses), {200})
+        self.assertEqual(PaymentEvent.objects.filter(outcome='paid').count(), 1)
+        self.assertEqual(PaymentEvent.objects.filter(outcome='duplicate').count(), 1999)
+        self.assertTrue(Order.objects.get(pk=order.pk).is_paid)
+
+
+@override_settings(TRAFFIC_FLUSH_INTERVAL=0)
+class ReconcileTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        make = lambda **kw: Order.objects.create(name="Анна", phone="1", address="-", items='[]', payment_method='online', **kw)
+        self.ok = make(total_price=990, is_paid=True, payment_id='p1')
+        self.unpaid = make(total_price=500)
+        self.wrong_sum = make(total_price=700)
+        self.twice = make(total_price=300, is_paid=True, payment_id='p4')
+
+    def export_rows(self):
+        return [
+            {'id': 'p1', 'orderid': str(self.ok.pk), 'pay_amount': '990.00', 'status': 'success'},
+            {'id': 'p2', 'orderid': str(self.unpaid.pk), 'pay_amount': '500.00', 'status': 'success'},
+            {'id': 'p3', 'orderid': str(self.wrong_sum.pk), 'pay_amount': '70.00', 'status': 'success'},
+            {'id': 'p5', 'orderid': str(self.twice.pk), 'pay_amount': '300.00', 'status': 'success'},
+            {'id': 'p6', 'orderid': '999999', 'pay_amount': '100.00', 'status': 'success'},
+            {'id': 'p7', 'orderid': str(self.unpaid.pk), 'pay_amount': '500.00', 'status': 'refunded'},
+        ]
+
+    def write(self, name, text):
+        path = f"{self.directory.name}/{name}"
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_reports_every_kind_of_problem_in_batches(self):
+        with self.assertNumQueries(4):  # one in_bulk per batch of 2, and the archive for the unknown order
+            result = reconcile.reconcile(iter(self.export_rows()), batch_size=2)
+        self.assertEqual((result.rows, result.matched, result.skipped), (6, 1, 1))
+        self.assertEqual(result.issues, {'missing_callback': 1, 'amount_mismatch': 1, 'other_payment': 1, 'orphan': 1})
+        self.assertFalse(Order.objects.get(pk=self.unpaid.pk).is_paid)
+
+    def test_apply_books_missing_callbacks(self):
+        result = reconcile.reconcile(self.export_rows(), apply=True)
+        self.assertEqual(result.applied, 1)
+        order = Order.objects.get(pk=self.unpaid.pk)
+        self.assertEqual((order.is_paid, order.payment_id), (True, 'p2'))
+        self.assertEqual(PaymentEvent.objects.get().outcome, 'reconciled')
+
+    def test_reads_csv_json_array_and_json_lines(self):
+        rows = self.export_rows()
+        csv_text = "ID платежа;Номер заказа;Сумма;Статус\n" + "".join(
+            f"{r['id']};{r['orderid']};{r['pay_amount'].replace('.', ',')};{r['status']}\n" for r in rows
+        )
+        paths = [
+            self.write('export.csv', csv_text),
+            self.write('export.json', json.dumps(rows, indent=2)),
+            self.write('export.jsonl', "\n".join(json.dumps(r) for r in rows)),
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                result = reconcile.reconcile(reconcile.read_rows(path), batch_size=4)
+                self.assertEqual(sum(result.issues.values()), 4)
+                self.assertEqual(result.matched, 1)
+
+    def test_json_objects_split_across_chunks(self):
+        path = self.write('export.json', json.dumps(self.export_rows() * 50))
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(len(list(reconcile.iter_json(f, chunk_size=7))), 300)
+
+    def test_command_writes_report(self):
+        export = self.write('export.json', json.dumps(self.export_rows()))
+        report = f"{self.directory.name}/report.csv"
+        out = StringIO()
+        call_command('reconcile_paykeeper', export, report=report, stdout=out)
+        self.assertIn("4 problems found", out.getvalue())
+        with open(report, encoding='utf-8') as f:
+            self.assertEqual([line.split(',')[0] for line in f.read().splitlines()[1:]],
+                             ['missing_callback', 'amount_mismatch', 'other_payment', 'orphan'])
+
+
+@override_settings(TRAFFIC_FLUSH_INTERVAL=0)
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('guest', password='x')
+        self.borsch = Product.objects.create(category=Category.objects.create(name="Супы"), title="Борщ", price=250)
+        old = timezone.now() - datetime.timedelta(days=200)
+
+        def make(status, created_at, **kw):
+            order = Order.objects.create(
+                user=self.user, name="Анна", phone="1", address="-", total_price=500, status=status,
+                items=json.dumps([{'id': None, 'title': "Борщ", 'quantity': 2, 'price': 250}]), **kw,
+            )
+            order_lines.create_for(order)
+            Order.objects.filter(pk=order.pk).update(created_at=created_at)
+            return order.pk
+
+        self.completed = make('completed', old, is_paid=True, payment_id='p1')
+        self.cancelled = make('cancelled', old - datetime.timedelta(hours=1))
+        self.stuck = make('new', old)  # never archived while it's open
+        self.recent = make('completed', timezone.now())
+        PaymentEvent.objects.create(order_id=self.completed, payment_id='p1', amount=500, outcome='paid')
+
+    def totals(self):
+        return (
+            list(RevenueLedger.objects.values_list('date', 'revenue', 'orders')),
+            list(DailySales.objects.values_list('date', 'orders', 'revenue')),
+        )
+
+    def test_moves_old_closed_orders_and_keeps_rollups(self):
+        sales.rebuild()  # the orders were backdated with update()
+        before = self.totals()
+        self.assertEqual(archive.archive(days=180, batch_size=1), 2)
+
+        self.assertEqual(set(ArchivedOrder.objects.values_list('pk', flat=True)), {self.completed, self.cancelled})
+        self.assertEqual(set(Order.objects.values_list('pk', flat=True)), {self.stuck, self.recent})
+        archived = ArchivedOrder.objects.get(pk=self.completed)
+        self.assertEqual((archived.user_id, archived.payment_id, archived.total_price), (self.user.pk, 'p1', 500))
+        self.assertTrue(OrderLine.objects.filter(order_id=self.completed).exists())
+        self.assertEqual(PaymentEvent.objects.get().payment_id, 'p1')
+
+        # Archiving isn't cancelling: revenue and sales are unchanged, and a rebuild still counts them
+        self.assertEqual(self.totals(), before)
+        DailySales.objects.all().delete()
+        self.assertEqual(sales.rebuild()[0], 2)
+        self.assertEqual(self.totals(), before)
+
+        self.assertEqual(archive.archive(days=180), 0)
+
+    def test_dish_figures_keep_archived_orders(self):
+        def sold():
+            return OrderLine.objects.filter(product=self.borsch).aggregate(total=Sum('quantity'))['total']
+
+        before = sold()
+        self.assertEqual(before, 8)
+        self.assertEqual(archive.archive(days=180), 2)
+        self.assertEqual(sold(), before)
+
+        # Deleting an order still takes its lines along
+        Order.objects.get(pk=self.recent).delete()
+        self.assertEqual(sold(), before - 2)
+
+    def test_archived_ids_are_not_handed_out_again(self):
+        Order.objects.filter(pk=self.recent).update(created_at=timezone.now() - datetime.timedelta(days=200))
+        self.assertEqual(archive.archive(days=180), 3)
+        self.assertNotIn(self.recent, Order.objects.values_list('pk', flat=True))
+        order = Order.objects.create(name="Анна", phone="1", address="-", items='[]', total_price=100)
+        self.assertGreater(order.pk, self.recent)
+
+    def test_rerun_after_interrupted_batch(self):
+        # The archive copy was written but the live row never deleted
+        row = Order.objects.filter(pk=self.completed).values(*archive.FIELDS).get()
+        ArchivedOrder.objects.create(archived_at=timezone.now(), **row)
+        self.client.force_login(self.user)
+        ids = [o['id'] for o in self.client.get('/api/profile/orders/').json()['results']]
+        self.assertEqual(ids.count(self.completed), 1)
+
+        self.assertEqual(archive.archive(days=180), 2)
+        self.assertEqual(ArchivedOrder.objects.count(), 2)
+
+    def test_profile_reads_both_tables(self):
+        self.client.force_login(self.user)
+        expected = [o['id'] for o in self.client.get('/api/profile/orders/').json()['results']]
+        archive.archive(days=180)
+
+        seen, url = [], '/api/profile/orders/?limit=2'
+        while url:
+            data = self.client.get(url).json()
+            seen += [order['id'] for order in data['results']]
+            url = data['next'] and f"/api/profile/orders/?limit=2&cursor={data['next']}"
+        self.assertEqual(seen, expected)
+
+        detail = self.client.get(f'/api/profile/orders/{self.completed}/')
+        self.assertEqual(detail.status_code, 200)
+        self.assertEqual(detail.json()['status'], 'completed')
+        self.client.force_login(User.objects.create_user('other', password='x'))
+        self.assertEqual(self.client.get(f'/api/profile/orders/{self.completed}/').status_code, 404)
+
+    def test_admin_search_points_to_archive(self):
+        archive.archive(days=180)
+        self.client.force_login(User.objects.create_user('manager', password='x', is_staff=True, is_superuser=True))
+        response = self.client.get('/admin/api/order/', {'q': "Анна"})
+        self.assertContains(response, "В архиве найдено еще заказов: 2")
+        response = self.client.get('/admin/api/archivedorder/', {'q': "Анна"})
+        self.assertContains(response, "Борщ")
+
+    def test_reconcile_finds_archived_orders(self):
+        archive.archive(days=180)
+        rows = [{'id': 'p1', 'orderid': str(self.completed), 'pay_amount': '500', 'status': 'success'}]
+        result = reconcile.reconcile(rows)
+        self.assertEqual((result.matched, sum(result.issues.values())), (1, 0))
+
+    def test_command_dry_run(self):
+        out = StringIO()
+        call_command('archive_orders', '--dry-run', stdout=out)
+        self.assertIn("2 orders would be archived", out.getvalue())
+        self.assertFalse(ArchivedOrder.objects.exists())
+
+
+HALL = dict(
+    RESERVATION_TABLES=[2, 4], RESERVATION_TURN_MINUTES=120, RESERVATION_SLOT_MINUTES=30,
+    RESERVATION_OPEN='12:00', RESERVATION_LAST_SEATING='20:00', TRAFFIC_FLUSH_INTERVAL=0,
+)
+
+
+def times_between(start, end):
+    """"HH:MM" every half hour from start to end, both included."""
+    first, last = slots.minutes(start), slots.minutes(end)
+    return [slots.as_time(m).strftime('%H:%M') for m in range(first, last + 1, 30)]
+
+
+@override_settings(**HALL)
+class SlotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.day = timezone.localdate() + datetime.timedelta(days=1)
+
+    def book(self, time, guests=2, day=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/reservations/', {
+                'name': "Олег", 'phone': "1", 'date': str(day or self.day), 'time': time, 'guests': guests,
+            }, content_type='application/json')
+
+    def times(self, guests, day=None):
+        response = self.client.get('/api/reservations/availability/', {'date': str(day or self.day), 'guests': guests})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['times']
+
+    def test_bookings_take_the_smallest_free_table(self):
+        self.assertEqual(self.times(2), times_between('12:00', '20:00'))
+
+        self.assertEqual(self.book('14:00').status_code, 201)
+        self.assertEqual(self.book('14:00').status_code, 201)
+        self.assertEqual(list(Reservation.objects.order_by('pk').values_list('table', flat=True)), [1, 2])
+
+        # Both tables are taken from 14:00 to 16:00
+        free = times_between('12:00', '12:00') + times_between('16:00', '20:00')
+        self.assertEqual(self.times(2), free)
+        self.assertEqual(self.times(3), free)
+
+        response = self.book('15:00')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("нет свободных столов", response.json()['error'])
+        self.assertEqual(Reservation.objects.count(), 2)
+
+    def test_index_is_cached_and_rebuilt_after_changes(self):
+        slots.availability(self.day, 3)  # builds the day
+        with self.assertNumQueries(0):
+            slots.availability(self.day, 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation = Reservation.objects.create(name="Олег", phone="1", date=self.day, time=datetime.time(18),
+                                                     guests=4, table=2)
+        with self.assertNumQueries(1):
+            self.assertNotIn(datetime.time(18), slots.availability(self.day, 3))
+        with self.assertNumQueries(0):
+            slots.availability(self.day, 3)
+
+        # Cancelling frees the table, moving the booking frees the old day
+        reservation.status = 'cancelled'
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation.save()
+        self.assertIn(datetime.time(18), slots.availability(self.day, 3))
+
+        other_day = self.day + datetime.timedelta(days=1)
+        slots.availability(other_day, 3)
+        reservation.status, reservation.date = 'confirmed', other_day
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation.save()
+        self.assertNotIn(datetime.time(18), slots.availability(other_day, 3))
+        self.assertIn(datetime.time(18), slots.availability(self.day, 3))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation.delete()
+        self.assertIn(datetime.time(18), slots.availability(other_day, 3))
+
+    def test_index_built_before_a_change_is_never_read(self):
+        hall = slots.Hall()
+        before = slots.generation(hall, self.day)
+        stale = slots.load(hall, self.day)  # a slow reader, still without the booking
+        with self.captureOnCommitCallbacks(execute=True):
+            Reservation.objects.create(name="Олег", phone="1", date=self.day, time=datetime.time(18),
+                                       guests=4, table=2)
+        cache.set(hall.cache_key(self.day, before), stale)
+        self.assertNotIn(datetime.time(18), slots.availability(self.day, 3))
+
+        # An expired counter starts over at a value never used before
+        cache.delete(hall.generation_key(self.day))
+        self.assertNotEqual(slots.generation(hall, self.day), before)
+
+    def test_bookings_without_a_table_are_counted(self):
+        # Made before tables were assigned
+        Reservation.objects.create(name="Олег", phone="1", date=self.day, time=datetime.time(12, 10), guests=4)
+        self.assertEqual(self.times(3), times_between('14:30', '20:00'))
+
+    def test_large_parties_are_arranged_by_phone(self):
+        self.book('18:00', guests=4)
+        response = self.client.get('/api/reservations/availability/', {'date': str(self.day), 'guests': 9})
+        self.assertTrue(response.json()['by_phone'])
+        self.assertEqual(response.json()['times'], times_between('12:00', '20:00'))
+
+        self.assertEqual(self.book('18:00', guests=9).status_code, 201)
+        self.assertIsNone(Reservation.objects.get(guests=9).table)
+
+    def test_rejects_times_that_cant_be_booked(self):
+        yesterday = timezone.localdate() - datetime.timedelta(days=1)
+        for time, guests, day in (('14:10', 2, None), ('11:30', 2, None), ('20:30', 2, None),
+                                  ('14:00', 0, None), ('14:00', 2, yesterday)):
+            with self.subTest(time=time, guests=guests, day=day):
+                response = self.book(time, guests, day)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+        self.assertFalse(Reservation.objects.exists())
+
+        for params in ({'date': 'завтра', 'guests': 2}, {'date': str(self.day), 'guests': 'x'},
+                       {'date': str(yesterday), 'guests': 2}, {'guests': 2}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/reservations/availability/', params).status_code, 400)
+
+
+@override_settings(**dict(HALL, RESERVATION_TABLES=[4]))
+class SlotConcurrencyTests(TransactionTestCase):
+    def test_last_table_is_booked_once(self):
+        cache.clear()
+        day = str(timezone.localdate() + datetime.timedelta(days=1))
+
+        def book(_):
+            return Client().post('/api/reservations/', {
+                'name': "Олег", 'phone': "1", 'date': day, 'time': '18:00', 'guests': 2,
+            }, content_type='application/json').status_code
+
+        with ThreadPoolExecutor(max_workers=12) as pool:
+            statuses = list(pool.map(book, range(24)))
+        self.assertEqual(sorted(set(statuses)), [201, 409])
+        self.assertEqual(statuses.count(201), 1)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+
+def upload(name, width=800, height=400, color='red'):
+    """A JPEG saved straight to storage, returns its name."""
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, 'JPEG')
+    return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+class MediaRootMixin:
+    def use_temporary_media(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, IMAGE_DERIVATIVE_WIDTHS=[320, 640])
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class ImageDerivativeTests(MediaRootMixin, TransactionTestCase):
+    # generate() closes its connection when done, as it does on a pool thread
+
+    def setUp(self):
+        self.use_temporary_media()
+        self.category = Category.objects.create(name="Горячее")
+
+    def with_image(self, instance, field, image):
+        # update(): no signal, so nothing renders in the background meanwhile
+        type(instance).objects.filter(pk=instance.pk).update(**{field: image})
+        instance.refresh_from_db()
+        return instance
+
+    def product(self, image):
+        product = Product.objects.create(category=self.category, title="Ребра", price=900)
+        return self.with_image(product, 'image', image)
+
+    def derivatives(self, instance):
+        return type(instance).objects.get(pk=instance.pk).image_derivatives
+
+    def test_paths_are_content_addressed(self):
+        first = self.product(upload('products/ribs.jpg'))
+        with default_storage.open(first.image.name) as f:
+            data = f.read()
+        second = self.product(default_storage.save('products/ribs-copy.jpg', ContentFile(data)))
+
+        self.assertTrue(images.generate(Product, first.pk))
+        self.assertTrue(images.generate(Product, second.pk))
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        entry = self.derivatives(first)['image']
+        self.assertEqual(entry['digest'], digest)
+        self.assertEqual(entry['webp'], {
+            width: f"derivatives/{digest[:2]}/{digest}/{width}.webp" for width in ('320', '640')
+        })
+        self.assertTrue(all(default_storage.exists(name) for name in entry['jpeg'].values()))
+        # Same photo, same files
+        self.assertEqual(self.derivatives(second)['image']['jpeg'], entry['jpeg'])
+        self.assertEqual(self.derivatives(second)['image']['source'], second.image.name)
+
+        # Up to date: nothing to do, unless forced
+        self.assertFalse(images.generate(Product, first.pk))
+        self.assertTrue(images.generate(Product, first.pk, force=True))
+
+        # Never upscaled
+        small = self.product(upload('products/small.jpg', width=200, height=100))
+        images.generate(Product, small.pk)
+        self.assertEqual(list(self.derivatives(small)['image']['webp']), ['200'])
+
+    def test_srcset_in_serializers(self):
+        product = self.product(upload('products/ribs.jpg'))
+        self.assertIsNone(ProductSerializer(product).data['image_srcset'])
+
+        images.generate(Product, product.pk)
+        product.refresh_from_db()
+        entry = product.image_derivatives['image']
+        self.assertEqual(ProductSerializer(product).data['image_srcset'], {
+            key: {width: f"/media/{name}" for width, name in entry[key].items()} for key in ('webp', 'jpeg')
+        })
+
+        menu = self.with_image(BanquetMenu.objects.create(title="Стандарт"), 'cover_image',
+                               upload('banquet_covers/hall.jpg'))
+        images.generate(BanquetMenu, menu.pk)
+        menu.refresh_from_db()
+        data = BanquetMenuSerializer(menu).data
+        self.assertEqual(set(data['cover_image_srcset']), {'webp', 'jpeg'})
+        self.assertEqual(set(data['cover_image_srcset']['webp']), {'320', '640'})
+        self.assertIsNone(data['content_image_srcset'])
+        self.assertNotIn('image_derivatives', data)
+
+    def test_srcset_ignores_derivatives_of_an_older_upload(self):
+        product = self.product(upload('products/ribs.jpg'))
+        images.generate(Product, product.pk)
+        product.refresh_from_db()
+        self.assertEqual(images.stale_fields(product), [])
+
+        product.image = upload('products/ribs-new.jpg', color='blue')
+        self.assertIsNone(images.srcset(product, 'image'))
+        self.assertEqual(images.stale_fields(product), ['image'])
+
+
+class ImageDerivativeCommandTests(MediaRootMixin, TransactionTestCase):
+    # The command renders on its own threads, so the rows have to be committed
+
+    def setUp(self):
+        self.use_temporary_media()
+        menu_snapshot._local_snapshot = None
+        category = Category.objects.create(name="Горячее")
+        self.products = [Product.objects.create(category=category, title=f"Блюдо {i}", price=100) for i in range(3)]
+        for product, color in zip(self.products[:2], ('red', 'green')):
+            # update(): no signal, so nothing renders in the background meanwhile
+            Product.objects.filter(pk=product.pk).update(image=upload(f'products/{color}.jpg', color=color))
+
+    def run_command(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command('build_image_derivatives', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_backfill_skip_and_force(self):
+        version = menu_snapshot.get_snapshot().version
+        out, err = self.run_command()
+        self.assertIn("Done: 2, skipped: 0, failed: 0", out)
+        self.assertEqual(err, '')
+        self.assertTrue(all(Product.objects.get(pk=p.pk).image_derivatives for p in self.products[:2]))
+
+        # One menu rebuild for the whole backfill, and the payload has the srcsets
+        snapshot = menu_snapshot.get_snapshot()
+        self.assertEqual(snapshot.version, version + 1)
+        self.assertEqual(sum(1 for p in json.loads(snapshot.payload)['products'] if p['image_srcset']), 2)
+
+        self.assertIn("All derivatives are up to date", self.run_command()[0])
+
+        # --force takes every row, the one without a photo is reported as skipped
+        out, err = self.run_command('--force')
+        self.assertIn("Done: 2, skipped: 1, failed: 0", out)
+        self.assertIn(f"Product #{self.products[2].pk}: no source image, skipped", err)
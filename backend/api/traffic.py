@@ -0,0 +1,185 @@
+"""
+Write-behind page view counters for TrafficMonitorMiddleware.
+
+Counting used to cost several queries and two saves before every request,
+serialized behind SQLite's write lock and losing increments to
+read-modify-write races. Now each worker only counts in memory; a background
+thread flushes the counts every TRAFFIC_FLUSH_INTERVAL seconds (or sooner,
+once TRAFFIC_FLUSH_THRESHOLD visits are buffered) using F() increments and
+bulk inserts. Whatever is still buffered is flushed on interpreter exit.
+
+Page views are also counted per hour and path group into TrafficRollup rows,
+which api/rollups.py later compacts into days and months.
+
+Unique visitors are a HyperLogLog sketch per day (api/hll.py). A flush
+merges the worker's sketch into the stored one with a compare-and-swap on
+the blob, so concurrent flushes from other workers are never overwritten.
+"""
+import atexit
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+
+from .hll import VisitorSketch
+from .models import DailyStats, TrafficRollup
+
+# Give up after this many lost compare-and-swap races, the next flush retries
+CAS_ATTEMPTS = 5
+
+DEFAULT_PATH_GROUPS = [
+    ('/api/menu/', 'menu'),
+    ('/api/lunch/', 'lunch'),
+    ('/api/orders/', 'orders'),
+    ('/api/reservations/', 'reservations'),
+    ('/api/', 'api'),
+]
+
+
+def path_group(path):
+    """Rollup bucket for a request path: first matching prefix from TRAFFIC_PATH_GROUPS."""
+    if path in ('', '/'):
+        return 'home'
+    for prefix, group in getattr(settings, 'TRAFFIC_PATH_GROUPS', DEFAULT_PATH_GROUPS):
+        if path.startswith(prefix):
+            return group
+    return 'other'
+
+
+class TrafficBuffer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = Counter()             # date -> page views
+        self.visitors = defaultdict(set)   # date -> IPs not yet written
+        self.hits = Counter()              # (hour, path group) -> page views
+        self.buffered = 0
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    @property
+    def interval(self):
+        return getattr(settings, 'TRAFFIC_FLUSH_INTERVAL', 10)
+
+    @property
+    def threshold(self):
+        return getattr(settings, 'TRAFFIC_FLUSH_THRESHOLD', 500)
+
+    def record(self, when, ip, path=''):
+        day = when.date()
+        hour = when.replace(minute=0, second=0, microsecond=0)
+        with self.lock:
+            self.views[day] += 1
+            if ip:
+                self.visitors[day].add(ip)
+            self.hits[hour, path_group(path)] += 1
+            self.buffered += 1
+            buffered = self.buffered
+
+        if self.threshold <= 1:
+            # Unbuffered mode (e.g. tests): write right away
+            self.flush()
+            return
+
+        if not self.interval:
+            # No flush thread: flushed explicitly (tests, management commands) and at exit
+            return
+        self.start()
+        if buffered >= self.threshold:
+            self.wakeup.set()
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self.run, name='traffic-flush', daemon=True)
+                    self.thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Traffic flush error: {e}")
+            finally:
+                close_old_connections()
+
+    def take(self):
+        with self.lock:
+            views, visitors, hits = self.views, self.visitors, self.hits
+            self.views, self.visitors, self.hits = Counter(), defaultdict(set), Counter()
+            self.buffered = 0
+        return views, visitors, hits
+
+    def restore(self, views, visitors, hits):
+        # Flush failed: put the counts back so the next flush retries them
+        with self.lock:
+            self.views.update(views)
+            for day, ips in visitors.items():
+                self.visitors[day] |= ips
+            self.hits.update(hits)
+
+    def flush(self):
+        views, visitors, hits = self.take()
+        if not views and not hits:
+            return
+        try:
+            for day in sorted(views):
+                self.write_day(day, views[day], visitors.get(day, set()))
+                # Written: don't count this day again if a later one fails
+                del views[day]
+                visitors.pop(day, None)
+            self.write_hours(hits)
+        except Exception:
+            self.restore(views, visitors, hits)
+            raise
+
+    def write_hours(self, hits):
+        with transaction.atomic():
+            TrafficRollup.objects.bulk_create(
+                [TrafficRollup(resolution=TrafficRollup.HOUR, period_start=hour, path_group=group)
+                 for hour, group in hits],
+                ignore_conflicts=True,
+            )
+            for (hour, group), views in hits.items():
+                TrafficRollup.objects.filter(
+                    resolution=TrafficRollup.HOUR, period_start=hour, path_group=group,
+                ).update(views=F('views') + views)
+        hits.clear()
+
+    def write_day(self, day, views, ips):
+        added = VisitorSketch()
+        for ip in ips:
+            added.add(ip)
+
+        DailyStats.objects.bulk_create([DailyStats(date=day)], ignore_conflicts=True)
+        for _ in range(CAS_ATTEMPTS):
+            stored = DailyStats.objects.filter(date=day).values_list('visitor_sketch', flat=True).get()
+            sketch = VisitorSketch.from_bytes(stored)
+            sketch.update(added)
+            matched = DailyStats.objects.filter(
+                date=day,
+                visitor_sketch=bytes(stored) if stored is not None else None,
+            ).update(
+                visitor_sketch=sketch.to_bytes(),
+                unique_visitors=len(sketch),
+                total_views=F('total_views') + views,
+            )
+            if matched:
+                return
+        raise RuntimeError(f"Traffic stats for {day} kept changing under the flush")
+
+
+def unique_visitors_between(start, end):
+    """Unique visitors over a date range (inclusive), from the union of the daily sketches."""
+    sketches = DailyStats.objects.filter(date__range=(start, end)).values_list('visitor_sketch', flat=True)
+    return len(VisitorSketch.union(VisitorSketch.from_bytes(data) for data in sketches))
+
+
+buffer = TrafficBuffer()
+
+# gunicorn workers exit through sys.exit, so atexit handlers run on shutdown
+atexit.register(lambda: buffer.flush())
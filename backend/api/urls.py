@@ -4,17 +4,26 @@ from . import views
 urlpatterns = [
     path('status/', views.get_status, name='status'),
     path('menu/', views.get_menu, name='menu'),
+    path('menu/search/', views.search_menu, name='menu_search'),
     path('lunch/', views.get_business_lunch, name='lunch'),
+    path('cart/quote/', views.cart_quote, name='cart_quote'),
     path('orders/', views.create_order, name='create_order'),
+    path('orders/<int:order_id>/payment/', views.order_payment, name='order_payment'),
     path('paykeeper/callback/', views.paykeeper_callback, name='paykeeper_callback'),
     path('reservations/', views.create_reservation, name='create_reservation'),
+    path('reservations/availability/', views.get_reservation_availability, name='reservation_availability'),
     path('auth/user/', views.get_current_user, name='auth_user'),
     path('auth/register/', views.register_view, name='auth_register'),
     path('auth/login/', views.login_view, name='auth_login'),
     path('auth/logout/', views.logout_view, name='auth_logout'),
     path('profile/data/', views.get_user_profile_data, name='profile_data'),
+    path('profile/orders/', views.get_user_orders, name='profile_orders'),
+    path('profile/orders/<int:order_id>/', views.get_user_order, name='profile_order'),
     path('profile/address/add/', views.add_address, name='add_address'),
     path('profile/address/<int:address_id>/delete/', views.delete_address, name='delete_address'),
     path('banquet-menus/', views.get_banquet_menus, name='banquet_menus'),
     path('admin/check-new/', views.check_new_orders, name='check_new_orders'),
+    path('admin/poll/', views.poll_changes, name='poll_changes'),
+    path('admin/metrics/', views.get_metrics, name='metrics'),
+    path('admin/sales/', views.get_sales_report, name='sales_report'),
 ]
@@ -1,11 +1,24 @@
-from django.http import HttpResponse
+import asyncio
+import json
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils.http import parse_etags
 from django.shortcuts import render
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .models import Category, Product, BusinessLunch, Order, Reservation, UserAddress, BanquetMenu
-from .serializers import CategorySerializer, ProductSerializer, BusinessLunchSerializer, OrderSerializer, ReservationSerializer, UserSerializer, RegisterSerializer, UserAddressSerializer, BanquetMenuSerializer
+from .models import Category, Product, BusinessLunch, Order, ArchivedOrder, PaymentEvent, Reservation, UserAddress, BanquetMenu
+from .serializers import CategorySerializer, ProductSerializer, BusinessLunchSerializer, OrderSerializer, OrderSummarySerializer, ReservationSerializer, UserSerializer, RegisterSerializer, UserAddressSerializer, BanquetMenuSerializer
 from django.contrib.auth import authenticate, login, logout
 from django.views.decorators.csrf import csrf_exempt
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from . import archive, changefeed, idempotency, lunch, menu_snapshot, metrics, order_lines, pagination, pricing, sales, slots
 
 @api_view(['GET'])
 def get_current_user(request):
@@ -47,142 +60,283 @@ def get_status(request):
 
 @api_view(['GET'])
 def get_menu(request):
-    categories = Category.objects.all()
-    products = Product.objects.all()
-    
+    # Menu is pre-rendered on change (see menu_snapshot.py), here we only
+    # check the version and answer 304 if the client already has it.
+    # The full payload carries "version" for later ?since= requests.
+    snapshot = menu_snapshot.get_snapshot()
+
+    # Delta sync: ?since=<version> returns only rows changed after that version.
+    # Unknown or future versions (e.g. after a DB reset) get the full menu.
+    since = request.GET.get('since')
+    if since is not None and since.isdigit() and 0 < int(since) <= snapshot.version:
+        response = Response(menu_snapshot.get_changes(int(since), snapshot.version))
+        response['X-Menu-Version'] = str(snapshot.version)
+        return response
+
+    if snapshot.etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(snapshot.payload, content_type='application/json')
+    response['ETag'] = snapshot.etag
+    response['X-Menu-Version'] = str(snapshot.version)
+    # Browsers may keep the menu but must revalidate it on every visit
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+@api_view(['GET'])
+def search_menu(request):
+    from . import search
+
+    query = request.GET.get('q', '').strip()[:100]
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+    except ValueError:
+        limit = 20
+
+    search.index.ensure_current()
     return Response({
-        "categories": CategorySerializer(categories, many=True).data,
-        "products": ProductSerializer(products, many=True).data
+        "query": query,
+        "results": search.index.search(query, limit),
     })
 
 @api_view(['GET'])
 def get_business_lunch(request):
-    import datetime
-    today = datetime.date.today()
-    
-    # Logic: 
-    # 1. Try to get exactly today's lunch
-    # 2. If not found, get the LATEST created lunch (order by date desc) appropriately
-    
-    lunch = BusinessLunch.objects.filter(date=today).first()
-    
-    if not lunch:
-        # Fallback to the most recent lunch available in the database
-        lunch = BusinessLunch.objects.order_by('-date').first()
-    
-    if lunch:
-        data = BusinessLunchSerializer(lunch).data
+    # Resolved once per local day and cached until midnight (see lunch.py)
+    data = lunch.get_lunch()
+
+    if data:
+        data = dict(data)
         # Add debug info for the user
-        data['debug_server_date'] = str(today)
+        data['debug_server_date'] = str(timezone.localdate())
         return Response(data)
-        
+
     return Response(None)
 
-from .paykeeper import get_payment_url
+from . import paykeeper
+
+# payment_token from create_order, checked by order_payment
+PAYMENT_TOKEN_SALT = 'order-payment'
+PAYMENT_TOKEN_MAX_AGE = 60 * 60 * 24
+
+def is_pickup(request):
+    # CartModal sends address "Самовывоз" for pickup orders
+    return request.data.get('delivery') == 'pickup' or request.data.get('address') == 'Самовывоз'
 
 @csrf_exempt
 @api_view(['POST'])
+def cart_quote(request):
+    # Same pricing as create_order, without creating anything
+    try:
+        priced = pricing.quote(request.data.get('items'), delivery=not is_pickup(request))
+    except pricing.PricingError as e:
+        return Response({"error": str(e)}, status=400)
+    return Response(priced)
+
+@csrf_exempt
+@api_view(['POST'])
+@idempotency.idempotent('orders')
 def create_order(request):
     serializer = OrderSerializer(data=request.data)
     if serializer.is_valid():
-        order = serializer.save()
-        if request.user.is_authenticated:
-            order.user = request.user
-            order.save()
-            
+        # Prices and total come from the menu, not from the browser
+        try:
+            priced = pricing.quote(serializer.validated_data['items'], delivery=not is_pickup(request))
+        except pricing.PricingError as e:
+            return Response({"error": str(e)}, status=400)
+
+        with transaction.atomic():
+            order = serializer.save(
+                user=request.user if request.user.is_authenticated else None,
+                items=pricing.items_json(priced),
+                total_price=priced['total'],
+            )
+            order_lines.create_for(order)
+
         response_data = {"status": "success", "order_id": order.id}
-        
-        # Handle PayKeeper payment
+
+        # The PayKeeper invoice is requested by the client from order_payment,
+        # so this worker isn't held for the round trip
         if order.payment_method == 'online':
-            try:
-                payment_url = get_payment_url(
-                    order_id=order.id,
-                    amount=order.total_price,
-                    client_name=order.name,
-                    client_phone=order.phone
-                )
-                response_data["payment_url"] = payment_url
-            except Exception as e:
-                # Log error but don't fail the order creation
-                print(f"Error generating PayKeeper URL: {e}")
-                
+            response_data["payment_token"] = signing.dumps(order.id, salt=PAYMENT_TOKEN_SALT)
+
         return Response(response_data, status=201)
     return Response(serializer.errors, status=400)
 
+async def order_payment(request, order_id):
+    """
+    PayKeeper payment link for an online order. Needs the payment_token that
+    create_order returned; the invoice is created on the first call and
+    reused afterwards (see paykeeper.py).
+    """
+    try:
+        signed_id = signing.loads(request.GET.get('token', ''), salt=PAYMENT_TOKEN_SALT,
+                                  max_age=PAYMENT_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        signed_id = None
+    if signed_id != order_id:
+        return JsonResponse({"error": "Доступ запрещен"}, status=403)
+
+    order = await Order.objects.filter(pk=order_id).afirst()
+    if order is None:
+        return JsonResponse({"error": "Заказ не найден"}, status=404)
+    if order.is_paid:
+        return JsonResponse({"error": "Заказ уже оплачен"}, status=409)
+
+    try:
+        if isinstance(request, ASGIRequest):
+            payment_url = await paykeeper.aget_payment_url(order)
+        else:
+            # A new event loop per WSGI request: the pooled sync client outlives it
+            payment_url = await sync_to_async(paykeeper.get_payment_url)(order)
+    except paykeeper.PayKeeperError as e:
+        print(f"Error creating PayKeeper invoice: {e}")
+        return JsonResponse({"error": "Не удалось создать счет на оплату, попробуйте позже"}, status=502)
+    return JsonResponse({"payment_url": payment_url})
+
 @csrf_exempt
 @api_view(['POST'])
 def paykeeper_callback(request):
     """
     Handle PayKeeper notification.
     ContentType: application/x-www-form-urlencoded
+
+    PayKeeper repeats a notification until it gets "OK <hash>", often several
+    copies at once. The order is marked paid by a single conditional UPDATE,
+    so exactly one copy changes it; every notification is logged as a
+    PaymentEvent.
     """
-    from .paykeeper import verify_signature
-    import hashlib
-    
     # Data comes as form data
-    payment_id = request.data.get('id')
-    order_id = request.data.get('orderid')
-    key = request.data.get('key')
-    # service_name = request.data.get('service_name')
-    # clientid = request.data.get('clientid')
-    # sum = request.data.get('sum')
-
-    if not payment_id or not key or not order_id:
+    data = {name: request.data.get(name) for name in request.data}
+    payment_id = data.get('id') or ''
+    order_id = str(data.get('orderid') or '')
+    key = data.get('key')
+
+    try:
+        amount = Decimal(str(data.get('sum'))).quantize(Decimal('0.01'))
+        if not amount.is_finite() or abs(amount) >= 10 ** 8:
+            amount = None
+    except ArithmeticError:
+        amount = None  # missing or garbage, it's still in the payload
+
+    def log(outcome, order_id=None):
+        PaymentEvent.objects.create(
+            order_id=order_id, payment_id=payment_id[:100], amount=amount,
+            outcome=outcome, payload=json.dumps(data, ensure_ascii=False),
+        )
+
+    if not payment_id or not key or not order_id.isdigit():
+        log('invalid')
         return Response("Error: Missing data", status=400)
 
-    # Verify signature
-    if verify_signature(payment_id, key):
-        try:
-            order = Order.objects.get(id=order_id)
-            
-            # Check if already paid to avoid duplicates logic if needed
-            if not order.is_paid:
-                order.is_paid = True
-                order.payment_id = payment_id
-                order.payment_method = 'online'
-                order.save()
-                
-            # Return OK message required by PayKeeper
-            # Usually strict: OK <md5(id+secret)>
-            response_hash = hashlib.md5((payment_id + settings.PAYKEEPER_SECRET_KEY).encode('utf-8')).hexdigest()
-            content = f"OK {response_hash}"
-            return Response(content, status=200)
-            
-        except Order.DoesNotExist:
+    if not paykeeper.verify_signature(payment_id, key):
+        log('bad_signature')
+        return Response("Error: Hash mismatch", status=403)
+
+    with transaction.atomic():
+        if paykeeper.mark_paid(order_id, payment_id):
+            log('paid', order_id)
+        elif Order.objects.filter(pk=order_id).exists():
+            log('duplicate', order_id)
+        else:
+            log('unknown_order')
             return Response("Error: Order not found", status=404)
-        except Exception as e:
-            print(f"Payment processing error: {e}")
-            return Response(f"Error: {e}", status=500)
-    
-    return Response("Error: Hash mismatch", status=403)
+
+    # PayKeeper expects exactly "OK <md5(id + secret)>" as plain text
+    return HttpResponse(f"OK {paykeeper.notification_hash(payment_id)}", content_type='text/plain')
 
 @csrf_exempt
 @api_view(['POST'])
+@idempotency.idempotent('reservations')
 def create_reservation(request):
     serializer = ReservationSerializer(data=request.data)
     if serializer.is_valid():
         # Optional: Link reservation to user if needed
-        serializer.save()
+        try:
+            slots.book(serializer)
+        except slots.SlotUnavailable as e:
+            return Response({"error": str(e)}, status=409)
+        except slots.SlotError as e:
+            return Response({"error": str(e)}, status=400)
         return Response({"status": "success", "reservation_id": serializer.data['id']}, status=201)
     return Response(serializer.errors, status=400)
 
+@api_view(['GET'])
+def get_reservation_availability(request):
+    """Bookable times for ?date=YYYY-MM-DD&guests=N (ReservationModal)."""
+    try:
+        day = parse_date(request.query_params.get('date', ''))
+        guests = int(request.query_params.get('guests', 2))
+        if day is None:
+            raise ValueError
+        times = slots.availability(day, guests)
+    except slots.SlotError as e:
+        return Response({"error": str(e)}, status=400)
+    except ValueError:
+        return Response({"error": "Укажите дату и количество гостей"}, status=400)
+
+    return Response({
+        "date": day,
+        "guests": guests,
+        "times": [t.strftime('%H:%M') for t in times],
+        # Bigger than any table: any time, a manager calls back
+        "by_phone": guests > slots.Hall().largest,
+    })
+
 # Profile & Address APIs
 
+PROFILE_PAGE_SIZE = 20
+
+def user_orders(user):
+    # Live and archived orders, paged as one list (api/archive.py)
+    return [
+        model.objects.filter(user=user).only(*OrderSummarySerializer.Meta.fields)
+        for model in (Order, ArchivedOrder)
+    ]
+
 @api_view(['GET'])
 def get_user_profile_data(request):
     if not request.user.is_authenticated:
         return Response({"error": "Unauthorized"}, status=401)
     
     user = request.user
-    orders = Order.objects.filter(user=user).order_by('-created_at')
+    # First page of order summaries only, the rest via get_user_orders
+    orders, next_cursor = pagination.page(user_orders(user), limit=PROFILE_PAGE_SIZE)
     addresses = UserAddress.objects.filter(user=user)
-    
+
     return Response({
         "user": UserSerializer(user).data,
-        "orders": OrderSerializer(orders, many=True).data,
+        "orders": OrderSummarySerializer(orders, many=True).data,
+        "orders_next": next_cursor,
         "addresses": UserAddressSerializer(addresses, many=True).data
     })
 
+@api_view(['GET'])
+def get_user_orders(request):
+    """Order summaries, newest first: ?cursor= from the previous page's "next", ?limit= up to 50."""
+    if not request.user.is_authenticated:
+        return Response({"error": "Unauthorized"}, status=401)
+
+    try:
+        limit = min(max(int(request.query_params.get('limit', PROFILE_PAGE_SIZE)), 1), 50)
+        orders, next_cursor = pagination.page(user_orders(request.user), request.query_params.get('cursor'), limit)
+    except ValueError:
+        return Response({"error": "Некорректные параметры страницы"}, status=400)
+
+    return Response({
+        "results": OrderSummarySerializer(orders, many=True).data,
+        "next": next_cursor,
+    })
+
+@api_view(['GET'])
+def get_user_order(request, order_id):
+    if not request.user.is_authenticated:
+        return Response({"error": "Unauthorized"}, status=401)
+
+    order = archive.get_order(user=request.user, pk=order_id)
+    if order is None:
+        return Response({"error": "Заказ не найден"}, status=404)
+    return Response(OrderSerializer(order).data)
+
 @csrf_exempt
 @api_view(['POST'])
 def add_address(request):
@@ -223,47 +377,76 @@ def get_banquet_menus(request):
 
 @api_view(['GET'])
 def check_new_orders(request):
-    # This endpoint is polled by the admin panel to play sound
-    # We can check for orders created in the last minute, or just return total count of 'new' orders
-    # returning total 'new' is better for "badged" notifications, but for sound we might want "recent".
-    # Let's return both for flexibility.
-    
-    from datetime import timedelta
-    from django.utils import timezone
-    
-    threshold = timezone.now() - timedelta(seconds=30)
-    
-    # Recent new orders (for sound)
-    recent_orders = Order.objects.filter(created_at__gt=threshold).count()
-    recent_reservations = Reservation.objects.filter(created_at__gt=threshold).count()
-    
-    # Total pending (for badges)
-    pending_orders = Order.objects.filter(status='new').count()
-    
-    return Response({
-        "recent_orders": recent_orders,
-        "recent_reservations": recent_reservations,
-        "pending_orders": pending_orders,
-        "play_sound": (recent_orders > 0 or recent_reservations > 0)
-    })
+    # Polled by the admin panel every 30 seconds while neither the live socket
+    # (ws/admin/orders/, see consumers.py) nor the long-poll is available.
+    # ?since= is the token of the previous answer, see changefeed.changes()
+    since = changefeed.parse_token(request.query_params.get('since'))
+    counters = changefeed.current() if settings.CHANGEFEED_SHARED else changefeed.latest()
+    return Response(changefeed.changes(since, counters))
 
 
-def home_view(request):
-    """Main page view"""
-    from django.shortcuts import render
-    from .models import Category, Product
-    from .serializers import CategorySerializer, ProductSerializer
+async def poll_changes(request):
+    """
+    Long-poll for admin pages that can't keep a WebSocket open. The client
+    passes the token from its previous response as ?since=; the request is
+    held until the change counters move or ADMIN_POLL_TIMEOUT passes. The
+    wait only reads the cache (see changefeed.py). Under WSGI a held request
+    would occupy a worker thread, and without CHANGEFEED_SHARED the counters
+    miss other processes' changes, so then it answers {"long_poll": false}
+    right away and the page falls back to check-new.
+    """
+    user = await request.auser()
+    if not user.is_staff:
+        return JsonResponse({"error": "Доступ запрещен"}, status=403)
+    if not (settings.CHANGEFEED_SHARED and isinstance(request, ASGIRequest)):
+        return JsonResponse({"long_poll": False})
+
+    since = changefeed.parse_token(request.GET.get('since'))
+    counters = await changefeed.acurrent()
+    if since is not None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.ADMIN_POLL_TIMEOUT
+        while counters == since and loop.time() < deadline:
+            await asyncio.sleep(settings.ADMIN_POLL_INTERVAL)
+            counters = await changefeed.acurrent()
+
+    return JsonResponse(changefeed.changes(since, counters))
 
-    # Get menu data for the template
-    categories = Category.objects.all()
-    products = Product.objects.all()
 
-    # Convert to format expected by template
-    category_choices = [(cat.code, cat.name) for cat in categories]
-    menu_items = products
+def home_view(request):
+    """Main page view, the menu section comes from cached fragments (see ssr.py)"""
+    from . import ssr
 
+    menu_version, fragments = ssr.menu_fragments()
     context = {
-        'categories': category_choices,
-        'menu_items': menu_items
+        'menu_version': menu_version,
+        'menu_categories_html': fragments['categories'],
+        'menu_products_html': fragments['products'],
     }
     return render(request, 'index.html', context)
+
+@api_view(['GET'])
+def get_metrics(request):
+    # Request timing histograms of all workers, in Prometheus text format
+    if not request.user.is_staff:
+        return Response({"detail": "Staff only"}, status=403)
+    return HttpResponse(metrics.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@api_view(['GET'])
+def get_sales_report(request):
+    # ?start=YYYY-MM-DD&end=YYYY-MM-DD, the current month by default
+    if not request.user.is_staff:
+        return Response({"detail": "Staff only"}, status=403)
+
+    from datetime import date
+    today = timezone.localdate()
+    try:
+        start = date.fromisoformat(request.query_params.get('start') or today.replace(day=1).isoformat())
+        end = date.fromisoformat(request.query_params.get('end') or today.isoformat())
+        limit = min(max(int(request.query_params.get('limit', 10)), 1), 100)
+    except ValueError:
+        return Response({"error": "Dates must be YYYY-MM-DD, limit a number"}, status=400)
+    if start > end:
+        return Response({"error": "start is after end"}, status=400)
+
+    return Response(sales.report(start, end, limit=limit))
@@ -2,6 +2,9 @@
 ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to the regular Django app, WebSockets to the Channels consumers in
+api/routing.py (live admin notifications). This is what production runs
+(daphne, see Procfile), wsgi.py is kept for tools that need WSGI.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +16,22 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.config.settings')
 
-application = get_asgi_application()
+# Loads the apps, must run before anything imports models
+django_application = get_asgi_application()
+
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.security.websocket import AllowedHostsOriginValidator  # noqa: E402
+
+from api.routing import websocket_urlpatterns  # noqa: E402
+
+application = ProtocolTypeRouter({
+    'http': django_application,
+    'websocket': AllowedHostsOriginValidator(
+        AuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+    ),
+})
+
+# Build the in-memory dish search index before the first search comes in
+from api.search import warm_up  # noqa: E402
+warm_up()
@@ -11,8 +11,11 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent  # This points to the backend directory
 PROJECT_ROOT = BASE_DIR.parent  # This points to the project root directory
@@ -51,6 +54,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Serve static files in production
+    'api.middleware.RequestTimingMiddleware',  # After WhiteNoise: static files are not timed
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -66,7 +70,7 @@ ROOT_URLCONF = 'config.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [PROJECT_ROOT / 'templates'],  # templates directory is in project root
+        'DIRS': [PROJECT_ROOT / 'templates', BASE_DIR / 'templates'],  # site templates in project root, admin overrides in backend
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -79,6 +83,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
 
 
 # Database
@@ -88,9 +93,141 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',  # Use BASE_DIR instead of PROJECT_ROOT for database
+        'OPTIONS': {
+            # Writers take the lock up front and wait for each other instead of
+            # failing with "database is locked" (concurrent PayKeeper callbacks)
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file rather than shared memory, so tests can write from several threads
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'api-test.sqlite3')},
     }
 }
 
+# Archived orders (api/archive.py) go to a separate SQLite file when this is
+# set, otherwise to a table in the main database
+ARCHIVE_DB_PATH = os.environ.get('ARCHIVE_DB_PATH', '')
+if ARCHIVE_DB_PATH:
+    DATABASES['archive'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ARCHIVE_DB_PATH,
+        'OPTIONS': DATABASES['default']['OPTIONS'],
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'api-test-archive.sqlite3')},
+    }
+DATABASE_ROUTERS = ['api.routers.ArchiveRouter']
+
+
+# Cache
+# Per-process memory by default; set REDIS_URL to share the cache between
+# workers. Without it entries dropped on a change (lunch, slots) only go
+# away in the process that made the change
+
+REDIS_URL = os.environ.get('REDIS_URL', '')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Channel layer for live admin notifications (api/events.py). The socket
+# needs the ASGI server (daphne, see Procfile). The in-process layer only
+# reaches sockets served by the same process, so with more than one server
+# process set REDIS_URL. The admin page falls back to polling whenever the
+# socket can't connect.
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [REDIS_URL]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        }
+    }
+
+# Whether the cached change counters (api/changefeed.py) see every change:
+# with REDIS_URL, or with the per-process cache when there is one server
+# process (daphne in Procfile runs one, set WEB_CONCURRENCY when running
+# more). Otherwise the admin polls never wait and read the tables instead.
+CHANGEFEED_SHARED = bool(REDIS_URL) or int(os.environ.get('WEB_CONCURRENCY', '1')) <= 1
+
+# Admin long-poll (api/views.poll_changes): how long a request is held and
+# how often the change counters are re-read meanwhile, in seconds. Held only
+# over ASGI and with CHANGEFEED_SHARED; otherwise the admin page polls check-new.
+ADMIN_POLL_TIMEOUT = 25
+ADMIN_POLL_INTERVAL = 1
+
+# Idempotency-Key on order/reservation creation (api/idempotency.py): how
+# long a response is replayed, how long a duplicate waits for the first
+# request to finish, and when an unfinished claim counts as abandoned
+IDEMPOTENCY_TTL = 60 * 60 * 24
+IDEMPOTENCY_WAIT_SECONDS = 10
+IDEMPOTENCY_LOCK_SECONDS = 60
+
+# Delivery pricing used by api/pricing.py (and shown in the cart)
+DELIVERY_FEE = 150
+FREE_DELIVERY_FROM = 1000
+
+# Reservation capacity (api/slots.py): seats of each table in the hall, in
+# table number order, how long a party keeps its table, and the bookable
+# times, every RESERVATION_SLOT_MINUTES from open to the last seating
+RESERVATION_TABLES = [2, 2, 2, 2, 4, 4, 4, 4, 6, 8]
+RESERVATION_TURN_MINUTES = 120
+RESERVATION_SLOT_MINUTES = 30
+RESERVATION_OPEN = '10:00'
+RESERVATION_LAST_SEATING = '21:00'
+# How long a day's availability index stays cached; signals retire it on changes
+RESERVATION_INDEX_SECONDS = 60 * 10
+
+# Admin dashboard figures are cached this long (api/templatetags/dashboard_stats.py)
+DASHBOARD_CACHE_SECONDS = 5
+
+# Rendered home page menu fragments, keyed on menu version (see api/ssr.py)
+SSR_FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+# How often a worker checks whether another worker changed the menu (api/search.py)
+SEARCH_SYNC_INTERVAL = 1.0
+
+# Traffic counters are buffered per worker and flushed every N seconds or
+# after N visits, whichever comes first (api/traffic.py). Threshold 1 = write
+# per request, interval 0 = no flush thread (only explicit flushes and at exit).
+TRAFFIC_FLUSH_INTERVAL = 10
+TRAFFIC_FLUSH_THRESHOLD = 500
+
+# Days with up to this many visitors are counted exactly, busier days switch
+# to a ~1.6% error HyperLogLog estimate (api/hll.py)
+TRAFFIC_EXACT_VISITORS = 512
+
+# Retention for `manage.py compact_traffic` (api/rollups.py): hourly rows are
+# folded into days, days into months (kept forever). Visitor sketches of
+# older days are dropped, their daily unique counts stay.
+TRAFFIC_HOURLY_RETENTION_DAYS = 2
+TRAFFIC_DAILY_RETENTION_DAYS = 35
+TRAFFIC_SKETCH_RETENTION_DAYS = 400
+
+# Request timing histograms (api/metrics.py): each worker writes its own file
+# here, /api/admin/metrics/ merges them
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'api-metrics'))
+METRICS_WRITE_INTERVAL = 5
+
+# `manage.py archive_orders` moves completed and cancelled orders older than
+# this out of the live Order table, this many per transaction
+ARCHIVE_ORDERS_AFTER_DAYS = 180
+ARCHIVE_BATCH_SIZE = 500
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -133,6 +270,10 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = PROJECT_ROOT / 'media'  # media directory in project root
 
+# Responsive copies of uploaded photos (see api/images.py)
+IMAGE_DERIVATIVE_WIDTHS = [320, 640, 1280]
+IMAGE_DERIVATIVE_WORKERS = int(os.environ.get('IMAGE_DERIVATIVE_WORKERS', '2'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -152,6 +293,7 @@ if RAILWAY_PUBLIC_DOMAIN:
     CORS_ALLOWED_ORIGINS.append(f"https://{RAILWAY_PUBLIC_DOMAIN}")
 
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 CORS_ALLOW_ALL_ORIGINS = DEBUG  # Allow all origins in development
 
 CSRF_TRUSTED_ORIGINS = [
@@ -172,3 +314,13 @@ if CSRF_TRUSTED_ORIGINS_ENV:
 # PayKeeper Configuration
 PAYKEEPER_SERVER_URL = os.environ.get('PAYKEEPER_SERVER_URL', 'http://example.paykeeper.ru')
 PAYKEEPER_SECRET_KEY = os.environ.get('PAYKEEPER_SECRET_KEY', 'secret_key')
+# API user for invoice creation; without it the invoice preview link is used
+PAYKEEPER_USER = os.environ.get('PAYKEEPER_USER', '')
+PAYKEEPER_PASSWORD = os.environ.get('PAYKEEPER_PASSWORD', '')
+# Seconds; failed requests are retried PAYKEEPER_RETRIES times, waiting
+# PAYKEEPER_BACKOFF * 2^attempt in between
+PAYKEEPER_TIMEOUT = 5
+PAYKEEPER_CONNECT_TIMEOUT = 2
+PAYKEEPER_RETRIES = 2
+PAYKEEPER_BACKOFF = 0.3
+PAYKEEPER_TOKEN_SECONDS = 60 * 60 * 12
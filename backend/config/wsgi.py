@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.config.settings')
 
 application = get_wsgi_application()
+
+# Build the in-memory dish search index before the first search comes in
+from api.search import warm_up  # noqa: E402
+warm_up()
@@ -30,11 +30,6 @@ const BusinessLunchPage: React.FC = () => {
         </div>
     );
 
-    const parseList = (text: string) => {
-        if (!text) return [];
-        return text.split('\n').filter(line => line.trim() !== '');
-    };
-
     return (
         <main className="py-12 px-4 min-h-screen bg-[#F5F4F2]">
             <section className="max-w-3xl mx-auto pt-20"> {/* pt-20 for fixed navbar */}
@@ -64,7 +59,7 @@ const BusinessLunchPage: React.FC = () => {
                                     <Salad className="w-5 h-5" /> Салаты
                                 </h3>
                                 <ul className="space-y-3 text-sm text-gray-600">
-                                    {parseList(lunch.salads).map((item: string, i: number) => (
+                                    {lunch.salads_list.map((item: string, i: number) => (
                                         <li key={i} className="flex items-start gap-3">
                                             <div className="w-1.5 h-1.5 rounded-full bg-brand-yellow mt-2 shrink-0"></div>
                                             <span className="leading-relaxed">{item}</span>
@@ -79,7 +74,7 @@ const BusinessLunchPage: React.FC = () => {
                                     <Soup className="w-5 h-5" /> Супы
                                 </h3>
                                 <ul className="space-y-3 text-sm text-gray-600">
-                                    {parseList(lunch.soups).map((item: string, i: number) => (
+                                    {lunch.soups_list.map((item: string, i: number) => (
                                         <li key={i} className="flex items-start gap-3">
                                             <div className="w-1.5 h-1.5 rounded-full bg-brand-yellow mt-2 shrink-0"></div>
                                             <span className="leading-relaxed">{item}</span>
@@ -97,7 +92,7 @@ const BusinessLunchPage: React.FC = () => {
                                     <UtensilsCrossed className="w-5 h-5" /> Горячее
                                 </h3>
                                 <ul className="space-y-3 text-sm text-gray-600">
-                                    {parseList(lunch.hot_dishes).map((item: string, i: number) => (
+                                    {lunch.hot_dishes_list.map((item: string, i: number) => (
                                         <li key={i} className="flex items-start gap-3">
                                             <div className="w-1.5 h-1.5 rounded-full bg-brand-yellow mt-2 shrink-0"></div>
                                             <span className="leading-relaxed">{item}</span>
@@ -112,7 +107,7 @@ const BusinessLunchPage: React.FC = () => {
                                     <Wheat className="w-5 h-5" /> Гарниры, Напитки
                                 </h3>
                                 <ul className="space-y-3 text-sm text-gray-600">
-                                    {parseList(lunch.garnishes).map((item: string, i: number) => (
+                                    {lunch.garnishes_list.map((item: string, i: number) => (
                                         <li key={i} className="flex items-start gap-3">
                                             <div className="w-1.5 h-1.5 rounded-full bg-brand-yellow mt-2 shrink-0"></div>
                                             <span className="leading-relaxed">{item}</span>
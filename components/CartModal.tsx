@@ -1,9 +1,9 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { X, Trash2, Plus, Minus, CreditCard, Banknote, Loader2, MapPin } from 'lucide-react';
 import { CartItem } from '../types';
 import Button from './Button';
 import { useAuth } from '../contexts/AuthContext';
-import { API_URL, getImageUrl } from '../config';
+import { API_URL, getImageUrl, idempotencyKeyFor, IdempotencyKey } from '../config';
 
 interface CartModalProps {
   isOpen: boolean;
@@ -26,18 +26,41 @@ const CartModal: React.FC<CartModalProps> = ({ isOpen, onClose, items, onUpdateQ
     name: '',
     phone: '',
     address: '',
-    payment: 'card',
+    payment: 'cash',
     delivery: 'delivery',
   });
 
 
   const [isSubmitting, setIsSubmitting] = useState(false);
+  // One key per order, kept across retries of the same order until it goes through
+  const idempotencyKey = useRef<IdempotencyKey>(null);
   const [isSuccess, setIsSuccess] = useState(false);
   const [error, setError] = useState('');
 
+  const [quote, setQuote] = useState<{ delivery_fee: number; total: number } | null>(null);
+
+  // Local estimate until the server quote (the price the order will actually have) arrives
   const itemsTotal = items.reduce((sum, item) => sum + item.price * item.quantity, 0);
-  const deliveryCost = (formData.delivery === 'delivery' && itemsTotal < 1000) ? 150 : 0;
-  const total = itemsTotal + deliveryCost;
+  const deliveryCost = quote ? quote.delivery_fee : (formData.delivery === 'delivery' && itemsTotal < 1000) ? 150 : 0;
+  const total = quote ? quote.total : itemsTotal + deliveryCost;
+
+  useEffect(() => {
+    if (!isOpen || items.length === 0) return;
+    let cancelled = false;
+    fetch(`${API_URL}/api/cart/quote/`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      credentials: 'include',
+      body: JSON.stringify({
+        items: items.map(item => ({ id: item.id, title: item.title, quantity: item.quantity })),
+        delivery: formData.delivery,
+      }),
+    })
+      .then(response => (response.ok ? response.json() : null))
+      .then(data => { if (!cancelled) setQuote(data); })
+      .catch(() => { if (!cancelled) setQuote(null); });
+    return () => { cancelled = true; };
+  }, [isOpen, items, formData.delivery]);
 
   // Auto-fill user data
   useEffect(() => {
@@ -89,9 +112,10 @@ const CartModal: React.FC<CartModalProps> = ({ isOpen, onClose, items, onUpdateQ
         name: formData.name,
         phone: formData.phone,
         address: formData.delivery === 'pickup' ? 'Самовывоз' : formData.address,
-        total_price: total,
         payment_method: formData.payment,
+        delivery: formData.delivery,
         items: JSON.stringify(items.map(item => ({
+          id: item.id,
           title: item.title,
           quantity: item.quantity,
           price: item.price
@@ -115,23 +139,40 @@ const CartModal: React.FC<CartModalProps> = ({ isOpen, onClose, items, onUpdateQ
       };
 
       const csrftoken = getCookie('csrftoken');
+      const body = JSON.stringify(orderData);
+      idempotencyKey.current = idempotencyKeyFor(idempotencyKey.current, body);
 
       const response = await fetch(`${API_URL}/api/orders/`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
           'X-CSRFToken': csrftoken || '',
+          'Idempotency-Key': idempotencyKey.current.key,
         },
         credentials: 'include',
-        body: JSON.stringify(orderData),
+        body,
       });
 
       const data = await response.json();
 
       if (response.ok) {
-        if (formData.payment === 'online' && data.payment_url) {
-          window.location.href = data.payment_url;
+        if (formData.payment === 'online' && data.payment_token) {
+          // The invoice is created separately. The order is already saved, so
+          // the key is kept: submitting again returns the same order and retries payment
+          const payment = await fetch(
+            `${API_URL}/api/orders/${data.order_id}/payment/?token=${encodeURIComponent(data.payment_token)}`,
+            { credentials: 'include' }
+          );
+          const paymentData = await payment.json();
+          if (payment.ok && paymentData.payment_url) {
+            idempotencyKey.current = null;
+            onClearCart();
+            window.location.href = paymentData.payment_url;
+          } else {
+            setError(paymentData.error || 'Заказ принят, но ссылку на оплату получить не удалось. Попробуйте еще раз.');
+          }
         } else {
+          idempotencyKey.current = null;
           setIsSuccess(true);
           onClearCart();
         }
@@ -16,7 +16,6 @@ interface Order {
     total_price: number;
     status: string;
     created_at: string;
-    items: string; // JSON string
     address: string;
 }
 
@@ -30,6 +29,10 @@ const ProfilePage: React.FC = () => {
     const { user, logout } = useAuth();
     const navigate = useNavigate();
     const [orders, setOrders] = useState<Order[]>([]);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [loadingMore, setLoadingMore] = useState(false);
+    // Order contents are loaded when a card is opened, keyed by order id
+    const [orderItems, setOrderItems] = useState<Record<number, OrderItem[] | null>>({});
     const [loading, setLoading] = useState(true);
 
     useEffect(() => {
@@ -47,6 +50,7 @@ const ProfilePage: React.FC = () => {
             if (response.ok) {
                 const data = await response.json();
                 setOrders(data.orders);
+                setNextCursor(data.orders_next);
             }
         } catch (error) {
             console.error('Failed to load profile', error);
@@ -55,6 +59,43 @@ const ProfilePage: React.FC = () => {
         }
     };
 
+    const loadMoreOrders = async () => {
+        if (!nextCursor) return;
+        setLoadingMore(true);
+        try {
+            const response = await fetch(`${API_URL}/api/profile/orders/?cursor=${encodeURIComponent(nextCursor)}`, { credentials: 'include' });
+            if (response.ok) {
+                const data = await response.json();
+                setOrders(prev => [...prev, ...data.results]);
+                setNextCursor(data.next);
+            }
+        } catch (error) {
+            console.error('Failed to load orders', error);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
+    const toggleOrderItems = async (orderId: number) => {
+        if (orderId in orderItems) {
+            setOrderItems(prev => {
+                const { [orderId]: _, ...rest } = prev;
+                return rest;
+            });
+            return;
+        }
+        setOrderItems(prev => ({ ...prev, [orderId]: null }));
+        try {
+            const response = await fetch(`${API_URL}/api/profile/orders/${orderId}/`, { credentials: 'include' });
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            const data = await response.json();
+            setOrderItems(prev => ({ ...prev, [orderId]: JSON.parse(data.items) }));
+        } catch (error) {
+            console.error('Failed to load order', error);
+            setOrderItems(prev => ({ ...prev, [orderId]: [] }));
+        }
+    };
+
     const handleLogout = async () => {
         await logout();
         navigate('/');
@@ -129,11 +170,11 @@ const ProfilePage: React.FC = () => {
                                 <p>У вас пока нет заказов</p>
                             </div>
                         ) : (
-                            orders.map((order, index) => (
+                            orders.map((order) => (
                                 <div key={order.id} className="border border-gray-100 rounded-2xl p-6 hover:shadow-md transition-shadow">
                                     <div className="flex flex-col md:flex-row justify-between md:items-center gap-4 mb-4">
                                         <div className="flex items-center gap-3">
-                                            <span className="font-bold text-lg">Заказ #{orders.length - index}</span>
+                                            <span className="font-bold text-lg">Заказ #{order.id}</span>
                                             <span className={`px-3 py-1 rounded-full text-xs font-bold ${getStatusColor(order.status)}`}>
                                                 {getStatusLabel(order.status)}
                                             </span>
@@ -145,18 +186,22 @@ const ProfilePage: React.FC = () => {
                                     </div>
 
                                     <div className="space-y-2 mb-4">
-                                        {(() => {
-                                            try {
-                                                const items: OrderItem[] = JSON.parse(order.items);
-                                                return items.map((item, idx) => (
-                                                    <div key={idx} className="flex justify-between text-sm text-gray-600 border-b border-gray-50 last:border-0 py-1">
-                                                        <span>{item.title} <span className="text-gray-400">x{item.quantity}</span></span>
-                                                        <span className="font-medium">{item.price * item.quantity} ₽</span>
-                                                    </div>
-                                                ));
-                                            } catch (e) {
-                                                return <p className="text-sm text-red-400">Ошибка отображения состава</p>;
-                                            }
+                                        <button
+                                            onClick={() => toggleOrderItems(order.id)}
+                                            className="text-sm font-medium text-dacha-green hover:underline"
+                                        >
+                                            {order.id in orderItems ? 'Скрыть состав' : 'Показать состав'}
+                                        </button>
+                                        {order.id in orderItems && (() => {
+                                            const items = orderItems[order.id];
+                                            if (items === null) return <p className="text-sm text-gray-400">Загрузка...</p>;
+                                            if (items.length === 0) return <p className="text-sm text-red-400">Ошибка отображения состава</p>;
+                                            return items.map((item, idx) => (
+                                                <div key={idx} className="flex justify-between text-sm text-gray-600 border-b border-gray-50 last:border-0 py-1">
+                                                    <span>{item.title} <span className="text-gray-400">x{item.quantity}</span></span>
+                                                    <span className="font-medium">{item.price * item.quantity} ₽</span>
+                                                </div>
+                                            ));
                                         })()}
                                     </div>
 
@@ -171,6 +216,13 @@ const ProfilePage: React.FC = () => {
                                 </div>
                             ))
                         )}
+                        {nextCursor && (
+                            <div className="text-center pt-6">
+                                <Button variant="outline" onClick={loadMoreOrders} disabled={loadingMore}>
+                                    {loadingMore ? 'Загрузка...' : 'Показать еще'}
+                                </Button>
+                            </div>
+                        )}
                     </div>
                 </div>
             </div>
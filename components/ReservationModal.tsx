@@ -1,7 +1,7 @@
-import React, { useState } from 'react';
+import React, { useState, useRef, useEffect } from 'react';
 import { X, Calendar, Clock, User, Phone, Loader2, CheckCircle } from 'lucide-react';
 import Button from './Button';
-import { API_URL } from '../config';
+import { API_URL, idempotencyKeyFor, IdempotencyKey } from '../config';
 
 interface ReservationModalProps {
     isOpen: boolean;
@@ -18,8 +18,44 @@ const ReservationModal: React.FC<ReservationModalProps> = ({ isOpen, onClose })
         comment: ''
     });
     const [isSubmitting, setIsSubmitting] = useState(false);
+    // One key per reservation, kept across retries of the same form until it goes through
+    const idempotencyKey = useRef<IdempotencyKey>(null);
     const [isSuccess, setIsSuccess] = useState(false);
     const [error, setError] = useState('');
+    // Free times for the chosen date and party size (/api/reservations/availability/)
+    const [times, setTimes] = useState<string[] | null>(null);
+    const [byPhone, setByPhone] = useState(false);
+    const [availabilityVersion, setAvailabilityVersion] = useState(0);
+
+    useEffect(() => {
+        if (!isOpen || !formData.date) {
+            setTimes(null);
+            setByPhone(false);
+            return;
+        }
+        let cancelled = false;
+        setTimes(null);
+        const params = new URLSearchParams({ date: formData.date, guests: formData.guests });
+        fetch(`${API_URL}/api/reservations/availability/?${params}`, { credentials: 'include' })
+            .then(async response => {
+                const data = await response.json();
+                if (cancelled) return;
+                if (!response.ok) {
+                    setTimes([]);
+                    setError(data.error || 'Не удалось загрузить свободное время');
+                    return;
+                }
+                setError('');
+                setTimes(data.times);
+                setByPhone(data.by_phone);
+                // Drop a time that is no longer free
+                setFormData(prev => data.times.includes(prev.time) ? prev : { ...prev, time: '' });
+            })
+            .catch(() => {
+                if (!cancelled) setTimes([]);
+            });
+        return () => { cancelled = true; };
+    }, [isOpen, formData.date, formData.guests, availabilityVersion]);
 
     if (!isOpen) return null;
 
@@ -64,19 +100,29 @@ const ReservationModal: React.FC<ReservationModalProps> = ({ isOpen, onClose })
             };
 
             const csrftoken = getCookie('csrftoken');
+            const body = JSON.stringify(formData);
+            idempotencyKey.current = idempotencyKeyFor(idempotencyKey.current, body);
 
             const response = await fetch(`${API_URL}/api/reservations/`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                     'X-CSRFToken': csrftoken || '',
+                    'Idempotency-Key': idempotencyKey.current.key,
                 },
                 credentials: 'include',
-                body: JSON.stringify(formData),
+                body,
             });
 
             if (response.ok) {
+                idempotencyKey.current = null;
                 setIsSuccess(true);
+            } else if (response.status === 409 || response.status === 400) {
+                // Taken meanwhile or not bookable: show why and refresh the free times
+                const data = await response.json().catch(() => ({}));
+                idempotencyKey.current = null;
+                setError(data.error || 'Выбранное время недоступно');
+                setAvailabilityVersion(v => v + 1);
             } else {
                 setError('Ошибка при отправке. Попробуйте позже.');
             }
@@ -184,14 +230,21 @@ const ReservationModal: React.FC<ReservationModalProps> = ({ isOpen, onClose })
                             <label className="text-sm font-medium text-gray-700 flex items-center gap-2">
                                 <Clock size={16} /> Время
                             </label>
-                            <input
-                                type="time"
+                            <select
                                 name="time"
                                 required
-                                className="w-full px-4 py-2 border border-gray-200 rounded-lg focus:ring-2 focus:ring-brand-green focus:border-transparent outline-none transition-all"
+                                disabled={!times || times.length === 0}
+                                className="w-full px-4 py-2 border border-gray-200 rounded-lg focus:ring-2 focus:ring-brand-green focus:border-transparent outline-none transition-all disabled:bg-gray-50"
                                 value={formData.time}
                                 onChange={handleChange}
-                            />
+                            >
+                                <option value="">
+                                    {!formData.date ? 'Выберите дату' : times === null ? 'Загрузка...' : times.length === 0 ? 'Нет мест' : '--:--'}
+                                </option>
+                                {(times || []).map(t => (
+                                    <option key={t} value={t}>{t}</option>
+                                ))}
+                            </select>
                         </div>
                     </div>
 
@@ -221,6 +274,18 @@ const ReservationModal: React.FC<ReservationModalProps> = ({ isOpen, onClose })
                         />
                     </div>
 
+                    {formData.date && times !== null && times.length === 0 && !error && (
+                        <div className="bg-yellow-50 text-yellow-700 p-3 rounded-lg text-sm font-medium">
+                            На эту дату нет свободных столов для {formData.guests} гостей, выберите другой день
+                        </div>
+                    )}
+
+                    {byPhone && (
+                        <p className="text-sm text-gray-500">
+                            Для большой компании столы подберет менеджер: он перезвонит после заявки
+                        </p>
+                    )}
+
                     {error && (
                         <div className="bg-red-50 text-red-500 p-3 rounded-lg text-sm font-medium">
                             {error}
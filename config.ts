@@ -9,3 +9,18 @@ export const getImageUrl = (path: string | null | undefined): string => {
     if (path.startsWith('http')) return path;
     return `${API_URL}${path}`;
 };
+
+// Sent as Idempotency-Key: reuse the same key when retrying one submission,
+// the server then answers with the first result instead of creating a duplicate
+export const newIdempotencyKey = (): string => {
+    if (typeof crypto !== 'undefined' && 'randomUUID' in crypto) return crypto.randomUUID();
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+};
+
+// The key goes with the body it was minted for: a retry of the same body reuses
+// it, an edited one gets a new key (the server answers 422 to a key reused with
+// another body, even when the first request was accepted but the reply got lost)
+export type IdempotencyKey = { key: string; body: string } | null;
+
+export const idempotencyKeyFor = (previous: IdempotencyKey, body: string): { key: string; body: string } =>
+    previous && previous.body === body ? previous : { key: newIdempotencyKey(), body };